@@ -0,0 +1,50 @@
+"""Benchmark of altsplice_test in worker processes against the serial test.
+
+Synthetic transcriptome with genes with skipped exons on several chromosomes, and random coverage of two sample groups.
+
+Usage: python benchmarks/bench_altsplice_test.py [processes] [n_genes_per_chromosome] [n_chromosomes]"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from intervaltree import Interval, IntervalTree
+
+from isotools.transcriptome import Transcriptome
+
+
+def synthetic_transcriptome(n_genes, n_chromosomes, n_samples=10, seed=0):
+    rng = np.random.default_rng(seed)
+    t = Transcriptome(data={}, infos={"reference_file": "synthetic", "sample_table": pd.DataFrame({"name": [f"s{i}" for i in range(n_samples)]})})
+    for c in range(n_chromosomes):
+        novel = IntervalTree()
+        for start in range(0, 10000 * n_genes, 10000):
+            exons = [[start + 300 * i, start + 300 * i + 100] for i in range(12)]
+            for _ in range(8):
+                keep = [0] + [i for i in range(1, 11) if rng.random() < 0.8] + [11]
+                novel.add(Interval(start, exons[-1][1], {"exons": [exons[i] for i in keep], "strand": "+"}))
+        t._add_novel_genes(novel, f"chr{c + 1}")
+    for g in t:
+        g.data["coverage"] = rng.poisson(rng.gamma(5, 4, (n_samples, g.n_transcripts)))
+    return t
+
+
+def main(processes=4, n_genes=500, n_chromosomes=8):
+    t = synthetic_transcriptome(n_genes, n_chromosomes)
+    groups = {"A": [f"s{i}" for i in range(5)], "B": [f"s{i}" for i in range(5, 10)]}
+    print(f"{t.n_genes} genes on {n_chromosomes} chromosomes")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        t_start = time.perf_counter()
+        expected = t.altsplice_test(groups, min_total=10, min_n=2)
+        t_serial = time.perf_counter() - t_start
+        t_start = time.perf_counter()
+        result = t.altsplice_test(groups, min_total=10, min_n=2, processes=processes)
+        t_parallel = time.perf_counter() - t_start
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"{len(result)} events, serial {t_serial:6.2f}s, {processes} processes {t_parallel:6.2f}s")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
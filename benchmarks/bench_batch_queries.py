@@ -0,0 +1,67 @@
+"""Benchmark of the batch variants of the SegmentGraph queries against the queries of individual transcripts.
+
+Synthetic reference gene with many exons and isoforms, and novel transcripts derived from the isoforms (exon skipping,
+shifted splice sites, truncations). The caches of the graph are reset before each run.
+
+Usage: python benchmarks/bench_batch_queries.py [n_transcripts] [n_exons]"""
+import random
+import sys
+import time
+
+from isotools.splice_graph import SegmentGraph
+
+
+def synthetic_gene(n_exons, n_isoforms=50, seed=0):
+    rng = random.Random(seed)
+    pos = 0
+    exons = []
+    for _ in range(n_exons):
+        pos += rng.randint(100, 3000)
+        length = rng.randint(50, 300)
+        exons.append((pos, pos + length))
+        pos += length
+    return [[e for e in exons if rng.random() < 0.9] for _ in range(n_isoforms)]
+
+
+def novel_transcripts(isoforms, n, seed=1):
+    rng = random.Random(seed)
+    transcripts = []
+    for _ in range(n):
+        tr = [list(e) for e in rng.choice(isoforms)]
+        if rng.random() < 0.3:
+            del tr[rng.randrange(1, len(tr) - 1)]
+        if rng.random() < 0.2:
+            tr[rng.randrange(len(tr) - 1)][1] += rng.choice([-7, 4])
+        k = rng.randrange(len(tr) // 2)
+        tr = tr[k : len(tr) - rng.randrange(len(tr) // 2)]
+        tr[0][0] += rng.randint(-20, 20)
+        tr[-1][1] += rng.randint(-20, 20)
+        transcripts.append(tr)
+    return transcripts
+
+
+def main(n_transcripts=2000, n_exons=200):
+    isoforms = synthetic_gene(n_exons)
+    transcripts = novel_transcripts(isoforms, n_transcripts)
+    print(f"{n_transcripts} transcripts, reference with {len(isoforms)} isoforms of up to {n_exons} exons")
+    queries = {
+        "get_alternative_splicing": (lambda sg, tr: sg.get_alternative_splicing(tr), lambda sg, trs: sg.get_alternative_splicing_batch(trs)),
+        "find_splice_sites": (lambda sg, tr: sg.find_splice_sites(tr).tolist(), lambda sg, trs: [s.tolist() for s in sg.find_splice_sites_batch(trs)]),
+        "get_overlap": (lambda sg, tr: sg.get_overlap(tr), lambda sg, trs: sg.get_overlap_batch(trs)),
+        "fuzzy_junction": (lambda sg, tr: sg.fuzzy_junction(tr, 5), lambda sg, trs: sg.fuzzy_junction_batch(trs, 5)),
+    }
+    for name, (single, batch) in queries.items():
+        sg = SegmentGraph(isoforms, "+")
+        t = time.perf_counter()
+        expected = [single(sg, tr) for tr in transcripts]
+        t_single = time.perf_counter() - t
+        sg = SegmentGraph(isoforms, "+")
+        t = time.perf_counter()
+        result = batch(sg, transcripts)
+        t_batch = time.perf_counter() - t
+        assert result == expected, f"{name}: batch and single queries report different results"
+        print(f"{name:25s} single {t_single:6.2f}s, batch {t_batch:6.2f}s")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""Benchmark of the batch betabinomial likelihood ratio test (used by altsplice_test) against the test of individual events.
+
+Synthetic events with two groups of samples, varying overdispersion and group differences, and some uncovered samples.
+
+Usage: python benchmarks/bench_betabinom.py [n_events] [n_samples]"""
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from isotools._transcriptome_stats import betabinom_lr_test, betabinom_lr_test_batch
+
+
+def random_events(n_events, n_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    n = [rng.integers(0, 100, (n_events, n_samples)) * (rng.random((n_events, n_samples)) < 0.9) for _ in range(2)]
+    p = rng.beta(2, 3, n_events)
+    sd = rng.choice([0, 0.05, 0.2], (n_events, 1))
+    shift = rng.choice([0, 0.2], (n_events, 1))
+    x = [rng.binomial(ni, np.clip(p[:, None] + rng.normal(0, sd, ni.shape) + shift * i, 0, 1)) for i, ni in enumerate(n)]
+    return x, n
+
+
+def main(n_events=5000, n_samples=4):
+    x, n = random_events(n_events, n_samples)
+    print(f"{n_events} events, {n_samples} samples per group")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        t = time.perf_counter()
+        expected = [betabinom_lr_test([xi[i] for xi in x], [ni[i] for ni in n]) for i in range(n_events)]
+        t_single = time.perf_counter() - t
+        t = time.perf_counter()
+        pvals, params = betabinom_lr_test_batch(x, n)
+        t_batch = time.perf_counter() - t
+    # compare where the dispersion is well determined, otherwise the likelihood is flat and the individual fits stop early
+    determined = [all(d is not None and d > 1e-3 for d in p[1::2]) for _, p in expected]
+    diff = max(abs(p - e[0]) for p, e, det in zip(pvals, expected, determined) if det)
+    assert diff < 1e-3, f"batch and individual tests report different p-values (max difference {diff})"
+    print(f"individual tests {t_single:6.2f}s, batch {t_batch:6.2f}s (max p-value difference {diff:.1e})")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,35 @@
+"""Micro-benchmark of the vectorized CIGAR parser against the scalar parser.
+
+Usage: python benchmarks/bench_cigar.py [n_alignments]"""
+import random
+import sys
+import time
+
+from isotools._utils import junctions_from_cigar, junctions_from_cigar_batch
+
+
+def random_cigar(rng):
+    cigar = [(4, rng.randint(0, 20)), (0, rng.randint(50, 500))]
+    for _ in range(rng.randint(0, 15)):
+        cigar.extend([(3, rng.randint(100, 10000)), (0, rng.randint(50, 500))])
+        if rng.random() < 0.3:
+            cigar.extend([(rng.choice((1, 2)), rng.randint(1, 5)), (0, rng.randint(1, 100))])
+    return cigar
+
+
+def main(n=200000):
+    rng = random.Random(0)
+    cigars = [random_cigar(rng) for _ in range(n)]
+    offsets = [rng.randint(0, 10 ** 8) for _ in cigars]
+    t = time.perf_counter()
+    scalar = [junctions_from_cigar(c, o) for c, o in zip(cigars, offsets)]
+    t_scalar = time.perf_counter() - t
+    t = time.perf_counter()
+    starts, ends, exon_idx = junctions_from_cigar_batch(cigars, offsets)
+    t_batch = time.perf_counter() - t
+    assert exon_idx[-1] == sum(len(exons) for exons in scalar)
+    print(f"{n} alignments: scalar {t_scalar:.2f}s, batch {t_batch:.2f}s ({t_scalar / t_batch:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
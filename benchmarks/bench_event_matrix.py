@@ -0,0 +1,37 @@
+"""Benchmark of several altsplice_test comparisons on one EventMatrix against determining the events for each comparison.
+
+Synthetic transcriptome of bench_altsplice_test.py, with comparisons of different groups of samples.
+
+Usage: python benchmarks/bench_event_matrix.py [n_comparisons] [n_genes_per_chromosome] [n_chromosomes]"""
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+from bench_altsplice_test import synthetic_transcriptome
+
+
+def main(n_comparisons=5, n_genes=500, n_chromosomes=8):
+    t = synthetic_transcriptome(n_genes, n_chromosomes)
+    samples = [f"s{i}" for i in range(10)]
+    # rotate the samples to get different groups for each comparison
+    comparisons = [{"A": (samples[i:] + samples[:i])[:5], "B": (samples[i:] + samples[:i])[5:]} for i in range(n_comparisons)]
+    print(f"{t.n_genes} genes on {n_chromosomes} chromosomes, {n_comparisons} comparisons")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        t_start = time.perf_counter()
+        expected = [t.altsplice_test(groups, min_total=10, min_n=2) for groups in comparisons]
+        t_genes = time.perf_counter() - t_start
+        t_start = time.perf_counter()
+        em = t.event_matrix()
+        t_matrix = time.perf_counter() - t_start
+        results = [t.altsplice_test(groups, min_total=10, min_n=2, event_matrix=em) for groups in comparisons]
+        t_tests = time.perf_counter() - t_start
+    for result, exp in zip(results, expected):
+        pd.testing.assert_frame_equal(result, exp)
+    print(f"{len(em)} events, from the genes {t_genes:6.2f}s, from one event matrix {t_tests:6.2f}s (building the matrix {t_matrix:6.2f}s)")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
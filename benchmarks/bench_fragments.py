@@ -0,0 +1,74 @@
+"""Benchmark of SegmentGraph.find_fragments on a gene with thousands of LRTS isoforms.
+
+Synthetic gene with 60 exons: full length isoforms skipping exons, and fragments thereof (truncated at both ends).
+With "compare", the previous implementation, which compares all pairs of transcripts in the node matrix, is timed as well,
+and the results are checked to be identical.
+
+Usage: python benchmarks/bench_fragments.py [n_isoforms] [compare]"""
+import random
+import sys
+import time
+
+from isotools.splice_graph import SegmentGraph
+
+
+def synthetic_gene(n_isoforms, n_exons=60, seed=0):
+    rng = random.Random(seed)
+    pos = 0
+    exons = []
+    for _ in range(n_exons):
+        pos += rng.randint(100, 3000)
+        length = rng.randint(50, 300)
+        exons.append((pos, pos + length))
+        pos += length
+    transcripts = []
+    for _ in range(n_isoforms):
+        tr = [e for e in exons if rng.random() < 0.97]
+        if rng.random() < 0.6:  # fragment
+            i = rng.randrange(len(tr))
+            tr = [list(e) for e in tr[i : rng.randint(i + 1, len(tr))]]
+            tr[0][0] = rng.randint(tr[0][0], tr[0][1] - 1)
+            tr[-1][1] = rng.randint(tr[-1][0] + 1, tr[-1][1])
+        transcripts.append(tr)
+    return transcripts
+
+
+def find_fragments_pairwise(sg):
+    "the previous implementation"
+    truncated = set()
+    contains = {}
+    nodes = sg.get_node_matrix()
+    for trid, (tss, pas) in enumerate(zip(sg._tss, sg._pas)):
+        if trid in truncated:
+            continue
+        contains[trid] = {
+            trid2
+            for trid2, (tss2, pas2) in enumerate(zip(sg._tss, sg._pas))
+            if trid2 != trid and tss2 >= tss and pas2 <= pas and all(nodes[trid2, tss2 : pas2 + 1] == nodes[trid, tss2 : pas2 + 1])
+        }
+        truncated.update(contains[trid])
+    fragments = {}
+    for big, small in contains.items():
+        if big not in truncated:
+            for trid in sorted(small):
+                delta1 = sg._count_introns(big, sg._tss[big], sg._tss[trid])
+                delta2 = sg._count_introns(big, sg._pas[trid], sg._pas[big])
+                fragments.setdefault(trid, []).append((big, delta1, delta2) if sg.strand == "+" else (big, delta2, delta1))
+    return fragments
+
+
+def main(n_isoforms=3000, compare=None):
+    sg = SegmentGraph(synthetic_gene(n_isoforms), "+")
+    print(f"{len(sg)} segments, {n_isoforms} transcripts")
+    t = time.perf_counter()
+    fragments = sg.find_fragments()
+    print(f"find_fragments: {time.perf_counter() - t:6.2f}s, {len(fragments)} fragments")
+    if compare == "compare":
+        t = time.perf_counter()
+        expected = find_fragments_pairwise(sg)
+        print(f"pairwise:       {time.perf_counter() - t:6.2f}s")
+        assert fragments == expected, "implementations report different results"
+
+
+if __name__ == "__main__":
+    main(*[int(a) if a.isdigit() else a for a in sys.argv[1:]])
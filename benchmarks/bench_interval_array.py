@@ -0,0 +1,102 @@
+"""Benchmark of IntervalArray against the previous flat bin implementation and intervaltree.IntervalTree.
+
+Mimics the use in the import: for each new interval, the overlapping intervals are requested before it is added.
+Time includes the lookups, memory is the peak allocation for adding all intervals (measured separately).
+
+Usage: python benchmarks/bench_interval_array.py [n_sparse] [n_dense]"""
+import random
+import sys
+import time
+import tracemalloc
+
+from intervaltree import Interval, IntervalTree
+
+from isotools._transcriptome_io import IntervalArray
+from isotools._utils import overlap
+
+
+class FlatIntervalArray:
+    "the previous implementation: one set of interval indices per bin of fixed size, allocated for the whole chromosome"
+
+    def __init__(self, total_size, bin_size=1e4):
+        self.obj = []
+        self.data = [set() for _ in range(int(total_size // bin_size) + 1)]
+        self.bin_size = bin_size
+
+    def overlap(self, begin, end):
+        candidates = {
+            i
+            for idx in range(int(begin // self.bin_size), int(end // self.bin_size) + 1)
+            for i in self.data[idx]
+        }
+        return (self.obj[i] for i in sorted(candidates) if overlap((begin, end), self.obj[i]))
+
+    def add(self, obj):
+        for idx in range(int(obj.begin // self.bin_size), int(obj.end // self.bin_size) + 1):
+            self.data[idx].add(len(self.obj))
+        self.obj.append(obj)
+
+
+class Tree:
+    "IntervalTree, with the same interface and result order as IntervalArray"
+
+    def __init__(self, total_size):
+        self.tree = IntervalTree()
+        self.order = {}
+
+    def add(self, obj):
+        self.order[id(obj)] = len(self.order)
+        self.tree.add(obj)
+
+    def overlap(self, begin, end):
+        # IntervalArray reports intervals that touch the query (closed intervals)
+        return sorted(self.tree.overlap(begin - 1, end + 1), key=lambda obj: self.order[id(obj)])
+
+
+CHR_LEN = 250_000_000
+
+
+def workload(rng, n, dense):
+    "random intervals of transcript size, with some long ones; dense intervals are within a 200kb locus"
+    intervals = []
+    for i in range(n):
+        start = rng.randint(1_000_000, 1_200_000) if dense else rng.randint(0, CHR_LEN - 3_000_000)
+        length = rng.choice([500, 1500, 3000, 20000, 2_000_000]) if i % 50 == 0 else rng.randint(300, 3000)
+        intervals.append(Interval(start, start + length, i))
+    return intervals
+
+
+def run(cls, intervals):
+    t = time.perf_counter()
+    array = cls(CHR_LEN)
+    hits = 0
+    for iv in intervals:
+        hits += sum(1 for _ in array.overlap(iv.begin, iv.end))
+        array.add(iv)
+    runtime = time.perf_counter() - t
+    del array
+    tracemalloc.start()
+    array = cls(CHR_LEN)
+    for iv in intervals:
+        array.add(iv)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return runtime, peak, hits
+
+
+def main(n_sparse=100000, n_dense=15000):
+    rng = random.Random(0)
+    for name, intervals in (
+        ("sparse", workload(rng, n_sparse, False)),
+        ("dense locus", workload(rng, n_dense, True)),
+    ):
+        hits = set()
+        for cls in (FlatIntervalArray, IntervalArray, Tree):
+            runtime, peak, n_hits = run(cls, intervals)
+            hits.add(n_hits)
+            print(f"{name:12s} {cls.__name__:18s} {runtime:7.2f}s peak {peak:8.1f} MB, {n_hits} overlaps")
+        assert len(hits) == 1, "implementations report different overlaps"
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
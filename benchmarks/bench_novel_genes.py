@@ -0,0 +1,74 @@
+"""Benchmark of the clustering of novel transcripts to genes (Transcriptome._add_novel_genes).
+
+Synthetic novel transcripts: half are unspliced reads in three large intergenic clusters, the others spliced transcripts spread over
+the chromosome. With "compare", the grouping by merging sets of transcripts of previous versions is timed as well,
+and the genes are checked to be identical.
+
+Usage: python benchmarks/bench_novel_genes.py [n_transcripts] [compare]"""
+import random
+import sys
+import time
+
+from intervaltree import Interval
+
+from isotools.transcriptome import Transcriptome
+from isotools._transcriptome_io import IntervalArray
+from isotools._utils import is_same_gene
+
+CHR_LEN = 50_000_000
+
+
+def synthetic_novel(n, seed=0):
+    rng = random.Random(seed)
+    novel = IntervalArray(CHR_LEN)
+    for i in range(n):
+        if i % 2:
+            start = rng.randint(0, 2) * 2_000_000 + rng.randint(0, 200_000)
+            exons = [[start, start + rng.randint(300, 3000)]]
+        else:
+            start = rng.randint(0, CHR_LEN - 20_000)
+            end1 = start + rng.randint(100, 500)
+            start2 = end1 + rng.randint(500, 5000)
+            exons = [[start, end1], [start2, start2 + rng.randint(100, 500)]]
+        novel.add(Interval(exons[0][0], exons[-1][1], {"exons": exons, "strand": rng.choice("+-")}))
+    return novel
+
+
+def merge_sets(novel, spj_iou_th=0, reg_iou_th=0.5):
+    "the grouping of previous versions, by merging sets of transcripts"
+    idx = {id(tr): i for i, tr in enumerate(novel)}
+    merge = list()
+    for i, tr in enumerate(novel):
+        merge.append({tr})
+        candidates = [
+            c
+            for c in novel.overlap(tr.begin, tr.end)
+            if c.data["strand"] == tr.data["strand"] and idx[id(c)] < i
+        ]
+        for c in candidates:
+            if c in merge[i]:
+                continue
+            if is_same_gene(tr.data["exons"], c.data["exons"], spj_iou_th, reg_iou_th):
+                merge[i].update(merge[idx[id(c)]])
+        for c in merge[i]:
+            merge[idx[id(c)]] = merge[i]
+    return {frozenset(id(tr.data) for tr in trS) for trS in merge}
+
+
+def main(n=100000, compare=None):
+    novel = synthetic_novel(n)
+    t = Transcriptome(data={}, infos={"reference_file": "synthetic"})
+    start = time.perf_counter()
+    t._add_novel_genes(novel, "chr1")
+    runtime = time.perf_counter() - start
+    genes = {frozenset(id(tr) for tr in g.transcripts) for g in t.data["chr1"]}
+    print(f"{n} novel transcripts: {runtime:.1f}s, {len(genes)} genes")
+    if compare:
+        start = time.perf_counter()
+        expected = merge_sets(novel)
+        print(f"merging sets (previous versions): {time.perf_counter() - start:.1f}s, {len(expected)} genes")
+        assert genes == expected, "different genes"
+
+
+if __name__ == "__main__":
+    main(*[int(a) if a.isdigit() else a for a in sys.argv[1:]])
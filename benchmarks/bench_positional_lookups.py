@@ -0,0 +1,60 @@
+"""Benchmark of the binary search positional lookups of the SegmentGraph against scans over all segments.
+
+Synthetic reference gene with many exons and isoforms, queried at random positions and regions.
+
+Usage: python benchmarks/bench_positional_lookups.py [n_queries] [n_exons]"""
+import random
+import sys
+import time
+
+from isotools.splice_graph import SegmentGraph
+
+
+def synthetic_gene(n_exons, n_isoforms=50, seed=0):
+    rng = random.Random(seed)
+    pos = 0
+    exons = []
+    for _ in range(n_exons):
+        pos += rng.randint(100, 3000)
+        length = rng.randint(50, 300)
+        exons.append((pos, pos + length))
+        pos += length
+    return [[e for e in exons if rng.random() < 0.9] for _ in range(n_isoforms)]
+
+
+def is_exonic_scan(sg, position):
+    for n in sg:
+        if n[0] <= position and n[1] >= position:
+            return True
+    return False
+
+
+def segments_in_scan(sg, start, end):
+    j1 = next((j for j, n in enumerate(sg) if n.end > start), len(sg))
+    j2 = next((j for j in range(j1, len(sg)) if sg[j].start >= end), len(sg))
+    return range(j1, j2)
+
+
+def main(n_queries=20000, n_exons=200):
+    sg = SegmentGraph(synthetic_gene(n_exons), "+")
+    rng = random.Random(1)
+    positions = [rng.randrange(sg[0].start - 1000, sg[-1].end + 1000) for _ in range(n_queries)]
+    regions = [(pos, pos + rng.randint(1, 5000)) for pos in positions]
+    print(f"{n_queries} queries, segment graph with {len(sg)} segments")
+    queries = {
+        "is_exonic": (lambda: [is_exonic_scan(sg, pos) for pos in positions], lambda: [sg.is_exonic(pos) for pos in positions]),
+        "segments_in": (lambda: [segments_in_scan(sg, *r) for r in regions], lambda: [sg.segments_in(*r) for r in regions]),
+    }
+    for name, (scan, bisect) in queries.items():
+        t = time.perf_counter()
+        expected = scan()
+        t_scan = time.perf_counter() - t
+        t = time.perf_counter()
+        result = bisect()
+        t_bisect = time.perf_counter() - t
+        assert result == expected, f"{name}: binary search and scan report different results"
+        print(f"{name:15s} scan {t_scan:6.2f}s, binary search {t_bisect:6.2f}s")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,64 @@
+"""Benchmark of SegmentGraph.search_transcript, which looks up multi exon transcripts in an intron chain index.
+
+Synthetic gene of TTN size (about 360 exons and some hundred isoforms skipping exons). The full splice matches and
+partial matches (exons removed at the ends) of all isoforms are searched, and compared to the previous implementation,
+which intersects the sets of transcripts while walking the segments of the graph.
+
+Usage: python benchmarks/bench_search_transcript.py [n_exons] [n_isoforms]"""
+import random
+import sys
+import time
+
+from isotools.splice_graph import SegmentGraph
+
+
+def synthetic_gene(n_exons, n_isoforms, seed=0):
+    rng = random.Random(seed)
+    pos = 0
+    exons = []
+    for _ in range(n_exons):
+        pos += rng.randint(100, 3000)
+        length = rng.randint(50, 300)
+        exons.append((pos, pos + length))
+        pos += length
+    return [[e for e in exons if rng.random() < 0.95] for _ in range(n_isoforms)]
+
+
+def search_transcript_walk(sg, exons):
+    "the previous implementation for multi exon transcripts"
+    if exons[0][1] <= sg[0].start or exons[-1][0] >= sg[-1].end:
+        return []
+    tr = set(range(len(sg._tss)))
+    j = 0
+    for i, e in enumerate(exons[:-1]):
+        while j < len(sg) and sg[j].end < e[1]:
+            tr -= set(trid for trid, j2 in sg[j].suc.items() if sg[j].end != sg[j2].start)
+            j += 1
+        if sg[j].end != e[1]:
+            return []
+        tr &= set(trid for trid, j2 in sg[j].suc.items() if sg[j2].start == exons[i + 1][0])
+        j += 1
+        if len(tr) == 0:
+            return []
+    while j < len(sg):
+        tr -= set(trid for trid, j2 in sg[j].suc.items() if sg[j].end != sg[j2].start)
+        j += 1
+    return sorted(tr)
+
+
+def main(n_exons=360, n_isoforms=300):
+    transcripts = synthetic_gene(n_exons, n_isoforms)
+    sg = SegmentGraph(transcripts, "+")
+    queries = transcripts + [tr[5:-5] for tr in transcripts]
+    print(f"{len(sg)} segments, {len(transcripts)} transcripts, {len(queries)} queries")
+    t = time.perf_counter()
+    walk = [search_transcript_walk(sg, q) for q in queries]
+    print(f"segment walk:       {time.perf_counter() - t:6.2f}s")
+    t = time.perf_counter()
+    index = [sg.search_transcript(q) for q in queries]
+    print(f"intron chain index: {time.perf_counter() - t:6.2f}s (including building the index)")
+    assert walk == index, "implementations report different results"
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,84 @@
+"""Benchmark of the numpy array based ArraySegmentGraph against the dict based SegmentGraph.
+
+Synthetic gene set of GENCODE size (about 62k genes and 250k transcripts), with a heavy tail of genes with hundreds of isoforms.
+Memory is the allocation of the graphs of all genes (measured with tracemalloc), after construction and after all nodes
+have been accessed, as well as the size of the pickled graphs. Time is measured for construction,
+find_splice_bubbles and get_alternative_splicing of (up to 20) transcripts of each gene.
+
+Usage: python benchmarks/bench_segment_graph.py [n_genes]"""
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+
+from isotools.splice_graph import ArraySegmentGraph, SegmentGraph
+
+
+def synthetic_gene(rng):
+    "transcripts of a gene, combining a subset of the exons, with alternative splice sites"
+    n_isoforms = min(int(rng.paretovariate(1.2)), 800)
+    n_exons = rng.randint(2, 40 if n_isoforms > 50 else 15)
+    pos = 0
+    exons = []
+    for _ in range(n_exons):
+        pos += rng.randint(200, 5000)
+        length = rng.randint(50, 300)
+        exons.append((pos, pos + length))
+        pos += length
+    transcripts = []
+    for _ in range(n_isoforms):
+        used = [e for e in exons if rng.random() < 0.8] or exons[:1]
+        tr = []
+        for start, end in used:
+            if rng.random() < 0.1:
+                start += rng.randint(-20, 20)
+            if rng.random() < 0.1:
+                end += rng.randint(-20, 20)
+            tr.append((start, end))
+        transcripts.append(tr)
+    return transcripts, rng.choice("+-")
+
+
+def build(cls, genes):
+    tracemalloc.start()
+    t = time.perf_counter()
+    graphs = [cls(tr, strand) for tr, strand in genes]
+    runtime = time.perf_counter() - t
+    memory = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+    return graphs, runtime, memory
+
+
+def main(n_genes=62000):
+    rng = random.Random(0)
+    genes = [synthetic_gene(rng) for _ in range(n_genes)]
+    print(f"{n_genes} genes, {sum(len(tr) for tr, _ in genes)} transcripts, up to {max(len(tr) for tr, _ in genes)} per gene")
+    results = []
+    for cls in (SegmentGraph, ArraySegmentGraph):
+        graphs, t_build, mem = build(cls, genes)
+        pickled = sum(len(pickle.dumps(sg)) for sg in graphs) / 1e6
+        t = time.perf_counter()
+        bubbles = [list(sg.find_splice_bubbles()) for sg in graphs]
+        t_bubbles = time.perf_counter() - t
+        t = time.perf_counter()
+        altsplice = [[sg.get_alternative_splicing(tr) for tr in transcripts[:20]] for sg, (transcripts, _) in zip(graphs, genes)]
+        t_altsplice = time.perf_counter() - t
+        del graphs
+        tracemalloc.start()
+        graphs = [cls(tr, strand) for tr, strand in genes]
+        for sg in graphs:
+            sg[:]
+        mem_nodes = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        del graphs
+        print(
+            f"{cls.__name__:18s} construction {t_build:6.1f}s {mem:7.1f} MB, with all nodes {mem_nodes:7.1f} MB, "
+            f"pickled {pickled:7.1f} MB; find_splice_bubbles {t_bubbles:6.1f}s; get_alternative_splicing {t_altsplice:6.1f}s"
+        )
+        results.append((bubbles, altsplice))
+    assert results[0] == results[1], "implementations report different results"
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
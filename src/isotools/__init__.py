@@ -9,7 +9,8 @@ from ._transcriptome_filter import (
     DEFAULT_REF_TRANSCRIPT_FILTER,
     DEFAULT_TRANSCRIPT_FILTER,
 )
+from ._transcriptome_stats import EventMatrix
 from .gene import Gene
 from .logger import setup_logging
-from .splice_graph import SegGraphNode, SegmentGraph
+from .splice_graph import ArraySegmentGraph, SegGraphNode, SegmentGraph
 from .transcriptome import Transcriptome
@@ -376,7 +376,8 @@ def sashimi_plot(
     if ax is None:
         _, ax = plt.subplots(1)
 
-    for st, end, h in boxes:
+    for i in sg.segments_in(*x_range):
+        st, end, h = boxes[i]
         if h > 0:
             rect = patches.Rectangle(
                 (st, 0),
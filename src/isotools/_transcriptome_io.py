@@ -1,5 +1,15 @@
 import copy
+import heapq
+import itertools
+import os
+import pickle
+import re
+import tempfile
+from collections import OrderedDict
 from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
+from operator import itemgetter
 from pathlib import Path
 from typing import List, Dict, Optional
 
@@ -12,11 +22,11 @@ from tqdm import tqdm
 from .logger import isotools_logger as logger
 from ._utils import (
     cigar_string2tuples,
+    intron_chain,
     is_same_gene,
     junctions_from_cigar,
-    overlap,
+    junctions_from_cigar_batch,
     pairwise,
-    splice_identical,
 )
 from .decorators import deprecated, experimental
 from .gene import Gene
@@ -101,13 +111,8 @@ def remove_samples(self, sample_names: List[str]):
                 }
                 if not tr["coverage"]:
                     remove_tr.append(i)
-        if (
-            remove_tr
-        ):  # remove the transcripts that is not expressed by remaining samples
-            g.data["transcripts"] = [
-                tr for i, tr in enumerate(g.transcripts) if i not in remove_tr
-            ]
-        g.data["segment_graph"] = None  # gets recomputed on next request
+        if remove_tr:  # remove the transcripts that is not expressed by remaining samples
+            g.remove_transcripts(remove_tr)
         g.data["coverage"] = None
 
 
@@ -118,302 +123,1352 @@ def add_sample_from_bam(
     fuzzy_junction: int = 5,
     add_chromosomes: bool = True,
     chimeric_mincov: int = 2,
+    chimeric_buffer: Optional[int] = None,
     use_satag: bool = False,
+    clipping: bool = False,
+    processes: int = 1,
+    threads: int = 1,
+    stream: bool = False,
+    stream_buffer: Optional[int] = None,
+    collapsed_file: Optional[Path] = None,
     **kwargs,
 ):
     """Imports expressed transcripts from bam and adds it to the 'Transcriptome' object.
 
-    :param fn: The bam filename of the new sample
+    :param fn: The bam filename of the new sample. With stream=True, this may also be a sam file, or "-" to read from stdin.
     :param sample_name: Name of the new sample
     :param fuzzy_junction: maximum size for fuzzy junction correction
     :param add_chromosomes: If True, genes from chromosomes which are not in the Transcriptome yet are added.
     :param chimeric_mincov: Minimum number of reads for a chimeric transcript to be considered
+    :param chimeric_buffer: If provided, at most this number of chimeric alignment parts are kept in memory,
+        by each chromosome that is collapsed and by the gene assignment. Further parts are written to temporary files while the reads
+        are collapsed, which are merged and grouped by read name after all reads have been collapsed,
+        such that memory consumption does not depend on the number of chimeric reads. As the reads are then processed in order of
+        their names, the aligned positions reported for a chimeric transcript may come from a different read.
     :param use_satag: If True, import secondary alignments (of chimeric alignments) from the SA tag.
         This should only be specified if the secondary alignment is not reported in a seperate bam entry.
-    :param kwargs: Additional keyword arugments are added to the sample table."""
+    :param clipping: If True, the clipped positions and lengths of the reads are stored for each transcript and sample,
+        in the "clipping" field of the transcripts.
+    :param processes: Number of worker processes for the import. If larger than 1, the reads of each chromosome are collapsed
+        in a separate process, with its own file handle. The assignment to genes is done in the main process, in the same order
+        as for the single process import, such that the results are identical.
+    :param threads: Number of threads for the decompression of each bam file (by htslib), in addition to the main thread.
+    :param stream: If True, the alignments are read once in the order of the file, which does not need to be sorted or indexed,
+        e.g. the output of the aligner can be piped directly. Transcripts are collapsed for each chromosome separately,
+        and assigned to genes when the whole file has been read. This mode does not support multiple processes.
+        For unsorted files, the result may differ from the import of the sorted file, as the reads and transcripts are processed
+        in a different order, which affects the grouping of overlapping mono-exon reads and the fuzzy junction correction.
+    :param stream_buffer: Maximum number of collapsed transcripts and chimeric read parts kept in memory by the streaming import.
+        If exceeded, the least recently used chromosomes are written to temporary files, and loaded again when they get more reads.
+        For files sorted or grouped by chromosome, this keeps about one chromosome in memory. For unsorted files, chromosomes are
+        written and loaded repeatedly if they do not fit in the buffer together. If None, all chromosomes are kept in memory.
+    :param collapsed_file: If provided, the collapsed reads are saved to this file (compressed numpy format, .npz),
+        such that the samples can be assigned to a different reference with :func:`add_samples_from_collapsed`,
+        without reading the alignments again.
+    :param kwargs: Additional keyword arugments are added to the sample table.
+    :return: Dict with the number of nonchimeric reads per chromosome.
+
+    .. seealso:: :func:`add_samples_from_bam` to import several samples from one bam file,
+        and :func:`add_samples_from_bams` to import several bam files at once."""
 
-    # todo: one alignment may contain several samples - this is not supported at the moment
     assert sample_name not in self.samples, (
         "sample %s is already in the data set." % sample_name
     )
     logger.info(f"adding sample {sample_name} from file {fn}")
-    kwargs["name"] = sample_name
-    kwargs["file"] = fn
+    nc_reads_chr, n_chimeric = self._import_bam(
+        {sample_name: fn},
+        [sample_name],
+        fuzzy_junction,
+        add_chromosomes,
+        chimeric_mincov,
+        use_satag,
+        processes,
+        clipping=clipping,
+        threads=threads,
+        chimeric_buffer=chimeric_buffer,
+        stream=stream,
+        stream_buffer=stream_buffer,
+        collapsed_file=collapsed_file,
+    )
+    self._add_sample_table_rows({sample_name: fn}, nc_reads_chr, n_chimeric, kwargs)
+    return nc_reads_chr[sample_name]
+
+
+def add_samples_from_bam(
+    self,
+    fn: Path,
+    sample_tag: str = "RG",
+    sample_names=None,
+    fuzzy_junction: int = 5,
+    add_chromosomes: bool = True,
+    chimeric_mincov: int = 2,
+    chimeric_buffer: Optional[int] = None,
+    use_satag: bool = False,
+    clipping: bool = False,
+    processes: int = 1,
+    threads: int = 1,
+    stream: bool = False,
+    stream_buffer: Optional[int] = None,
+    collapsed_file: Optional[Path] = None,
+    **kwargs,
+):
+    """Imports expressed transcripts of several samples from one bam file, in a single pass over the file.
+
+    The sample of each alignment is determined by the value of an alignment tag, e.g. the read group or a barcode.
+    Coverage, TSS/PAS and clipping information is stored by sample, while each distinct transcript is assigned to a gene
+    and annotated only once.
+
+    :param fn: The bam filename.
+    :param sample_tag: The alignment tag that identifies the sample, e.g. "RG" for the read group.
+    :param sample_names: Either a dict, mapping the tag values to sample names, or a list of tag values, which are also used
+        as sample names. Alignments with other tag values are ignored. If not specified, the read groups from the bam header
+        are used for the "RG" tag, and all tag values found in the file for other tags (or with stream=True).
+    :param fuzzy_junction: maximum size for fuzzy junction correction
+    :param add_chromosomes: If True, genes from chromosomes which are not in the Transcriptome yet are added.
+    :param chimeric_mincov: Minimum number of reads for a chimeric transcript to be considered
+    :param chimeric_buffer: Maximum number of chimeric alignment parts kept in memory, see :func:`add_sample_from_bam`.
+    :param use_satag: If True, import secondary alignments (of chimeric alignments) from the SA tag.
+        This should only be specified if the secondary alignment is not reported in a seperate bam entry.
+    :param clipping: If True, the clipping of the reads is stored, see :func:`add_sample_from_bam`.
+    :param processes: Number of worker processes for the import, see :func:`add_sample_from_bam`.
+    :param threads: Number of threads for the decompression of each bam file, see :func:`add_sample_from_bam`.
+    :param stream: If True, read the alignments once in the order of the file, see :func:`add_sample_from_bam`.
+    :param stream_buffer: Maximum number of records kept in memory by the streaming import, see :func:`add_sample_from_bam`.
+    :param collapsed_file: If provided, the collapsed reads are saved to this file, see :func:`add_sample_from_bam`.
+    :param kwargs: Additional keyword arugments are added to the sample table. To specify different values for the samples
+        (e.g. the group), provide a dict with sample names as keys.
+    :return: Dict with the number of nonchimeric reads per chromosome, for each sample."""
+
+    if sample_names is None and sample_tag == "RG" and not stream:
+        with AlignmentFile(fn, "rb") as align:
+            sample_names = [rg["ID"] for rg in align.header.to_dict().get("RG", [])]
+        assert sample_names, f"no read groups found in header of {fn}"
+    if sample_names is not None:
+        if not isinstance(sample_names, dict):
+            sample_names = {val: val for val in sample_names}
+        assert len(set(sample_names.values())) == len(
+            sample_names
+        ), "sample names must be unique"
+        conflict = [sa for sa in sample_names.values() if sa in self.samples]
+        assert not conflict, f"samples {conflict} are already in the data set."
+    logger.info(
+        f'adding samples from file {fn}, identified by "{sample_tag}" tag'
+        + ("" if sample_names is None else f": {', '.join(sample_names.values())}")
+    )
+    nc_reads_chr, n_chimeric = self._import_bam(
+        {None: fn},
+        None if sample_names is None else list(sample_names.values()),
+        fuzzy_junction,
+        add_chromosomes,
+        chimeric_mincov,
+        use_satag,
+        processes,
+        clipping=clipping,
+        threads=threads,
+        chimeric_buffer=chimeric_buffer,
+        sample_tag=sample_tag,
+        tag_samples=sample_names,
+        stream=stream,
+        stream_buffer=stream_buffer,
+        collapsed_file=collapsed_file,
+    )
+    self._add_sample_table_rows(
+        {sa: fn for sa in nc_reads_chr}, nc_reads_chr, n_chimeric, kwargs
+    )
+    return nc_reads_chr
+
+
+def add_samples_from_bams(
+    self,
+    fns: Dict[str, Path],
+    fuzzy_junction: int = 5,
+    add_chromosomes: bool = True,
+    chimeric_mincov: int = 2,
+    chimeric_buffer: Optional[int] = None,
+    use_satag: bool = False,
+    clipping: bool = False,
+    processes: int = 1,
+    threads: int = 1,
+    collapsed_file: Optional[Path] = None,
+    **kwargs,
+):
+    """Imports expressed transcripts of several samples from separate bam files, which are read concurrently.
+
+    The alignments of all files are merged by position, such that each locus is collapsed, assigned to a gene
+    and annotated only once for all samples.
+
+    :param fns: Dict with the sample names as keys and the bam filenames as values.
+    :param fuzzy_junction: maximum size for fuzzy junction correction
+    :param add_chromosomes: If True, genes from chromosomes which are not in the Transcriptome yet are added.
+    :param chimeric_mincov: Minimum number of reads for a chimeric transcript to be considered
+    :param chimeric_buffer: Maximum number of chimeric alignment parts kept in memory, see :func:`add_sample_from_bam`.
+    :param use_satag: If True, import secondary alignments (of chimeric alignments) from the SA tag.
+        This should only be specified if the secondary alignment is not reported in a seperate bam entry.
+    :param clipping: If True, the clipping of the reads is stored, see :func:`add_sample_from_bam`.
+    :param processes: Number of worker processes for the import, see :func:`add_sample_from_bam`.
+    :param threads: Number of threads for the decompression of each bam file, see :func:`add_sample_from_bam`.
+    :param collapsed_file: If provided, the collapsed reads are saved to this file, see :func:`add_sample_from_bam`.
+    :param kwargs: Additional keyword arugments are added to the sample table. To specify different values for the samples
+        (e.g. the group), provide a dict with sample names as keys.
+    :return: Dict with the number of nonchimeric reads per chromosome, for each sample."""
+    conflict = [sa for sa in fns if sa in self.samples]
+    assert not conflict, f"samples {conflict} are already in the data set."
+    logger.info(f"adding samples {', '.join(fns)} from {len(fns)} files")
+    nc_reads_chr, n_chimeric = self._import_bam(
+        fns,
+        list(fns),
+        fuzzy_junction,
+        add_chromosomes,
+        chimeric_mincov,
+        use_satag,
+        processes,
+        clipping=clipping,
+        threads=threads,
+        chimeric_buffer=chimeric_buffer,
+        collapsed_file=collapsed_file,
+    )
+    self._add_sample_table_rows(fns, nc_reads_chr, n_chimeric, kwargs)
+    return nc_reads_chr
+
+
+def add_samples_from_collapsed(
+    self,
+    fn: Path,
+    sample_names: Optional[Dict[str, str]] = None,
+    fuzzy_junction: int = 5,
+    add_chromosomes: bool = True,
+    chimeric_mincov: int = 2,
+    chimeric_buffer: Optional[int] = None,
+    **kwargs,
+):
+    """Imports the collapsed reads of one or several samples, as saved by the collapsed_file parameter of :func:`add_sample_from_bam`.
+
+    Only the assignment of the transcripts to genes is done, so this is much faster than reading the alignments,
+    e.g. to use the same samples with a different reference annotation.
+
+    :param fn: The file with the collapsed reads.
+    :param sample_names: Dict to rename the samples, with the original names as keys and the new names as values.
+        Other samples in the file are imported with their original names.
+    :param fuzzy_junction: maximum size for fuzzy junction correction
+    :param add_chromosomes: If True, genes from chromosomes which are not in the Transcriptome yet are added.
+    :param chimeric_mincov: Minimum number of reads for a chimeric transcript to be considered
+    :param chimeric_buffer: Maximum number of chimeric alignment parts kept in memory, see :func:`add_sample_from_bam`.
+    :param kwargs: Additional keyword arugments are added to the sample table. To specify different values for the samples
+        (e.g. the group), provide a dict with sample names as keys.
+    :return: Dict with the number of nonchimeric reads per chromosome, for each sample."""
+    file_samples, sample_files, chr_len, n_reads, unmapped, collapsed = _read_collapsed(fn)
+    if sample_names:
+        collapsed = _rename_samples(collapsed, sample_names)
+        file_samples = [sample_names.get(sa, sa) for sa in file_samples]
+        sample_files = {sample_names.get(sa, sa): f for sa, f in sample_files.items()}
+    conflict = [sa for sa in file_samples if sa in self.samples]
+    assert not conflict, f"samples {conflict} are already in the data set."
+    logger.info(f"adding samples {', '.join(file_samples)} from collapsed reads in {fn}")
+    chromosomes = list(chr_len)
+    if not add_chromosomes:
+        chromosomes = [chrom for chrom in chromosomes if chrom in self.chromosomes]
+        collapsed = (
+            chrom_collapsed
+            for chrom, chrom_collapsed in zip(chr_len, collapsed)
+            if chrom in chromosomes
+        )
+    with tqdm(
+        total=n_reads, unit="reads", bar_format="{l_bar}{bar:10}{r_bar}{bar:-10b}"
+    ) as pbar:
+        nc_reads_chr, n_chimeric = self._add_collapsed(
+            chromosomes,
+            chr_len,
+            collapsed,
+            file_samples,
+            fuzzy_junction,
+            chimeric_mincov,
+            pbar,
+            unmapped=unmapped,
+            collapse_progress=True,
+            chimeric_buffer=chimeric_buffer,
+        )
+    self._add_sample_table_rows(
+        {sa: sample_files.get(sa, fn) for sa in nc_reads_chr}, nc_reads_chr, n_chimeric, kwargs
+    )
+    return nc_reads_chr
+
+
+def _rename_samples(collapsed, sample_names):
+    "renames the samples of the collapsed reads"
+    for chrom_collapsed in collapsed:
+        transcripts, chimeric = chrom_collapsed[:2]
+        for tr_interval in transcripts:
+            tr = tr_interval.data
+            for what in "coverage", "TSS", "PAS", "clipping":
+                if what in tr:
+                    tr[what] = {sample_names.get(sa, sa): v for sa, v in tr[what].items()}
+        renamed = _SpilledGroups()
+        for (sa, read_name), parts in chimeric.items():
+            renamed.extend((sample_names.get(sa, sa), read_name), parts)
+        chimeric.close()
+        chimeric = renamed
+        nc_reads = {sample_names.get(sa, sa): v for sa, v in chrom_collapsed[-1].items()}
+        yield (transcripts, chimeric, *chrom_collapsed[2:-1], nc_reads)
+
+
+def _add_sample_table_rows(self, fns, nc_reads_chr, n_chimeric, kwargs):
+    "adds the imported samples to the sample table - values of kwargs may be dicts with sample specific values"
+    rows = []
+    for sa in nc_reads_chr:
+        row = {"name": sa, "file": fns[sa]}
+        row.update(
+            {k: v.get(sa, None) if isinstance(v, dict) else v for k, v in kwargs.items()}
+        )
+        row["chimeric_reads"] = n_chimeric[sa]
+        row["nonchimeric_reads"] = sum(nc_reads_chr[sa].values())
+        rows.append(row)
+    self.infos["sample_table"] = self.sample_table.append(rows, ignore_index=True)
+    self._update_coverage()
+
+
+def _update_coverage(self):
+    "adds new samples to the coverage matrices of the genes, which have still valid splice graphs (e.g. no new transcripts)"
+    for g in self:
+        if "coverage" in g.data and g.data["coverage"] is not None:
+            g._set_coverage()
+
+
+def _import_bam(
+    self,
+    fns,
+    samples,
+    fuzzy_junction,
+    add_chromosomes,
+    chimeric_mincov,
+    use_satag,
+    processes,
+    clipping=False,
+    threads=1,
+    chimeric_buffer=None,
+    sample_tag=None,
+    tag_samples=None,
+    stream=False,
+    stream_buffer=None,
+    collapsed_file=None,
+):
+    """Imports the transcripts of one or several samples from bam files, but does not update the sample table.
+
+    :param fns: Dict with bam filenames. If sample_tag is None, the keys are the sample names of the files.
+    :param samples: The list of sample names, or None, if the samples are defined by the tag values found in the file.
+    :param stream: If True, the (single) file is read once from start to end, and does not need to be sorted or indexed.
+    :param stream_buffer: Maximum number of records of the collapsers kept in memory with stream=True, see :class:`_CollapserStore`.
+    :param collapsed_file: If provided, the collapsed reads are saved to this file.
+    :return: Tuple with 1) a dict with the number of nonchimeric reads per chromosome and 2) a dict with the number of chimeric reads,
+        each with sample names as keys"""
     # genome_fh=FastaFile(genome_fn) if genome_fn is not None else None
-    with AlignmentFile(fn, "rb") as align:
-        if add_chromosomes:
-            chromosomes = align.references
-        else:
-            chromosomes = self.chromosomes
-        stats = align.get_index_statistics()
-        # try catch if sam/ no index /not pacbio?
-        total_alignments = sum([s.mapped for s in stats if s.contig in chromosomes])
-        total_nc_reads = unmapped = n_secondary = 0
-        total_nc_reads_chr = {}
-        chimeric = dict()
-        with tqdm(total=total_alignments, unit="reads", bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}') as pbar:
+    chr_len = {}
+    total_alignments = None if stream else 0
+    for fn in fns.values() if not stream else []:
+        with AlignmentFile(fn, "rb") as align:
+            if add_chromosomes:
+                chromosomes = align.references
+            else:
+                chromosomes = [c for c in self.chromosomes if c in align.references]
+            stats = align.get_index_statistics()
+            # try catch if sam/ no index /not pacbio?
+            total_alignments += sum([s.mapped for s in stats if s.contig in chromosomes])
             for chrom in chromosomes:
-                # todo: potential issue here - secondary/chimeric alignments to
-                # non listed chromosomes are ignored
-                total_nc_reads_chr[chrom] = 0
-                pbar.set_postfix(chr=chrom)
-                # transcripts=IntervalTree()
-                # novel=IntervalTree()
-                chr_len = align.get_reference_length(chrom)
-                transcripts = IntervalArray(
-                    chr_len
-                )  # intervaltree was pretty slow for this context
-                novel = IntervalArray(chr_len)
-                n_reads = 0
-                for read in align.fetch(chrom):
-                    n_reads += 1
-                    pbar.update(0.5)
-                    if read.flag & 0x4:  # unmapped
-                        unmapped += 1
-                        continue
-                    if (
-                        read.flag & 0x700
-                    ):  # not primary alignment or failed qual check or PCR duplicate
-                        n_secondary += 1
-                        continue  # use only primary alignments
-                    tags = dict(read.tags)
-                    strand = "-" if read.is_reverse else "+"
-                    exons = junctions_from_cigar(read.cigartuples, read.reference_start)
-                    tr_range = (exons[0][0], exons[-1][1])
-                    if tr_range[0] < 0 or tr_range[1] > chr_len:
-                        logger.error(
-                            f"Alignment outside chromosome range: transcript at {tr_range} for chromosome {chrom} of length {chr_len}"
-                        )
-                        continue
-                    if "is" in tags:
-                        cov = tags[
-                            "is"
-                        ]  # number of actual reads supporting this transcript
-                    else:
-                        cov = 1
+                chrom_len = align.get_reference_length(chrom)
+                assert (
+                    chr_len.setdefault(chrom, chrom_len) == chrom_len
+                ), f"length of {chrom} in {fn} differs from the other bam files"
+    chromosomes = list(chr_len)
+    unmapped = 0
+    collapse_args = dict(
+        chimeric_mincov=chimeric_mincov,
+        use_satag=use_satag,
+        sample_tag=sample_tag,
+        tag_samples=tag_samples,
+        clipping=clipping,
+        chimeric_buffer=chimeric_buffer,
+    )
+    with ExitStack() as stack:
+        pbar = stack.enter_context(
+            tqdm(total=total_alignments, unit="reads", bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}')
+        )
+        if stream:
+            assert len(fns) == 1, "streaming import is only supported for a single file"
+            if processes > 1:
+                logger.warning("streaming import does not support multiple processes")
+            ((file_sample, fn),) = fns.items()
+            align = stack.enter_context(AlignmentFile(fn, "r", threads=threads))
+            chr_len = {
+                chrom: align.get_reference_length(chrom)
+                for chrom in align.references
+                if add_chromosomes or chrom in self.chromosomes
+            }
+            chromosomes = list(chr_len)
+            collapsers = _CollapserStore(chr_len, stream_buffer, **collapse_args)
+            stack.callback(collapsers.close)
+            unmapped = _collapse_stream(align, file_sample, collapsers, pbar)
+            collapsed = (collapsers.finalize(chrom) for chrom in chromosomes)
+        elif processes > 1:
+            # each worker opens the files and collapses the reads of one chromosome
+            pool = stack.enter_context(Pool(processes))
+            collapsed = pool.imap(
+                partial(
+                    _collapse_chromosome_from_files, fns, threads=threads, **collapse_args
+                ),
+                chromosomes,
+            )
+        else:
+            aligns = {
+                sa: stack.enter_context(AlignmentFile(fn, "rb", threads=threads))
+                for sa, fn in fns.items()
+            }
+            collapsed = (
+                _collapse_chromosome(aligns, chrom, pbar=pbar, **collapse_args)
+                for chrom in chromosomes
+            )
+        if collapsed_file is not None:
+            cache = _CollapsedWriter(fns)
+            collapsed = cache.record(chromosomes, chr_len, collapsed)
+        result = self._add_collapsed(
+            chromosomes,
+            chr_len,
+            collapsed,
+            samples,
+            fuzzy_junction,
+            chimeric_mincov,
+            pbar,
+            unmapped=unmapped,
+            collapse_progress=processes > 1 and not stream,
+            sample_tag=sample_tag,
+            chimeric_buffer=chimeric_buffer,
+        )
+    if collapsed_file is not None:
+        cache.save(collapsed_file, unmapped)
+    return result
 
-                    if (
-                        "SA" in tags or read.flag & 0x800
-                    ):  # part of a chimeric alignment
-                        if chimeric_mincov > 0:  # otherwise ignore chimeric read
-                            chimeric.setdefault(read.query_name, [cov, []])
-                            assert (
-                                chimeric[read.query_name][0] == cov
-                            ), "error in bam: parts of chimeric alignment for read {} has different coverage information {} != {}".format(
-                                read.query_name, chimeric[read.query_name][0], cov
-                            )
-                            chimeric[read.query_name][1].append(
-                                [
-                                    chrom,
-                                    strand,
-                                    exons,
-                                    aligned_part(read.cigartuples, read.is_reverse),
-                                    None,
-                                ]
-                            )
-                            if use_satag and "SA" in tags:
-                                for snd_align in (
-                                    sa.split(",") for sa in tags["SA"].split(";") if sa
-                                ):
-                                    snd_cigartuples = cigar_string2tuples(snd_align[3])
-                                    snd_exons = junctions_from_cigar(
-                                        snd_cigartuples, int(snd_align[1])
-                                    )
-                                    chimeric[read.query_name][1].append(
-                                        [
-                                            snd_align[0],
-                                            snd_align[2],
-                                            snd_exons,
-                                            aligned_part(
-                                                snd_cigartuples, snd_align[2] == "-"
-                                            ),
-                                            None,
-                                        ]
-                                    )
-                                    # logging.debug(chimeric[read.query_name])
-                        continue
-                    total_nc_reads_chr[chrom] += cov
-                    for tr_interval in transcripts.overlap(
-                        *tr_range
-                    ):  # did we see this transcript already?
-                        if tr_interval.data["strand"] != strand:
-                            continue
-                        if splice_identical(exons, tr_interval.data["exons"]):
-                            tr = tr_interval.data
-                            tr.setdefault("range", {}).setdefault(tr_range, 0)
-                            tr["range"][tr_range] += cov
-                            break
-                    else:
-                        tr = {
-                            "exons": exons,
-                            "range": {tr_range: cov},
-                            "strand": strand,
-                        }
-                        transcripts.add(Interval(*tr_range, tr))
-                    # if genome_fh is not None:
-                    #    mutations=get_mutations(read.cigartuples, read.query_sequence, genome_fh, chrom,read.reference_start,read.query_qualities)
-                    #    for pos,ref,alt,qual in mutations:
-                    #        tr.setdefault('mutations',{}).setdefault(sample_name,{}).setdefault(pos,{'ref':ref}).setdefault(alt,[0,[]])
-                    #        tr['mutations'][sample_name][pos][alt][0]+=cov
-                    #        if qual:
-                    #            tr['mutations'][sample_name][pos][alt][1].append(qual) #assuming the quality already accounts for cov>1
-
-                    if 4 in read.cigartuples:  # clipping
-                        clip = get_clipping(
-                            read.cigartuples, read, read.reference_start
-                        )
-                        tr.setdefault("clipping", {}).setdefault(
-                            sample_name, {}
-                        ).setdefault(clip, 0)
-                        tr["clipping"][sample_name][clip] += cov
-                for tr_interval in transcripts:
-                    tr = tr_interval.data
-                    tr_ranges = tr.pop("range")
-                    # tr_ranges=tr['range']
-                    starts, ends = {}, {}
-                    for r, cov in tr_ranges.items():
-                        starts[r[0]] = starts.get(r[0], 0) + cov
-                        ends[r[1]] = ends.get(r[1], 0) + cov
-                    tr["TSS"] = starts if tr["strand"] == "+" else ends
-                    tr["PAS"] = starts if tr["strand"] == "-" else ends
-                    # tr['exons'][0][0]=min(r[0] for r in tr_ranges) #todo - instead of extremas take the median?
-                    # tr['exons'][-1][1]=max(r[1] for r in tr_ranges)
-                    tr["exons"][0][0] = get_quantile(starts.items(), 0.5)
-                    tr["exons"][-1][1] = get_quantile(ends.items(), 0.5)
-                    cov = sum(tr_ranges.values())
-                    tr["coverage"] = cov
-
-                    gene = self._add_sample_transcript(
-                        tr, chrom, sample_name, fuzzy_junction
-                    )
-                    if gene is None:
-                        novel.add(tr_interval)
-                    n_reads -= cov
-                    pbar.update(cov / 2)
-                self._add_novel_genes(novel, chrom, sample_name)
-
-                pbar.update(
-                    n_reads / 2
-                )  # some reads are not processed here, add them to the progress: chimeric, unmapped, secondary alignment
-                # logger.debug(f'imported {total_nc_reads_chr[chrom]} nonchimeric reads for {chrom}')
-                total_nc_reads += total_nc_reads_chr[chrom]
+
+def _add_collapsed(
+    self,
+    chromosomes,
+    chr_len,
+    collapsed,
+    samples,
+    fuzzy_junction,
+    chimeric_mincov,
+    pbar,
+    unmapped=0,
+    collapse_progress=False,
+    sample_tag=None,
+    chimeric_buffer=None,
+):
+    """Assigns collapsed reads to genes, adds novel genes and chimeric transcripts.
+
+    :param collapsed: Iterable with the collapsed reads of the chromosomes, in the same order, see :func:`_ReadCollapser.finalize`.
+    :param samples: The list of sample names, or None, if the samples are defined by the collapsed reads.
+    :param unmapped: Number of unmapped reads, which are not included in collapsed.
+    :param collapse_progress: If True, the collapsing is accounted for in the progress bar.
+    :param chimeric_buffer: Maximum number of chimeric alignment parts kept in memory, see :class:`_SpilledGroups`.
+    :return: Tuple with 1) a dict with the number of nonchimeric reads per chromosome and 2) a dict with the number of chimeric reads,
+        each with sample names as keys"""
+    samples = [] if samples is None else list(samples)
+    n_secondary = n_untagged = 0
+    nc_reads_chr = {sa: {} for sa in samples}
+    # parts of the chimeric reads, grouped by sample and read name
+    chimeric = _SpilledGroups(chimeric_buffer)
+    collapsed = iter(collapsed)
+    for chrom in chromosomes:
+        pbar.set_postfix(chr=chrom)
+        (
+            transcripts,
+            chrom_chimeric,
+            n_reads,
+            chrom_unmapped,
+            chrom_secondary,
+            chrom_untagged,
+            chrom_nc_reads,
+        ) = next(collapsed)
+        if collapse_progress:
+            pbar.update(n_reads / 2)
+        unmapped += chrom_unmapped
+        n_secondary += chrom_secondary
+        n_untagged += chrom_untagged
+        new_samples = [sa for sa in chrom_nc_reads if sa not in nc_reads_chr]
+        if new_samples:  # samples are defined by the tags found in the file
+            conflict = [sa for sa in new_samples if sa in self.samples]
+            assert not conflict, f"samples {conflict} are already in the data set."
+            for sa in new_samples:
+                samples.append(sa)
+                nc_reads_chr[sa] = {}
+        for sa in samples:
+            nc_reads_chr[sa][chrom] = chrom_nc_reads.get(sa, 0)
+        # chimeric alignments may span several chromosomes
+        chimeric.merge(chrom_chimeric)
+        novel = IntervalArray(chr_len[chrom])
+        pending = []  # new transcripts of reference genes, classified in one batch per gene
+        for tr_interval in transcripts:
+            cov = sum(tr_interval.data["coverage"].values())
+            gene = self._add_sample_transcript(
+                tr_interval.data, chrom, fuzzy_junction, pending
+            )
+            if gene is None:
+                novel.add(tr_interval)
+            n_reads -= cov
+            pbar.update(cov / 2)
+        _annotate_pending(pending)
+        self._add_novel_genes(novel, chrom)
+
+        pbar.update(
+            n_reads / 2
+        )  # some reads are not processed here, add them to the progress: chimeric, unmapped, secondary alignment
+        # logger.debug(f'imported {chrom_nc_reads} nonchimeric reads for {chrom}')
     if n_secondary > 0:
         logger.info(
             f"skipped {n_secondary} secondary alignments (0x100), alignment that failed quality check (0x200) or PCR duplicates (0x400)"
         )
     if unmapped > 0:
         logger.info(f"ignored {unmapped} reads marked as unaligned")
-    # merge chimeric reads and assign gene names
-    chimeric, non_chimeric = _check_chimeric(chimeric)
-    chained_msg = ""
-    if len(non_chimeric):
+    if n_untagged > 0:
         logger.info(
-            f"imported {len(non_chimeric)} chimeric alignments that can be chained to single nonchimeric transcripts (long intron alingment split)"
+            f'ignored {n_untagged} reads without "{sample_tag}" tag or with unknown tag value'
         )
-        chained_msg = f" (including  {sum(nc[0] for nc in non_chimeric) } chained chimeric alignments)"
-    n_chimeric = self._add_chimeric(chimeric, chimeric_mincov, sample_name)
-    if len(chimeric) - n_chimeric > 0:
+    # merge the parts of chimeric reads, and group them by breakpoints
+    breakpoints = _SpilledGroups(chimeric_buffer)
+    non_chimeric = {sa: [] for sa in samples}
+    skip = 0
+    try:
+        for (sa, read_name), parts in chimeric.items():
+            cov = parts[0][0]
+            assert all(
+                part_cov == cov for part_cov, _ in parts
+            ), "error in bam: parts of chimeric alignment for read {} has different coverage information {}".format(
+                read_name, [part_cov for part_cov, _ in parts]
+            )
+            new_chim = [cov, [part for _, part in parts]]
+            if len(new_chim[1]) < 2:
+                skip += cov
+                continue
+            bpts, merged_introns = _check_chimeric(new_chim)
+            if bpts:
+                # the sample index in the key adds the chimeric reads sample by sample, as for separate imports
+                breakpoints.extend((samples.index(sa), bpts), [new_chim])
+            else:
+                non_chimeric[sa].append([new_chim[0], new_chim[1][0], merged_introns])
+        chimeric.close()
+        if skip:
+            logger.warning(
+                f"ignored {skip} chimeric alignments with only one part aligned to specified chromosomes."
+            )
+        n_chimeric = {sa: 0 for sa in samples}
+        n_breakpoints = {sa: 0 for sa in samples}
+        for (i, bpts), chim_list in breakpoints.items(ordered=True):
+            sa = samples[i]
+            n_breakpoints[sa] += 1
+            n_chimeric[sa] += self._add_chimeric([(bpts, chim_list)], chimeric_mincov, sa)
+    finally:
+        chimeric.close()
+        breakpoints.close()
+    for sa in samples:
+        chained_msg = ""
+        if len(non_chimeric[sa]):
+            logger.info(
+                f"imported {len(non_chimeric[sa])} chimeric alignments that can be chained to single nonchimeric transcripts (long intron alingment split)"
+            )
+            chained_msg = f" (including  {sum(nc[0] for nc in non_chimeric[sa]) } chained chimeric alignments)"
+        if n_breakpoints[sa] - n_chimeric[sa] > 0:
+            logger.info(
+                f"ignoring {n_breakpoints[sa]-n_chimeric[sa]} chimeric alignments with less than {chimeric_mincov} reads"
+            )
+        chained_reads = {}  # this adds long introns
+        chimeric_msg = (
+            ""
+            if not n_chimeric[sa]
+            else f" and {n_chimeric[sa]} chimeric reads with coverage of at least {chimeric_mincov}"
+        )
+        novel = dict()
+        for (cov, (chrom, strand, exons, _, _), introns) in non_chimeric[sa]:
+            chained_reads[chrom] = chained_reads.get(chrom, 0) + cov
+            try:
+                tss, pas = (
+                    (exons[0][0], exons[-1][1])
+                    if strand == "+"
+                    else (exons[-1][1], exons[0][0])
+                )
+                tr = {
+                    "exons": exons,
+                    "coverage": {sa: cov},
+                    "TSS": {sa: {tss: cov}},
+                    "PAS": {sa: {pas: cov}},
+                    "strand": strand,
+                    "chr": chrom,
+                    "long_intron_chimeric": {sa: {introns: cov}},
+                }
+            except:
+                logger.error(
+                    f'\n\n-->{(exons[0][0],exons[-1][1]) if strand =="+" else (exons[-1][1],exons[0][0])}\n\n'
+                )
+                raise
+            gene = self._add_sample_transcript(
+                tr, chrom, fuzzy_junction
+            )  # tr is not updated
+            if gene is None:
+                novel.setdefault(chrom, []).append(tr)
+        for chrom in novel:
+            self._add_novel_genes(
+                IntervalTree(
+                    Interval(tr["exons"][0][0], tr["exons"][-1][1], tr)
+                    for tr in novel[chrom]
+                ),
+                chrom,
+            )
+        for chrom, cov in chained_reads.items():
+            nc_reads_chr[sa][chrom] = nc_reads_chr[sa].get(chrom, 0) + cov
         logger.info(
-            f"ignoring {len(chimeric)-n_chimeric} chimeric alignments with less than {chimeric_mincov} reads"
+            f"imported {sum(nc_reads_chr[sa].values())} nonchimeric reads{chained_msg}{chimeric_msg}"
+            + (f" for sample {sa}." if len(samples) > 1 or sample_tag is not None else ".")
         )
-    total_nc_reads += sum(nc[0] for nc in non_chimeric)  # this adds long introns
-    chimeric_msg = (
-        ""
-        if not n_chimeric
-        else f" and {n_chimeric} chimeric reads with coverage of at least {chimeric_mincov}"
-    )
-    logger.info(
-        f"imported {total_nc_reads} nonchimeric reads{chained_msg}{chimeric_msg}."
-    )
-    novel = dict()
-    for (cov, (chrom, strand, exons, _, _), introns) in non_chimeric:
-        try:
-            tss, pas = (
-                (exons[0][0], exons[-1][1])
-                if strand == "+"
-                else (exons[-1][1], exons[0][0])
+    # self.infos.setdefault('chimeric',{})[sample_name]=chimeric #save all chimeric reads (for debugging)
+    return nc_reads_chr, n_chimeric
+
+
+class _CollapsedWriter:
+    """Records the collapsed reads of an import in columnar form, to save them in a compressed numpy (.npz) file.
+
+    The file can be imported with :func:`add_samples_from_collapsed`, e.g. to assign the reads to the genes of a different reference
+    without reading the alignment files again.
+
+    :param fns: Dict with the alignment files, with the sample names as keys, or None as key, if the samples are defined by a tag.
+        The file names are saved, such that the sample table can refer to the original files."""
+
+    format_version = 1
+
+    def __init__(self, fns=None):
+        self.fns = {} if fns is None else fns
+        self.samples = {}
+        self.chromosomes = []
+        self.chr_len = []
+        self.columns = {}
+
+    def _sample_idx(self, sa):
+        return self.samples.setdefault(sa, len(self.samples))
+
+    def _add(self, **columns):
+        for k, v in columns.items():
+            self.columns.setdefault(k, []).extend(v)
+
+    def record(self, chromosomes, chr_len, collapsed):
+        "generator that records and passes the collapsed reads of each chromosome, before they get modified by the gene assignment"
+        for chrom, chrom_collapsed in zip(chromosomes, collapsed):
+            self.add(chrom, chr_len[chrom], chrom_collapsed)
+            yield chrom_collapsed
+
+    def add(self, chrom, chr_len, chrom_collapsed):
+        "adds the collapsed reads of one chromosome, as returned by :func:`_ReadCollapser.finalize`"
+        (
+            transcripts,
+            chimeric,
+            n_reads,
+            unmapped,
+            n_secondary,
+            n_untagged,
+            n_nonchimeric,
+        ) = chrom_collapsed
+        chrom_idx = len(self.chromosomes)
+        self.chromosomes.append(chrom)
+        self.chr_len.append(chr_len)
+        self._add(
+            chr_stats=[(n_reads, unmapped, n_secondary, n_untagged)],
+            nc=[
+                (chrom_idx, self._sample_idx(sa), n) for sa, n in n_nonchimeric.items()
+            ],
+        )
+        tr_idx = len(self.columns.get("tr_strand", []))
+        for tr_idx, tr_interval in enumerate(transcripts, tr_idx):
+            tr = tr_interval.data
+            self._add(
+                tr_chrom=[chrom_idx],
+                tr_range=[(tr_interval.begin, tr_interval.end)],
+                tr_strand=[tr["strand"] == "-"],
+                tr_n_exons=[len(tr["exons"])],
+                tr_exons=[tuple(e) for e in tr["exons"]],
+                coverage=[
+                    (tr_idx, self._sample_idx(sa), cov)
+                    for sa, cov in tr["coverage"].items()
+                ],
             )
-            tr = {
-                "exons": exons,
-                "coverage": cov,
-                "TSS": {tss: cov},
-                "PAS": {pas: cov},
-                "strand": strand,
-                "chr": chrom,
-                "long_intron_chimeric": {sample_name: {introns: cov}},
-            }
-        except:
-            logger.error(
-                f'\n\n-->{(exons[0][0],exons[-1][1]) if strand =="+" else (exons[-1][1],exons[0][0])}\n\n'
+            for side in "TSS", "PAS":
+                self._add(
+                    **{
+                        side: [
+                            (tr_idx, self._sample_idx(sa), pos, cov)
+                            for sa, sa_pos in tr[side].items()
+                            for pos, cov in sa_pos.items()
+                        ]
+                    }
+                )
+            self._add(
+                clipping=[
+                    (tr_idx, self._sample_idx(sa), clip[0], clip[1], cov)
+                    for sa, sa_clip in tr.get("clipping", {}).items()
+                    for clip, cov in sa_clip.items()
+                ]
             )
-            raise
-        gene = self._add_sample_transcript(
-            tr, chrom, sample_name, fuzzy_junction
-        )  # tr is not updated
-        if gene is None:
-            novel.setdefault(chrom, []).append(tr)
-    for chrom in novel:
-        self._add_novel_genes(
-            IntervalTree(
-                Interval(tr["exons"][0][0], tr["exons"][-1][1], tr)
-                for tr in novel[chrom]
+        for (sa, read_name), parts in chimeric.items():
+            for cov, part in parts:
+                self._add(
+                    chim_chrom=[chrom_idx],
+                    chim_sample=[self._sample_idx(sa)],
+                    chim_read=[read_name],
+                    chim_cov=[cov],
+                    part_chrom=[part[0]],
+                    part_strand=[part[1] == "-"],
+                    part_n_exons=[len(part[2])],
+                    part_exons=[tuple(e) for e in part[2]],
+                    part_aligned=[part[3]],
+                )
+
+    def save(self, fn, unmapped=0):
+        """saves the recorded reads
+
+        :param fn: The filename of the compressed numpy file.
+        :param unmapped: Number of unmapped reads not placed on any chromosome."""
+        shapes = {
+            "chr_stats": (0, 4),
+            "nc": (0, 3),
+            "tr_range": (0, 2),
+            "tr_exons": (0, 2),
+            "coverage": (0, 3),
+            "TSS": (0, 4),
+            "PAS": (0, 4),
+            "clipping": (0, 5),
+            "part_exons": (0, 2),
+            "part_aligned": (0, 2),
+        }
+        columns = {}
+        for k, v in self.columns.items():
+            if k in ("chim_read", "part_chrom"):
+                columns[k] = np.array(v, dtype=str)
+            else:
+                columns[k] = np.array(v, dtype=np.int64)
+        for k, shape in shapes.items():  # empty columns need the right shape
+            if k not in columns:
+                columns[k] = np.zeros(shape, dtype=np.int64)
+        np.savez_compressed(
+            fn,
+            format_version=self.format_version,
+            samples=np.array(list(self.samples), dtype=str),
+            files=np.array(
+                [str(self.fns.get(sa, self.fns.get(None, ""))) for sa in self.samples],
+                dtype=str,
             ),
-            chrom,
-            sample_name,
+            chromosomes=np.array(self.chromosomes, dtype=str),
+            chr_len=np.array(self.chr_len, dtype=np.int64),
+            unmapped=unmapped,
+            **columns,
         )
-    # self.infos.setdefault('chimeric',{})[sample_name]=chimeric #save all chimeric reads (for debugging)
-    for g in self:
-        if (
-            "coverage" in g.data and g.data["coverage"] is not None
-        ):  # still valid splice graphs no new transcripts - add a row of zeros to coveage
-            g._set_coverage()
-    kwargs["chimeric_reads"] = n_chimeric
-    kwargs["nonchimeric_reads"] = total_nc_reads
-    self.infos["sample_table"] = self.sample_table.append(kwargs, ignore_index=True)
-    return total_nc_reads_chr
+        logger.info(f"saved collapsed reads of {len(self.samples)} samples to {fn}")
+
+
+def _read_collapsed(fn):
+    """reads the collapsed reads saved by :class:`_CollapsedWriter`
+
+    :return: Tuple of 1) the list of sample names, 2) a dict with the original alignment file of each sample (if saved),
+        3) a dict with the chromosome lengths, 4) the total number of reads, 5) the number of unplaced unmapped reads
+        and 6) a generator of the collapsed reads of each chromosome, as returned by :func:`_ReadCollapser.finalize`."""
+    with np.load(fn) as npz:
+        data = {k: npz[k] for k in npz.files}
+    assert (
+        data["format_version"] == _CollapsedWriter.format_version
+    ), f"{fn} was written in format version {data['format_version']}, which is not supported"
+    samples = data["samples"].tolist()
+    sample_files = {sa: f for sa, f in zip(samples, data.get("files", np.zeros(0)).tolist()) if f}
+    chromosomes = data["chromosomes"].tolist()
+    chr_len = dict(zip(chromosomes, data["chr_len"].tolist()))
+
+    def by_index(col, n, idx_col=0):
+        "splits the rows of the column by the values in idx_col, which must be sorted"
+        rows = data[col].tolist()
+        if not rows:
+            return [[] for _ in range(n)]
+        bounds = np.searchsorted(data[col][:, idx_col], np.arange(n + 1))
+        return [rows[bounds[i] : bounds[i + 1]] for i in range(n)]
+
+    def collapsed():
+        n_tr = len(data.get("tr_strand", []))
+        exon_offset = np.cumsum([0, *data.get("tr_n_exons", [])]).tolist()
+        tr_exons = data["tr_exons"].tolist()
+        tr_range = data["tr_range"].tolist()
+        tr_sides = {
+            side: by_index(side, n_tr) for side in ("coverage", "TSS", "PAS", "clipping")
+        }
+        chr_tr = np.searchsorted(
+            data.get("tr_chrom", np.zeros(0)), np.arange(len(chromosomes) + 1)
+        )
+        part_offset = np.cumsum([0, *data.get("part_n_exons", [])]).tolist()
+        part_exons = data["part_exons"].tolist()
+        chr_chim = np.searchsorted(
+            data.get("chim_chrom", np.zeros(0)), np.arange(len(chromosomes) + 1)
+        )
+        nc = by_index("nc", len(chromosomes))
+        for chrom_idx, chrom in enumerate(chromosomes):
+            transcripts = []
+            for tr_idx in range(chr_tr[chrom_idx], chr_tr[chrom_idx + 1]):
+                exons = tr_exons[exon_offset[tr_idx] : exon_offset[tr_idx + 1]]
+                tr = {
+                    "exons": exons,
+                    "strand": "-" if data["tr_strand"][tr_idx] else "+",
+                    "coverage": {
+                        samples[sa]: cov for _, sa, cov in tr_sides["coverage"][tr_idx]
+                    },
+                }
+                for side in "TSS", "PAS":
+                    tr[side] = {}
+                    for _, sa, pos, cov in tr_sides[side][tr_idx]:
+                        tr[side].setdefault(samples[sa], {})[pos] = cov
+                for _, sa, pos, length, cov in tr_sides["clipping"][tr_idx]:
+                    tr.setdefault("clipping", {}).setdefault(samples[sa], {})[
+                        (pos, length)
+                    ] = cov
+                transcripts.append(Interval(*tr_range[tr_idx], tr))
+            chimeric = _SpilledGroups()
+            nc_reads = {samples[sa]: n for _, sa, n in nc[chrom_idx]}
+            for i in range(chr_chim[chrom_idx], chr_chim[chrom_idx + 1]):
+                nc_reads.setdefault(samples[data["chim_sample"][i]], 0)
+                chimeric.extend(
+                    (samples[data["chim_sample"][i]], str(data["chim_read"][i])),
+                    [
+                        (
+                            int(data["chim_cov"][i]),
+                            [
+                                str(data["part_chrom"][i]),
+                                "-" if data["part_strand"][i] else "+",
+                                part_exons[part_offset[i] : part_offset[i + 1]],
+                                tuple(data["part_aligned"][i].tolist()),
+                                None,
+                            ],
+                        )
+                    ],
+                )
+            yield (
+                transcripts,
+                chimeric,
+                *data["chr_stats"][chrom_idx].tolist(),
+                nc_reads,
+            )
+
+    n_reads = int(data["chr_stats"][:, 0].sum())
+    return samples, sample_files, chr_len, n_reads, int(data["unmapped"]), collapsed()
+
+
+def _collapse_stream(align, file_sample, collapsers, pbar=None):
+    """Collapses all reads of an alignment file, which is read once in the order of the file.
+
+    The reads are collapsed separately for each chromosome, which need to be finalized when the whole file has been read.
+    Memory consumption depends on the number of distinct transcripts rather than the number of reads, and can be limited
+    by the buffer of the collapsers.
+    For unsorted files, the collapsed transcripts may differ from the import of the sorted file, as the reads are seen in a different order:
+    Overlapping mono-exon reads may be grouped differently, and the order in which transcripts are assigned to genes
+    affects fuzzy junction correction, and hence the annotation of multi-exon transcripts.
+
+    :param collapsers: The :class:`_CollapserStore` for the reads.
+    :return: The number of unmapped reads, that are not placed on any chromosome."""
+    unmapped = 0
+    for chunk in _read_chunks(align.fetch(until_eof=True)):
+        chrom_chunks = {}
+        for read in chunk:
+            chrom_chunks.setdefault(read.reference_name, []).append((file_sample, read))
+        for chrom, chrom_chunk in chrom_chunks.items():
+            if chrom is None:
+                unmapped += len(chrom_chunk)
+            elif chrom in collapsers.chr_len:  # reads on other chromosomes are ignored
+                collapsers.add_reads(chrom, chrom_chunk)
+        collapsers.spill()
+        if pbar is not None:
+            pbar.update(len(chunk) / 2)
+    return unmapped
+
+
+class _CollapserStore:
+    """Keeps a :class:`_ReadCollapser` for each chromosome during the streaming import.
+
+    The collapsers in memory are limited to buffer records (collapsed transcripts and chimeric read parts). If this is exceeded,
+    the least recently used collapsers are written to temporary files, and are loaded again when they get more reads,
+    or when they are finalized. The most recently used collapser is always kept in memory.
+
+    :param chr_len: Dict with the lengths of the chromosomes.
+    :param buffer: Maximum number of records in memory, or None for no limit.
+    :param kwargs: Additional keyword arguments for the collapsers."""
+
+    def __init__(self, chr_len, buffer=None, **kwargs):
+        self.chr_len = chr_len
+        self.buffer = buffer
+        self.kwargs = kwargs
+        self.collapsers = OrderedDict()  # in order of last use
+        self.files = {}
+        self.n_written = 0
+
+    def _get(self, chrom):
+        collapser = self.collapsers.get(chrom)
+        if collapser is not None:
+            self.collapsers.move_to_end(chrom)
+            return collapser
+        if chrom in self.files:
+            fn = self.files.pop(chrom)
+            with open(fn, "rb") as fh:
+                collapser = pickle.load(fh)
+            os.remove(fn)
+        else:
+            collapser = _ReadCollapser(chrom, self.chr_len[chrom], **self.kwargs)
+        self.collapsers[chrom] = collapser
+        return collapser
+
+    def add_reads(self, chrom, chunk):
+        "adds a list of (file sample, alignment) tuples of chrom"
+        self._get(chrom).add_reads(chunk)
+
+    def spill(self):
+        "writes the least recently used collapsers to temporary files, until the records in memory fit in the buffer"
+        if self.buffer is None:
+            return
+        n_records = sum(collapser.n_records for collapser in self.collapsers.values())
+        while n_records > self.buffer and len(self.collapsers) > 1:
+            chrom, collapser = self.collapsers.popitem(last=False)
+            n_records -= collapser.n_records
+            with tempfile.NamedTemporaryFile(
+                prefix="isotools_", suffix=".pkl", delete=False
+            ) as fh:
+                pickle.dump(collapser, fh, pickle.HIGHEST_PROTOCOL)
+                self.files[chrom] = fh.name
+            self.n_written += 1
+
+    def finalize(self, chrom):
+        "finalizes and releases the collapser of chrom, see :func:`_ReadCollapser.finalize`"
+        collapsed = self._get(chrom).finalize()
+        del self.collapsers[chrom]
+        return collapsed
+
+    def close(self):
+        "removes the temporary files and all collapsers"
+        for fn in self.files.values():
+            if os.path.exists(fn):
+                os.remove(fn)
+        if self.n_written:
+            logger.debug(f"wrote collapsed reads of chromosomes {self.n_written} times to temporary files")
+        self.files = {}
+        self.collapsers = OrderedDict()
+
+
+def _collapse_chromosome_from_files(fns, chrom, threads=1, **kwargs):
+    "worker function for parallel import: collapses the reads of one chromosome using separate file handles"
+    with ExitStack() as stack:
+        aligns = {
+            sa: stack.enter_context(AlignmentFile(fn, "rb", threads=threads))
+            for sa, fn in fns.items()
+        }
+        return _collapse_chromosome(aligns, chrom, **kwargs)
+
+
+def _merged_reads(aligns, chrom):
+    "yields the alignments of chrom from several files as (file key, alignment) tuples, ordered by reference start"
+    return heapq.merge(
+        *(
+            zip(itertools.repeat(key), align.fetch(chrom))
+            for key, align in aligns.items()
+            if chrom in align.references
+        ),
+        key=lambda item: item[1].reference_start,
+    )
+
+
+def _collapse_chromosome(
+    aligns,
+    chrom,
+    chimeric_mincov,
+    use_satag,
+    sample_tag=None,
+    tag_samples=None,
+    clipping=False,
+    chimeric_buffer=None,
+    pbar=None,
+):
+    """Collapses the reads of one chromosome to transcripts, without assigning them to genes.
+
+    The reads of all files are merged by position. Coverage, TSS, PAS and (optionally) clipping of the transcripts are stored by sample.
+    If sample_tag is None, the reads are assigned to the sample name of the file, e.g. the key of the aligns dict.
+    Otherwise, the sample is determined by the value of the tag, which is looked up in tag_samples (if provided).
+
+    :param aligns: Dict with the opened AlignmentFiles.
+    :return: see :func:`_ReadCollapser.finalize`"""
+    # todo: potential issue here - secondary/chimeric alignments to
+    # non listed chromosomes are ignored
+    chr_len = next(
+        align.get_reference_length(chrom)
+        for align in aligns.values()
+        if chrom in align.references
+    )
+    collapser = _ReadCollapser(
+        chrom,
+        chr_len,
+        chimeric_mincov,
+        use_satag,
+        sample_tag,
+        tag_samples,
+        clipping,
+        chimeric_buffer,
+    )
+    for chunk in _read_chunks(_merged_reads(aligns, chrom)):
+        collapser.add_reads(chunk)
+        if pbar is not None:
+            pbar.update(len(chunk) / 2)
+    return collapser.finalize()
+
+
+class _ReadCollapser:
+    """Collapses the reads of one chromosome to transcripts, without assigning them to genes.
+
+    Reads can be added in any order, in chunks of (file sample, alignment) tuples."""
+
+    def __init__(
+        self,
+        chrom,
+        chr_len,
+        chimeric_mincov,
+        use_satag,
+        sample_tag=None,
+        tag_samples=None,
+        clipping=False,
+        chimeric_buffer=None,
+    ):
+        self.chrom = chrom
+        self.chr_len = chr_len
+        self.chimeric_mincov = chimeric_mincov
+        self.use_satag = use_satag
+        self.sample_tag = sample_tag
+        self.tag_samples = tag_samples
+        self.clipping = clipping
+        # multi-exon reads are collapsed by their intron chain, mono-exon reads need to overlap
+        self.transcripts = []
+        self.multi_exon = {}  # (strand, intron chain) -> transcript
+        self.mono_exon = IntervalArray(chr_len)  # intervaltree was pretty slow for this context
+        # parts of chimeric reads, by sample and read name
+        self.chimeric = _SpilledGroups(chimeric_buffer)
+        self.chimeric_samples = dict()  # samples with chimeric reads, in order of appearance
+        self.n_nonchimeric = dict()
+        self.n_reads = self.unmapped = self.n_secondary = self.n_untagged = 0
+
+    def add_reads(self, chunk):
+        "adds a list of (file sample, alignment) tuples"
+        self.n_reads += len(chunk)
+        reads = []
+        read_samples = []
+        for file_sample, read in chunk:
+            flag = read.flag  # check the flags before any other field of the alignment is decoded
+            if flag & 0x704:
+                if flag & 0x4:  # unmapped
+                    self.unmapped += 1
+                else:  # not primary alignment or failed qual check or PCR duplicate
+                    self.n_secondary += 1  # use only primary alignments
+                continue
+            if self.sample_tag is None:
+                sa = file_sample
+            elif not read.has_tag(self.sample_tag):
+                self.n_untagged += 1
+                continue
+            elif self.tag_samples is None:
+                sa = str(read.get_tag(self.sample_tag))
+            else:
+                sa = self.tag_samples.get(read.get_tag(self.sample_tag))
+                if sa is None:
+                    self.n_untagged += 1
+                    continue
+            reads.append(read)
+            read_samples.append(sa)
+        for sa, (read, exons) in zip(read_samples, _exons_from_reads(reads)):
+            strand = "-" if read.is_reverse else "+"
+            tr_range = (exons[0][0], exons[-1][1])
+            if tr_range[0] < 0 or tr_range[1] > self.chr_len:
+                logger.error(
+                    f"Alignment outside chromosome range: transcript at {tr_range} for chromosome {self.chrom} of length {self.chr_len}"
+                )
+                continue
+            # only the required tags are decoded
+            if read.has_tag("is"):
+                cov = read.get_tag("is")  # number of actual reads supporting this transcript
+            else:
+                cov = 1
+            has_satag = read.has_tag("SA")
+            if has_satag or read.flag & 0x800:  # part of a chimeric alignment
+                if self.chimeric_mincov > 0:  # otherwise ignore chimeric read
+                    # coverage of the parts is checked when the parts are merged
+                    self.chimeric_samples.setdefault(sa)
+                    parts = [
+                        (
+                            cov,
+                            [
+                                self.chrom,
+                                strand,
+                                exons,
+                                aligned_part(read.cigartuples, read.is_reverse),
+                                None,
+                            ],
+                        )
+                    ]
+                    if self.use_satag and has_satag:
+                        for snd_align in (
+                            part.split(",")
+                            for part in read.get_tag("SA").split(";")
+                            if part
+                        ):
+                            snd_cigartuples = cigar_string2tuples(snd_align[3])
+                            snd_exons = junctions_from_cigar(
+                                snd_cigartuples, int(snd_align[1])
+                            )
+                            parts.append(
+                                (
+                                    cov,
+                                    [
+                                        snd_align[0],
+                                        snd_align[2],
+                                        snd_exons,
+                                        aligned_part(snd_cigartuples, snd_align[2] == "-"),
+                                        None,
+                                    ],
+                                )
+                            )
+                            # logging.debug(chimeric[read.query_name])
+                    self.chimeric.extend((sa, read.query_name), parts)
+                continue
+            self.n_nonchimeric[sa] = self.n_nonchimeric.get(sa, 0) + cov
+            # did we see this transcript already?
+            if len(exons) > 1:
+                tr = self.multi_exon.get((strand, intron_chain(exons)))
+            else:
+                tr = next(
+                    (
+                        tr_interval.data
+                        for tr_interval in self.mono_exon.overlap(*tr_range)
+                        if tr_interval.data["strand"] == strand
+                    ),
+                    None,
+                )
+            if tr is not None:
+                sa_range = tr["range"].setdefault(sa, {})
+                sa_range[tr_range] = sa_range.get(tr_range, 0) + cov
+            else:
+                tr = {
+                    "exons": exons,
+                    "range": {sa: {tr_range: cov}},
+                    "strand": strand,
+                }
+                tr_interval = Interval(*tr_range, tr)
+                self.transcripts.append(tr_interval)
+                if len(exons) > 1:
+                    self.multi_exon[(strand, intron_chain(exons))] = tr
+                else:
+                    self.mono_exon.add(tr_interval)
+            # if genome_fh is not None:
+            #    mutations=get_mutations(read.cigartuples, read.query_sequence, genome_fh, chrom,read.reference_start,read.query_qualities)
+            #    for pos,ref,alt,qual in mutations:
+            #        tr.setdefault('mutations',{}).setdefault(sample_name,{}).setdefault(pos,{'ref':ref}).setdefault(alt,[0,[]])
+            #        tr['mutations'][sample_name][pos][alt][0]+=cov
+            #        if qual:
+            #            tr['mutations'][sample_name][pos][alt][1].append(qual) #assuming the quality already accounts for cov>1
+
+            if not self.clipping:
+                continue
+            clip = get_clipping(read.cigartuples, read.reference_start, read.is_reverse)
+            if clip is not None:
+                tr.setdefault("clipping", {}).setdefault(sa, {}).setdefault(clip, 0)
+                tr["clipping"][sa][clip] += cov
+
+    @property
+    def n_records(self):
+        "the number of collapsed transcripts and chimeric read parts, which determines the memory consumption"
+        return len(self.transcripts) + self.chimeric.n_values
+
+    def finalize(self):
+        """Computes TSS, PAS, coverage and median start/end of the collapsed transcripts.
+
+        :return: A tuple with 1) the transcripts as list of intervals, 2) the parts of chimeric reads on this chromosome,
+            as :class:`_SpilledGroups` with (sample, read name) keys and (coverage, part) values,
+            3) the number of reads, 4) the number of unmapped, 5) secondary and 6) untagged alignments and
+            7) the number of nonchimeric reads by sample, including samples with chimeric reads only."""
+        for tr_interval in self.transcripts:
+            tr = tr_interval.data
+            tr_ranges = tr.pop("range")
+            # tr_ranges=tr['range']
+            tr["TSS"], tr["PAS"], tr["coverage"] = {}, {}, {}
+            for sa, sa_ranges in tr_ranges.items():
+                starts, ends = {}, {}
+                for r, cov in sa_ranges.items():
+                    starts[r[0]] = starts.get(r[0], 0) + cov
+                    ends[r[1]] = ends.get(r[1], 0) + cov
+                tr["TSS"][sa] = starts if tr["strand"] == "+" else ends
+                tr["PAS"][sa] = starts if tr["strand"] == "-" else ends
+                tr["coverage"][sa] = sum(sa_ranges.values())
+            # tr['exons'][0][0]=min(r[0] for r in tr_ranges) #todo - instead of extremas take the median?
+            # tr['exons'][-1][1]=max(r[1] for r in tr_ranges)
+            _set_median_ends(tr)
+        for sa in self.chimeric_samples:
+            self.n_nonchimeric.setdefault(sa, 0)
+        return (
+            self.transcripts,
+            self.chimeric,
+            self.n_reads,
+            self.unmapped,
+            self.n_secondary,
+            self.n_untagged,
+            self.n_nonchimeric,
+        )
+
+
+def _read_chunks(reads, chunk_size=10000):
+    "splits an iterator of alignments into lists of at most chunk_size alignments"
+    reads = iter(reads)
+    while True:
+        chunk = list(itertools.islice(reads, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _exons_from_reads(reads):
+    "yields the alignments together with their exon positions, which are computed for all alignments at once"
+    starts, ends, idx = junctions_from_cigar_batch(
+        [read.cigartuples for read in reads], [read.reference_start for read in reads]
+    )
+    starts, ends, idx = starts.tolist(), ends.tolist(), idx.tolist()
+    for i, read in enumerate(reads):
+        yield read, [
+            [start, end]
+            for start, end in zip(starts[idx[i] : idx[i + 1]], ends[idx[i] : idx[i + 1]])
+        ]
+
+
+class _SpilledGroups:
+    """Groups values by key, keeping a bounded number of values in memory.
+
+    If more than max_values values are collected, the groups are sorted by key and written to a temporary file.
+    When iterating over the items, these files are merged, such that each group is reported once, in order of the keys.
+    As long as nothing was written to disk, the groups are reported in order of insertion, unless ordered is requested.
+    Within a group, the values are always in order of insertion.
+    The keys need to be sortable, and the values picklable.
+
+    :param max_values: Maximum number of values in memory, or None to keep all values in memory."""
+
+    def __init__(self, max_values=None):
+        self.max_values = max_values
+        self.groups = {}
+        self.n_values = 0
+        self.files = []
+
+    def extend(self, key, values):
+        "adds the values to the group of key"
+        self.groups.setdefault(key, []).extend(values)
+        self.n_values += len(values)
+        if self.max_values is not None and self.n_values > self.max_values:
+            self._spill()
+
+    def merge(self, other):
+        "adds all groups of other, which takes over the temporary files of other"
+        self.files.extend(other.files)
+        other.files = []
+        for key, values in other.groups.items():
+            self.extend(key, values)
+        other.groups = {}
+        other.n_values = 0
+
+    def _spill(self):
+        with tempfile.NamedTemporaryFile(
+            prefix="isotools_", suffix=".pkl", delete=False
+        ) as fh:
+            self.files.append(fh.name)
+            for key in sorted(self.groups):
+                pickle.dump((key, self.groups[key]), fh, pickle.HIGHEST_PROTOCOL)
+        self.groups = {}
+        self.n_values = 0
+
+    @staticmethod
+    def _read(fn):
+        with open(fn, "rb") as fh:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    return
+
+    def items(self, ordered=False):
+        """yields (key, values) tuples, with all values of the key
+
+        :param ordered: If True, the groups are reported in order of the keys, also if nothing was written to disk."""
+        if not self.files:
+            yield from (sorted(self.groups.items(), key=itemgetter(0)) if ordered else self.groups.items())
+            return
+        logger.debug(f"merging {len(self.files)} temporary files with grouped values")
+        runs = [self._read(fn) for fn in self.files]
+        runs.append(sorted(self.groups.items(), key=itemgetter(0)))
+        group_key, group = None, None
+        for key, values in heapq.merge(*runs, key=itemgetter(0)):
+            if group is not None and key == group_key:
+                group.extend(values)
+                continue
+            if group is not None:
+                yield group_key, group
+            group_key, group = key, values
+        if group is not None:
+            yield group_key, group
+
+    def close(self):
+        "removes the temporary files and all values"
+        for fn in self.files:
+            os.remove(fn)
+        self.files = []
+        self.groups = {}
+        self.n_values = 0
 
 
 def _add_chimeric(self, new_chimeric, min_cov, sa):
-    """add new chimeric transcripts to transcriptome, if covered by > min_cov reads"""
+    """add new chimeric transcripts to transcriptome, if covered by > min_cov reads
+
+    :param new_chimeric: Iterable of (breakpoints, list of chimeric reads) pairs."""
     total = 0
-    for new_bp, new_chim_list in new_chimeric.items():
+    for new_bp, new_chim_list in new_chimeric:
         n_reads = sum(cov for cov, _ in new_chim_list)
         if n_reads < min_cov:
             continue
         total += n_reads
+        chimeric_index = self._chimeric_index()
+        if new_bp not in self.chimeric:
+            self.chimeric[new_bp] = []
+            self._breakpoint_index_add(new_bp)
         for new_chim in new_chim_list:
             # should not contain: long intron, one part only (filtered by _check_chimeric),
             # todo: discard invalid (large overlaps, large gaps)
             # find equivalent chimeric reads
-            for found in self.chimeric.setdefault(new_bp, []):
-                if all(
-                    splice_identical(ch1[2], ch2[2])
-                    for ch1, ch2 in zip(new_chim[1], found[1])
-                ):
-                    # for sa in new_chim[0]:#add coverage
-                    found[0][sa] = found[0].get(sa, 0) + new_chim[0]
-                    # adjust start
-                    if found[1][0][1] == "+":  # strand of first part
-                        found[1][0][2][0][0] = min(
-                            found[1][0][2][0][0], new_chim[1][0][2][0][0]
-                        )
-                    else:
-                        found[1][0][2][0][1] = max(
-                            found[1][0][2][0][1], new_chim[1][0][2][0][1]
-                        )
-                    # adjust end
-                    if found[1][-1][1] == "+":  # strand of last part
-                        found[1][-1][2][-1][1] = max(
-                            found[1][-1][2][-1][1], new_chim[1][-1][2][-1][1]
-                        )
-                    else:
-                        found[1][-1][2][-1][0] = min(
-                            found[1][-1][2][-1][0], new_chim[1][-1][2][-1][0]
-                        )
-                    break
+            key = _chimeric_key(new_bp, new_chim[1])
+            found = chimeric_index.get(key)
+            if found is not None:
+                found[0][sa] = found[0].get(sa, 0) + new_chim[0]  # add coverage
+                # adjust start
+                if found[1][0][1] == "+":  # strand of first part
+                    found[1][0][2][0][0] = min(
+                        found[1][0][2][0][0], new_chim[1][0][2][0][0]
+                    )
+                else:
+                    found[1][0][2][0][1] = max(
+                        found[1][0][2][0][1], new_chim[1][0][2][0][1]
+                    )
+                # adjust end
+                if found[1][-1][1] == "+":  # strand of last part
+                    found[1][-1][2][-1][1] = max(
+                        found[1][-1][2][-1][1], new_chim[1][-1][2][-1][1]
+                    )
+                else:
+                    found[1][-1][2][-1][0] = min(
+                        found[1][-1][2][-1][0], new_chim[1][-1][2][-1][0]
+                    )
             else:  # not seen
                 new_chim[0] = {sa: new_chim[0]}
                 self.chimeric[new_bp].append(new_chim)
+                chimeric_index[key] = new_chim
                 for part in new_chim[1]:
                     if part[0] in self.data:
                         genes_ol = [
@@ -423,7 +1478,7 @@ def _add_chimeric(self, new_chimeric, min_cov, sa):
                         ]
                         # g,_=_get_intersects(genes_ol, part[2])
                         g, _, _, _ = _find_splice_sites(
-                            genes_ol, part[2]
+                            genes_ol, part[2], self._reference_splice_sites(part[0])
                         )  # take the best - ignore other hits here
                         if g is not None:
                             part[4] = g.name
@@ -433,6 +1488,48 @@ def _add_chimeric(self, new_chimeric, min_cov, sa):
     return total
 
 
+def _chimeric_key(bp, parts):
+    """Returns a hashable key for equivalent chimeric transcripts: the breakpoints and the intron chains of the parts.
+
+    Two chimeric reads with the same breakpoints are equivalent iff all parts are splice identical.
+    Mono-exon parts are pinned by the breakpoint, so they always overlap and their intron chain is empty."""
+    return bp, tuple(intron_chain(part[2]) for part in parts)
+
+
+def _chimeric_index(self):
+    """Returns the index of the chimeric transcripts by :func:`_chimeric_key`, which is built on first use."""
+    try:
+        return self._chim_idx
+    except AttributeError:
+        self._chim_idx = {
+            _chimeric_key(bp, chim[1]): chim
+            for bp, chim_list in self.chimeric.items()
+            for chim in chim_list
+        }
+        return self._chim_idx
+
+
+def _breakpoint_index(self):
+    """Returns an interval tree for each chromosome, with the positions of the breakpoints of the chimeric transcripts,
+    which is built on first use."""
+    try:
+        return self._bp_idx
+    except AttributeError:
+        self._bp_idx = {}
+        for bp in self.chimeric:
+            self._breakpoint_index_add(bp)
+        return self._bp_idx
+
+
+def _breakpoint_index_add(self, bp):
+    "adds the positions of the breakpoints of a chimeric transcript to the index, if it is built already"
+    if not hasattr(self, "_bp_idx"):
+        return
+    for chr1, _, pos1, chr2, _, pos2 in bp:
+        for chrom, pos in (chr1, pos1), (chr2, pos2):
+            self._bp_idx.setdefault(chrom, IntervalTree()).addi(pos, pos + 1, bp)
+
+
 def get_quantile(pos, percentile=0.5):
     """provided a list of (positions,coverage) pairs, return the median position"""
     total = sum(cov for _, cov in pos)
@@ -461,75 +1558,61 @@ def _breakpoints(chimeric):
     )
 
 
-def _check_chimeric(chimeric):
-    """prepare the chimeric reads:
+def _check_chimeric(new_chim):
+    """prepare a chimeric read:
     1) sort parts according to read order
     2) compute breakpoints
-    3) check if the chimeric read is actually a long introns - return list as nonchimeric
-    4) sort into dict by breakpoint - return dict as chimeric
-
-    chimeric[0] is the coverage
-    chimeric[1] is a list of tuples: chrom,strand,exons,[aligned start, end]"""
-
-    chimeric_dict = {}
-    non_chimeric = list()
-    skip = 0
-    for new_chim in chimeric.values():
-        if len(new_chim[1]) < 2:
-            skip += new_chim[0]
-            continue
-        merged_introns = []
-
-        # 1) sort
-        new_chim[1].sort(key=lambda x: x[3][1])  # sort by end of aligned part
-        # 2) compute breakpoints
-        bpts = _breakpoints(new_chim[1])  # compute breakpoints
-        # 3) check if long intron alignment spleits
-        merge = [
-            i
-            for i, bp in enumerate(bpts)
-            if bp[0] == bp[3]
-            and bp[1] == bp[4]  # same chr
-            and 0  # same strand,
-            < (bp[5] - bp[2] if bp[1] == "+" else bp[2] - bp[5])
-            < 1e6
-        ]  # max 1mb gap -> long intron
-        # todo: also check that the aligned parts have not big gap or overlap
-        if merge:
-            new_chim[1]
-            intron = 0
-            for i, part in enumerate(new_chim[1]):
-                intron += len(new_chim[1][i][2])
-                if i in merge:
-                    merged_introns.append(intron)
-
-            for i in merge:  # part i is merged into part i+1
-                if new_chim[1][i][1] == "+":  # merge into next part
-                    new_chim[1][i + 1][2] = new_chim[1][i][2] + new_chim[1][i + 1][2]
-                    new_chim[1][i + 1][3] = new_chim[1][i][3] + new_chim[1][i + 1][3]
-                else:
-                    new_chim[1][i + 1][2] = new_chim[1][i + 1][2] + new_chim[1][i][2]
-                    new_chim[1][i + 1][3] = new_chim[1][i + 1][3] + new_chim[1][i][3]
-            # remove redundant parts (i)
-            new_chim[1] = [part for i, part in enumerate(new_chim[1]) if i not in merge]
-            bpts = tuple(bp for i, bp in enumerate(bpts) if i not in merge)
-        # sort into chimeric (e.g. still breakpoints left) and nonchimeric (only one part and no breakpoints left)
-        if bpts:
-            chimeric_dict.setdefault(bpts, []).append(new_chim)
-        else:
-            assert len(new_chim[1]) == 1
-            non_chimeric.append(
-                [new_chim[0], new_chim[1][0], tuple(merged_introns)]
-            )  # coverage and "long introns"
-    if skip:
-        logger.warning(
-            f"ignored {skip} chimeric alignments with only one part aligned to specified chromosomes."
-        )
-    return chimeric_dict, non_chimeric
-
-
-def _add_sample_transcript(self, tr, chrom, sample_name, fuzzy_junction=5):
-    "add transcript to gene in chrom - return gene on success and None if no Gene was found"
+    3) check if the chimeric read is actually a long intron - in this case, the parts are merged
+
+    new_chim[0] is the coverage
+    new_chim[1] is a list of at least two parts: chrom,strand,exons,[aligned start, end],gene
+    :return: Tuple with the breakpoints that are left (empty for nonchimeric reads, which consist of a single part after merging)
+        and the number of exons before each merged long intron."""
+
+    merged_introns = []
+    # 1) sort
+    new_chim[1].sort(key=lambda x: x[3][1])  # sort by end of aligned part
+    # 2) compute breakpoints
+    bpts = _breakpoints(new_chim[1])  # compute breakpoints
+    # 3) check if long intron alignment spleits
+    merge = [
+        i
+        for i, bp in enumerate(bpts)
+        if bp[0] == bp[3]
+        and bp[1] == bp[4]  # same chr
+        and 0  # same strand,
+        < (bp[5] - bp[2] if bp[1] == "+" else bp[2] - bp[5])
+        < 1e6
+    ]  # max 1mb gap -> long intron
+    # todo: also check that the aligned parts have not big gap or overlap
+    if merge:
+        intron = 0
+        for i, part in enumerate(new_chim[1]):
+            intron += len(new_chim[1][i][2])
+            if i in merge:
+                merged_introns.append(intron)
+
+        for i in merge:  # part i is merged into part i+1
+            if new_chim[1][i][1] == "+":  # merge into next part
+                new_chim[1][i + 1][2] = new_chim[1][i][2] + new_chim[1][i + 1][2]
+                new_chim[1][i + 1][3] = new_chim[1][i][3] + new_chim[1][i + 1][3]
+            else:
+                new_chim[1][i + 1][2] = new_chim[1][i + 1][2] + new_chim[1][i][2]
+                new_chim[1][i + 1][3] = new_chim[1][i + 1][3] + new_chim[1][i][3]
+        # remove redundant parts (i)
+        new_chim[1] = [part for i, part in enumerate(new_chim[1]) if i not in merge]
+        bpts = tuple(bp for i, bp in enumerate(bpts) if i not in merge)
+    if not bpts:
+        assert len(new_chim[1]) == 1
+    return bpts, tuple(merged_introns)
+
+
+def _add_sample_transcript(self, tr, chrom, fuzzy_junction=5, pending=None):
+    """add transcript to gene in chrom - return gene on success and None if no Gene was found.
+    Sample specific attributes of tr (coverage, TSS, PAS, clipping) are dicts with the sample names as keys.
+
+    :param pending: If provided, new transcripts of reference genes are appended to this list, rather than compared to the reference,
+        such that they can be classified together with :func:`_annotate_pending`."""
     if chrom not in self.data:
         tr["annotation"] = (4, {"intergenic": []})
         return None
@@ -537,15 +1620,16 @@ def _add_sample_transcript(self, tr, chrom, sample_name, fuzzy_junction=5):
     genes_ol_strand = [g for g in genes_ol if g.strand == tr["strand"]]
     # check if transcript is already there (e.g. from other sample, or in case of long intron chimeric alignments also same sample):
     for g in genes_ol_strand:
-        for tr2 in g.transcripts:
-            if splice_identical(tr2["exons"], tr["exons"]):
-                _combine_transcripts(tr2, tr, sample_name)
-                return g
+        tr_idx = g.find_splice_identical(tr["exons"])
+        if tr_idx is not None:
+            if _combine_transcripts(g.transcripts[tr_idx], tr):
+                g._transcript_modified(tr_idx)  # the transcript start or end changed
+            return g
     # we have a new transcript (not seen in this or other samples)
     # check if gene is already there (e.g. from same or other sample):
     # g,_=_get_intersects(genes_ol, tr['exons'])
     g, ref_ol, additional, not_covered = _find_splice_sites(
-        genes_ol_strand, tr["exons"]
+        genes_ol_strand, tr["exons"], self._reference_splice_sites(chrom)
     )
     if g is not None:
         if (
@@ -555,23 +1639,31 @@ def _add_sample_transcript(self, tr, chrom, sample_name, fuzzy_junction=5):
                 tr, fuzzy_junction, modify=True
             )  # this modifies tr['exons']
             if shifts:
-                tr.setdefault("fuzzy_junction", {}).setdefault(sample_name, []).append(
-                    shifts
-                )  # keep the info, mainly for testing/statistics
-                for (
-                    tr2
-                ) in g.transcripts:  # check if correction made it identical to existing
-                    if splice_identical(tr2["exons"], tr["exons"]):
+                for sample_name in tr["coverage"]:
+                    tr.setdefault("fuzzy_junction", {}).setdefault(
+                        sample_name, []
+                    ).append(
+                        shifts
+                    )  # keep the info, mainly for testing/statistics
+                # check if correction made it identical to existing
+                tr_idx = g.find_splice_identical(tr["exons"])
+                if tr_idx is not None:
+                    tr2 = g.transcripts[tr_idx]
+                    for sample_name in tr["coverage"]:
                         tr2.setdefault("fuzzy_junction", {}).setdefault(
                             sample_name, []
                         ).append(
                             shifts
                         )  # keep the info, mainly for testing/statistics
-                        _combine_transcripts(tr2, tr, sample_name)
-                        return g
-            tr["annotation"] = g.ref_segment_graph.get_alternative_splicing(
-                tr["exons"], additional
-            )
+                    if _combine_transcripts(tr2, tr):
+                        g._transcript_modified(tr_idx)  # the transcript start or end changed
+                    return g
+            if pending is None:
+                tr["annotation"] = g.ref_segment_graph.get_alternative_splicing(
+                    tr["exons"], additional
+                )
+            else:  # the exons at this point are classified, the transcript start and end may change later
+                pending.append((g, tr, [tuple(e) for e in tr["exons"]], additional))
             if not_covered:
                 tr[
                     "novel_splice_sites"
@@ -589,56 +1681,71 @@ def _add_sample_transcript(self, tr, chrom, sample_name, fuzzy_junction=5):
                     new_gene
                 )  # todo: potential issue: in this case two genes may have grown together
                 self.data[chrom].remove(g)
+                self._index_gene(new_gene)
                 g = new_gene
         # if additional:
         #    tr['annotation']=(4,tr['annotation'][1]) #fusion transcripts... todo: overrule tr['annotation']
-        # this transcript is seen for the first time. Asign sample specific attributes to sample name
-        for what in "coverage", "TSS", "PAS":
-            tr[what] = {sample_name: tr[what]}
-        g.data.setdefault("transcripts", []).append(tr)
-        g.data["segment_graph"] = None  # gets recomputed on next request
-        g.data["coverage"] = None
+        # this transcript is seen for the first time
+        g.add_transcript(tr)
     else:
         # new novel gene
         tr["annotation"] = (4, _get_novel_type(genes_ol, genes_ol_strand, ref_ol))
     return g
 
 
-def _combine_transcripts(established, new_tr, sample_name):
-    "merge new_tr into splice identical established transcript"
-    try:
-        established["coverage"][sample_name] = (
-            established["coverage"].get(sample_name, 0) + new_tr["coverage"]
+def _annotate_pending(pending):
+    "classifies the new transcripts of reference genes collected by :func:`_add_sample_transcript`, in one batch per gene"
+    genes = {}
+    for g, tr, exons, additional in pending:
+        genes.setdefault(id(g), (g, []))[1].append((tr, exons, additional))
+    for g, new_transcripts in genes.values():
+        annotations = g.ref_segment_graph.get_alternative_splicing_batch(
+            [exons for _, exons, _ in new_transcripts], [additional for _, _, additional in new_transcripts]
         )
-        established["TSS"].setdefault(sample_name, {})
-        established["PAS"].setdefault(sample_name, {})
-        # TODO: check other infos that might get lost here
+        for (tr, _, _), annotation in zip(new_transcripts, annotations):
+            tr["annotation"] = annotation
+    pending.clear()
+
 
-        for side in "TSS", "PAS":
-            for pos, cov in new_tr[side].items():
-                established[side].setdefault(sample_name, {})[pos] = (
-                    established[side].get(sample_name, {}).get(pos, 0) + cov
+def _combine_transcripts(established, new_tr):
+    "merge new_tr into splice identical established transcript, returns True if the start or end of established changed"
+    ends = established["exons"][0][0], established["exons"][-1][1]
+    try:
+        for sample_name, cov in new_tr["coverage"].items():
+            established["coverage"][sample_name] = (
+                established["coverage"].get(sample_name, 0) + cov
+            )
+        # TODO: check other infos that might get lost here
+        for side in "TSS", "PAS", "clipping":
+            for sample_name, sa_pos in new_tr.get(side, {}).items():
+                established_pos = established.setdefault(side, {}).setdefault(
+                    sample_name, {}
                 )
+                for pos, cov in sa_pos.items():
+                    established_pos[pos] = established_pos.get(pos, 0) + cov
         # find median tss and pas
-        starts = [
-            v for sa in established["TSS"] for v in established["TSS"][sa].items()
-        ]
-        ends = [v for sa in established["PAS"] for v in established["PAS"][sa].items()]
-        if established["strand"] == "-":
-            starts, ends = ends, starts
-        established["exons"][0][0] = get_quantile(starts, 0.5)
-        established["exons"][-1][1] = get_quantile(ends, 0.5)
+        _set_median_ends(established)
         if "long_intron_chimeric" in new_tr:
-            for introns in new_tr["long_intron_chimeric"][sample_name]:
-                established.setdefault("long_intron_chimeric", {}).setdefault(
-                    sample_name, {}
-                ).setdefault(introns, 0)
-                established["long_intron_chimeric"][sample_name][introns] += new_tr[
-                    "long_intron_chimeric"
-                ][sample_name][introns]
+            for sample_name, sa_introns in new_tr["long_intron_chimeric"].items():
+                for introns, cov in sa_introns.items():
+                    established.setdefault("long_intron_chimeric", {}).setdefault(
+                        sample_name, {}
+                    ).setdefault(introns, 0)
+                    established["long_intron_chimeric"][sample_name][introns] += cov
     except:
         logger.error(f"error when merging {new_tr} into {established}")
         raise
+    return (established["exons"][0][0], established["exons"][-1][1]) != ends
+
+
+def _set_median_ends(tr):
+    "set the transcript start and end to the median TSS and PAS over all samples"
+    starts = [v for sa_tss in tr["TSS"].values() for v in sa_tss.items()]
+    ends = [v for sa_pas in tr["PAS"].values() for v in sa_pas.items()]
+    if tr["strand"] == "-":
+        starts, ends = ends, starts
+    tr["exons"][0][0] = get_quantile(starts, 0.5)
+    tr["exons"][-1][1] = get_quantile(ends, 0.5)
 
 
 def _get_novel_type(genes_ol, genes_ol_strand, ref_ol):
@@ -653,67 +1760,128 @@ def _get_novel_type(genes_ol, genes_ol_strand, ref_ol):
 
 
 def _add_novel_genes(
-    self, novel, chrom, sa, spj_iou_th=0, reg_iou_th=0.5, gene_prefix="PB_novel_"
+    self, novel, chrom, spj_iou_th=0, reg_iou_th=0.5, gene_prefix="PB_novel_"
 ):
-    '"novel" is a tree of transcript intervals (not Gene objects) ,e.g. from one chromosome, that do not overlap any annotated or unanntoated gene'
+    """"novel" is a tree of transcript intervals (not Gene objects) ,e.g. from one chromosome, that do not overlap any annotated or unanntoated gene.
+
+    The gene IDs are derived from the locus of the new gene (chromosome, start, end and strand), such that they do not depend on the order
+    of processing. If another gene with the same ID exists, a numeric suffix is added. The numeric ID of previous versions
+    (gene_prefix with the running number of novel genes) is kept as alias."""
     n_novel = self.novel_genes
     idx = {id(tr): i for i, tr in enumerate(novel)}
-    merge = list()
+    # disjoint sets of transcripts, that belong to the same gene
+    parent = list(range(len(idx)))
+    size = [1] * len(idx)
+    ordered = isinstance(novel, IntervalArray)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # path halving
+            i = parent[i]
+        return i
+
     for i, tr in enumerate(novel):
-        merge.append({tr})
-        candidates = [
-            c
-            for c in novel.overlap(tr.begin, tr.end)
-            if c.data["strand"] == tr.data["strand"] and idx[id(c)] < i
-        ]
-        for c in candidates:
-            if c in merge[i]:
+        for c in novel.overlap(tr.begin, tr.end):
+            c_idx = idx[id(c)]
+            if c_idx >= i:
+                if ordered:  # overlaps are reported in order of insertion
+                    break
+                continue
+            if c.data["strand"] != tr.data["strand"]:
+                continue
+            root_i, root_c = find(i), find(c_idx)
+            if root_i == root_c:  # already in the same gene
                 continue
             if is_same_gene(tr.data["exons"], c.data["exons"], spj_iou_th, reg_iou_th):
-                # add all transcripts of candidate
-                merge[i].update(merge[idx[id(c)]])
-        for c in merge[i]:  # update all overlapping (add the current to them)
-            merge[idx[id(c)]] = merge[i]
-
-    seen = set()
-    for trS in merge:
-        if id(trS) in seen:
-            continue
-        seen.add(id(trS))
+                if size[root_i] < size[root_c]:
+                    root_i, root_c = root_c, root_i
+                parent[root_c] = root_i
+                size[root_i] += size[root_c]
+
+    genes = {}  # root -> transcripts, in order of the first transcript
+    for i, tr in enumerate(novel):
+        genes.setdefault(find(i), []).append(tr)
+    for trS in genes.values():
         trL = [tr.data for tr in trS]
         strand = trL[0]["strand"]
         start = min(tr["exons"][0][0] for tr in trL)
         end = max(tr["exons"][-1][1] for tr in trL)
         if start >= end:
             logger.error(f"start>=end ({start}>={end}): {trL}")
-        for tr in trL:
-            tr["coverage"] = {sa: tr["coverage"]}
-            tr["TSS"] = {sa: tr["TSS"]}
-            tr["PAS"] = {sa: tr["PAS"]}
         n_novel += 1
         new_data = {
             "chr": chrom,
-            "ID": f"{gene_prefix}{n_novel:05d}",
+            "ID": _novel_gene_id(self.data.get(chrom), chrom, start, end, strand, gene_prefix),
+            "alias": f"{gene_prefix}{n_novel:05d}",
             "strand": strand,
             "transcripts": trL,
         }
-        self.data.setdefault(chrom, IntervalTree()).add(
-            Gene(start, end, new_data, self)
-        )
-        logger.debug(f"merging transcripts of novel gene {n_novel}: {trL}")
+        new_gene = Gene(start, end, new_data, self)
+        self.data.setdefault(chrom, IntervalTree()).add(new_gene)
+        self._index_gene(new_gene)
+        logger.debug("merging transcripts of novel gene %s: %s", n_novel, trL)
 
     self.infos["novel_counter"] = n_novel
 
 
-def _find_splice_sites(genes_ol, exons):
+def _novel_gene_id(genes, chrom, start, end, strand, gene_prefix="PB_novel_"):
+    """returns the locus derived ID for a novel gene, e.g. "PB_novel_chr1_1000_2000_plus".
+    The ID contains no separators of the region syntax (e.g. "chr1:1000-2000") and can be used in file names:
+    characters of the chromosome name other than letters, digits, "." and "-" are replaced by "_".
+    In case there is already a gene with this ID in genes (an IntervalTree), a suffix "_2", "_3", ... is added."""
+    chrom = re.sub(r"[^\w.-]", "_", chrom)
+    gene_id = f"{gene_prefix}{chrom}_{start}_{end}_{'plus' if strand == '+' else 'minus'}"
+    if genes is None:
+        return gene_id
+    # genes only grow, so genes with the same id still overlap the locus
+    known = {g.id for g in genes.overlap(start, end)}
+    i = 1
+    new_id = gene_id
+    while new_id in known:
+        i += 1
+        new_id = f"{gene_id}_{i}"
+    return new_id
+
+
+def _reference_splice_sites(self, chrom):
+    """Returns the potential splice sites of the reference genes on chrom, which are computed on first use.
+
+    As for :func:`SegmentGraph.find_splice_sites`, these are the node boundaries of the reference segment graphs,
+    which include the transcript start and end sites.
+
+    :return: A dict with (strand, site type, position) tuples as keys, where the site type is 0 for donors (node ends)
+        and 1 for acceptors (node starts) with respect to the forward strand, and the set of gene ids using the site as values.
+    """
+    try:
+        sites = self._ref_splice_sites
+    except AttributeError:
+        sites = self._ref_splice_sites = {}
+    if chrom not in sites:
+        chrom_sites = {}
+        for g in self.data.get(chrom, ()):
+            if not g.is_annotated:
+                continue
+            for node in g.ref_segment_graph:
+                chrom_sites.setdefault((g.strand, 0, node.end), set()).add(g.id)
+                chrom_sites.setdefault((g.strand, 1, node.start), set()).add(g.id)
+        sites[chrom] = chrom_sites
+    return sites[chrom]
+
+
+def _find_splice_sites(genes_ol, exons, ref_sites=None):
     """check the splice site intersect of all overlapping genes and return
     1) the best gene, 2) exonic reference gene overlap 3) names of genes that cover additional splice sites, and 4) splice sites that are not covered.
-    For mono-exon genes return the gene with largest exonic overlap"""
+    For mono-exon genes return the gene with largest exonic overlap.
+
+    :param ref_sites: The splice sites of the reference genes, see :func:`_reference_splice_sites`.
+        If provided, the splice sites of the reference genes are looked up there, rather than in the segment graphs.
+        The exonic reference gene overlap is then only computed if the best gene is not a reference gene, otherwise None is returned.
+    """
     if genes_ol:
         ref_ol = {
             g.name: g.ref_segment_graph.get_overlap(exons)
             for g in genes_ol
-            if g.is_annotated
+            if g.is_annotated and (len(exons) == 1 or ref_sites is None)
         }
         if len(exons) == 1:  # no splice sites, but return gene with largest overlap
             ol = np.array(
@@ -728,14 +1896,29 @@ def _find_splice_sites(genes_ol, exons):
             if ol[best_idx] > 0:
                 return genes_ol[best_idx], ref_ol, None, None
         else:
-            splice_sites = np.array(
-                [
-                    g.ref_segment_graph.find_splice_sites(exons)
-                    if g.is_annotated
-                    else g.segment_graph.find_splice_sites(exons)
-                    for g in genes_ol
-                ]
-            )
+            if ref_sites is None:
+                splice_sites = np.array(
+                    [
+                        g.ref_segment_graph.find_splice_sites(exons)
+                        if g.is_annotated
+                        else g.segment_graph.find_splice_sites(exons)
+                        for g in genes_ol
+                    ]
+                )
+            else:
+                splice_sites = np.zeros((len(genes_ol), (len(exons) - 1) * 2), dtype=bool)
+                gene_idx = {}
+                for i, g in enumerate(genes_ol):
+                    if g.is_annotated:
+                        gene_idx[g.id] = i
+                    else:
+                        splice_sites[i] = g.segment_graph.find_splice_sites(exons)
+                strand = genes_ol[0].strand
+                for j, pos in enumerate(intron_chain(exons)):
+                    for gene_id in ref_sites.get((strand, j % 2, pos), ()):
+                        i = gene_idx.get(gene_id)
+                        if i is not None:
+                            splice_sites[i, j] = True
             sum_ol = splice_sites.sum(1)
             try:  # find index of reference gene that covers the most splice sites
                 best_idx = next(
@@ -745,6 +1928,16 @@ def _find_splice_sites(genes_ol, exons):
                 )
             except StopIteration:  # no reference gene
                 best_idx = sum_ol.argmax()  # include non reference genes
+            if ref_sites is not None:  # overlap is required for novel transcripts only
+                ref_ol = (
+                    None
+                    if sum_ol[best_idx] > 0 and genes_ol[best_idx].is_annotated
+                    else {
+                        g.name: g.ref_segment_graph.get_overlap(exons)
+                        for g in genes_ol
+                        if g.is_annotated
+                    }
+                )
             if sum_ol[best_idx] > 0:
                 not_in_best = np.where(~splice_sites[best_idx])[0]
                 additional = splice_sites[
@@ -931,6 +2124,7 @@ def collapse_immune_genes(self, maxgap=300000):
                         self.data[chrom].add(new_gene)
                         num[itype] += 1
                         offset = i + 1
+    self.make_index()  # reference genes have changed
     logger.info(
         f'collapsed {num["IG"]} immunoglobulin loci and  {num["TR"]} T-cell receptor loci'
     )
@@ -1199,7 +2393,8 @@ def transcript_table(
     Exports all transcript isoforms within region to a table.
 
     :param region: Specify the region, either as (chr, start, end) tuple or as "chr:start-end" string. If omitted specify the complete genome.
-    :param extra_columns: Specify the additional information added to the table. Valid examples are "annotation", "coverage", or any other transcrit property as defined by the key in the transcript dict.
+    :param extra_columns: Specify the additional information added to the table. Valid examples are "annotation", "coverage",
+        or any other transcrit property as defined by the key in the transcript dict.
     :param include: Specify required flags to include transcripts.
     :param remove: Specify flags to ignore transcripts.
     :param min_coverage: minimum required total coverage.
@@ -1255,6 +2450,7 @@ def chimeric_table(
     This table contains relevant infos about breakpoints and coverage for chimeric genes.
 
     :param region: Specify the region, either as (chr, start, end) tuple or as "chr:start-end" string. If omitted specify the complete genome.
+        Chimeric transcripts with at least one breakpoint within the region are reported.
     :param include: Specify required flags to include transcripts.
     :param remove: Specify flags to ignore transcripts.
     """
@@ -1265,8 +2461,28 @@ def chimeric_table(
     #    star_chimeric=dict()
     # assert isinstance(star_chimeric, dict)
 
+    if region is None:
+        breakpoints = self.chimeric
+    else:
+        if isinstance(region, str):
+            chrom, start, end = region, None, None  # whole chromosome
+            if ":" in region:
+                try:
+                    chrom, pos = region.split(":")
+                    start, end = [int(v) for v in pos.split("-")]
+                except ValueError:
+                    raise ValueError(
+                        f'incorrect region {region} - specify as string "chr:start-end" or tuple ("chr",start,end)'
+                    )
+        else:
+            chrom, start, end = region
+        bp_tree = self._breakpoint_index().get(chrom, IntervalTree())
+        if start is not None:
+            bp_tree = bp_tree[int(start) : int(end)]
+        breakpoints = sorted({iv.data for iv in bp_tree})
     chim_tab = list()
-    for bp, chimeric in self.chimeric.items():
+    for bp in breakpoints:
+        chimeric = self.chimeric[bp]
         cov = tuple(sum(c.get(sa, 0) for c, _ in chimeric) for sa in self.samples)
         genes = [
             info[4] if info[4] is not None else "intergenic" for info in chimeric[0][1]
@@ -1380,6 +2596,7 @@ def export_alternative_splicing(
     region=None,
     include=None,
     remove=None,
+    event_matrix=None,
 ):
     """Exports alternative splicing events defined by the transcriptome.
 
@@ -1401,6 +2618,8 @@ def export_alternative_splicing(
     :param samples: Specify the samples to consider
     :param min_total: Minimum total coverage over all selected samples.
     :param min_alt_fraction: Minimum fraction of reads supporting the alternative.
+    :param event_matrix: The EventMatrix of the transcriptome (see :func:`event_matrix`), which provides the coverage of the events.
+        If omitted, the coverage is determined from the genes.
 
     """
     if out_format == "miso":
@@ -1427,6 +2646,14 @@ def export_alternative_splicing(
     sidx = np.array([sa_dict[sa] for sa in samples])
 
     assert 0 < min_alt_fraction < 0.5, "min_alt_fraction must be > 0 and < 0.5"
+    selected = None
+    if event_matrix is not None and not reference:
+        event_matrix._check(self)
+        # the splice bubbles (gene id and index of the bubble) with sufficient coverage
+        covered = event_matrix._covered(samples, min_total, min_alt_fraction)[0]
+        covered &= event_matrix.events["splice_type"].isin(list(types)).values
+        selected = set(zip(event_matrix.events.loc[covered, "gene_id"], event_matrix.events.loc[covered, "bubble"]))
+        selected_genes = {gene_id for gene_id, _ in selected}
     count = {st: 0 for st in types.values()}
     with ExitStack() as stack:
         fh = {st: stack.enter_context(open(out_file[st], "w")) for st in out_file}
@@ -1481,14 +2708,21 @@ def export_alternative_splicing(
         for g in self.iter_genes(region, include, remove):
             if reference and not g.is_annotated:
                 continue
+            elif selected is not None:
+                if g.id not in selected_genes:
+                    continue
             elif not reference and g.coverage[sidx, :].sum() < min_total:
                 continue
 
             seg_graph = g.ref_segment_graph if reference else g.segment_graph
-            for setA, setB, nodeX, nodeY, splice_type in seg_graph.find_splice_bubbles(
-                types=("ES", "3AS", "5AS", "IR", "ME")
-            ):
-                if not reference:
+            for bubble, (setA, setB, nodeX, nodeY, splice_type) in enumerate(seg_graph._splice_bubbles()):
+                if splice_type not in types:
+                    continue
+                setA, setB = list(setA), list(setB)
+                if selected is not None:
+                    if (g.id, bubble) not in selected:
+                        continue
+                elif not reference:
                     junction_cov = g.coverage[np.ix_(sidx, setA)].sum(1)
                     total_cov = g.coverage[np.ix_(sidx, setB)].sum(1) + junction_cov
                     if total_cov.sum() < min_total or (
@@ -1698,48 +2932,61 @@ def get_gff_chrom_dict(gff, chromosomes):
 
 
 class IntervalArray:
-    """drop in replacement for the interval tree during construction, with faster lookup"""
-
-    def __init__(self, total_size, bin_size=1e4):
-        self.obj = {}
-        self.data = [set() for _ in range(int((total_size) // bin_size) + 1)]
-        self.bin_size = bin_size
-
-    def overlap(self, begin, end):
-        try:
-            candidates = {
-                obj_id
-                for idx in range(
-                    int(begin // self.bin_size), int(end // self.bin_size) + 1
-                )
-                for obj_id in self.data[idx]
-            }
-        except IndexError:
+    """drop in replacement for the interval tree during construction, with faster lookup
+
+    Intervals are stored by insertion index in a hierarchy of bins: on each level, the bin size increases by factor,
+    and each interval is stored on the lowest level where it spans at most max_bins bins. Only bins that contain intervals
+    are allocated, so memory depends on the number of intervals rather than the size of the chromosome, and long
+    intervals do not need to be added to many bins. Overlaps are reported in order of insertion, to make the results reproducible."""
+
+    def __init__(self, total_size, bin_size=1e4, max_bins=8, factor=16):
+        self.obj = []
+        self.total_size = total_size
+        self.bin_sizes = [int(bin_size)]
+        while self.bin_sizes[-1] * max_bins <= total_size:
+            self.bin_sizes.append(self.bin_sizes[-1] * factor)
+        self.bins = [{} for _ in self.bin_sizes]
+        self.max_bins = max_bins
+
+    def _check_range(self, begin, end, what):
+        if begin < 0 or end > self.total_size:
             logger.error(
-                f"requesting interval between {begin} and {end}, but array is allocated only until position {len(self.data)*self.bin_size}"
+                f"{what} interval between {begin} and {end}, but array is allocated only until position {self.total_size}"
             )
-            raise
-        return (
-            self.obj[obj_id]
-            for obj_id in candidates
-            if overlap((begin, end), self.obj[obj_id])
-        )  # this assumes object has range obj[0] to obj[1]
+            raise IndexError(f"interval {begin}-{end} out of range")
+
+    def overlap(self, begin, end):
+        self._check_range(begin, end, "requesting")
+        sources = []
+        for bin_size, level_bins in zip(self.bin_sizes, self.bins):
+            if level_bins:
+                for idx in range(begin // bin_size, end // bin_size + 1):
+                    src = level_bins.get(idx)
+                    if src is not None:
+                        sources.append(src)
+        if not sources:
+            return iter(())
+        if len(sources) == 1:
+            candidates = sources[0]  # already in insertion order
+        else:
+            candidates = sorted(set().union(*sources))
+        obj = self.obj
+        # this assumes object has range obj[0] to obj[1]
+        return (obj[i] for i in candidates if obj[i][0] <= end and begin <= obj[i][1])
 
     def add(self, obj):
-        self.obj[id(obj)] = obj
-        try:
-            for idx in range(
-                int(obj.begin // self.bin_size), int(obj.end // self.bin_size) + 1
-            ):
-                self.data[idx].add(id(obj))
-        except IndexError:
-            logger.error(
-                f"adding interval from {obj.begin} to {obj.end}, but array is allocated only until position {len(self.data)*self.bin_size}"
-            )
-            raise
+        self._check_range(obj.begin, obj.end, "adding")
+        obj_idx = len(self.obj)
+        for bin_size, level_bins in zip(self.bin_sizes, self.bins):
+            first, last = obj.begin // bin_size, obj.end // bin_size
+            if last - first < self.max_bins or level_bins is self.bins[-1]:
+                break
+        for idx in range(first, last + 1):
+            level_bins.setdefault(idx, []).append(obj_idx)
+        self.obj.append(obj)
 
     def __len__(self):
         return len(self.obj)
 
     def __iter__(self):
-        return (v for v in self.obj.values())
+        return iter(self.obj)
@@ -1,10 +1,16 @@
 import itertools
 import logging
+import pickle
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
 
 import numpy as np
 import pandas as pd
 import statsmodels.stats.multitest as multi
 from scipy.optimize import minimize
+from scipy.sparse import csr_matrix, issparse
+from scipy.sparse import vstack as sparse_vstack
 from scipy.special import gammaln, polygamma  # pylint: disable-msg=E0611
 from scipy.stats import (
     betabinom,
@@ -137,7 +143,7 @@ def betabinom_lr_test(x, n):
     if any(ni.sum() == 0 for ni in n):
         return (
             np.nan,
-            [None, None],
+            [None] * 6,
         )  # one group is not covered at all - no test possible. Checking this to avoid RuntimeWarnings (Mean of empty slice)
     x_all, n_all = (np.concatenate(x), np.concatenate(n))
     # calculate ml parameters
@@ -170,12 +176,521 @@ def betabinom_ll(x, n, a, b):
         return betabinom.logpmf(x, n, a, b).sum()
 
 
+def betabinom_ml_batch(x, n, max_iter=100, tol=1e-8):
+    """Calculate maximum likelihood parameters of beta binomial distributions for many events at once.
+
+    Fits all events together by a damped Newton iteration on log(a) and log(b), starting from the same moment estimates as betabinom_ml.
+    Events that do not converge, or where the estimates run towards zero, are fitted individually by betabinom_ml.
+
+    :param x: number of successes, as 2d numpy array (events x samples). Samples with n=0 are ignored, so events can be padded with zeros.
+    :param n: number of trials, as 2d numpy array (events x samples)
+    :return: The arrays a and b of the ml parameters and a boolean array indicating success.
+        If all samples of an event have the same proportion, b is nan and a is the proportion (binomial case)."""
+    x, n = np.asarray(x, dtype=float), np.asarray(n, dtype=float)
+    covered = n > 0
+    n_samples = covered.sum(1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        prob = np.where(covered, x / np.where(covered, n, 1), 0)
+        m = prob.sum(1) / n_samples  # estimate initial parameters
+        d = np.where(covered, (prob - m[:, None]) ** 2, 0).sum(1) / n_samples
+    a, b = m.copy(), np.full(len(x), np.nan)
+    success = n_samples > 0
+    a[~success] = np.nan
+    fit = np.flatnonzero(success & (d > 0))
+    if len(fit):
+        a[fit], b[fit], converged = _betabinom_newton(x[fit], n[fit], m[fit], np.maximum(d[fit], 1e-6), max_iter, tol)
+        for i in fit[~converged]:  # fall back to the individual fit
+            params, _, success[i] = betabinom_ml(x[i], n[i])
+            a[i], b[i] = params
+    return a, b, success
+
+
+def _betabinom_loglike(x, n, a, b):
+    "log likelihood of betabinomial for each event (without the terms that do not depend on a and b), and its first and second derivatives"
+    a, b = a[:, None], b[:, None]
+    ll = (gammaln(x + a) - gammaln(a) + gammaln(n - x + b) - gammaln(b) + gammaln(a + b) - gammaln(n + a + b)).sum(1)
+    e = polygamma(0, a + b) - polygamma(0, n + a + b)
+    da = (e + polygamma(0, x + a) - polygamma(0, a)).sum(1)
+    db = (e + polygamma(0, n - x + b) - polygamma(0, b)).sum(1)
+    e = polygamma(1, a + b) - polygamma(1, n + a + b)
+    daa = (e + polygamma(1, x + a) - polygamma(1, a)).sum(1)
+    dbb = (e + polygamma(1, n - x + b) - polygamma(1, b)).sum(1)
+    return ll, da, db, daa, dbb, e.sum(1)
+
+
+def _betabinom_newton(x, n, m, d, max_iter, tol):
+    "damped Newton iteration for the ml parameters of the beta binomial, on log scale to keep the parameters positive"
+    e = m**2 - m + d
+    a, b = -m * e / d, (m - 1) * e / d
+    invalid = (a <= 0) | (b <= 0)  # moment estimates not defined if variance exceeds binomial variance
+    a[invalid], b[invalid] = m[invalid], 1 - m[invalid]
+    lam = np.full(len(x), 1e-3)  # damping
+    converged = np.zeros(len(x), bool)
+    active = np.arange(len(x))
+    ll, da, db, daa, dbb, dab = _betabinom_loglike(x, n, a, b)
+    for _ in range(max_iter):
+        # gradient and (negative) hessian with respect to u=log(a) and v=log(b)
+        aa, bb = a[active], b[active]
+        gu, gv = aa * da[active], bb * db[active]
+        huu, hvv, huv = -(aa**2 * daa[active] + gu), -(bb**2 * dbb[active] + gv), -aa * bb * dab[active]
+        huu, hvv = huu + lam[active] * np.abs(huu), hvv + lam[active] * np.abs(hvv)
+        det = huu * hvv - huv**2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            step_u, step_v = (hvv * gu - huv * gv) / det, (huu * gv - huv * gu) / det
+        bad = ~(det > 0) | ~np.isfinite(step_u) | ~np.isfinite(step_v)  # not positive definite: gradient ascent
+        step_u[bad], step_v[bad] = gu[bad] / (1 + np.abs(gu[bad])), gv[bad] / (1 + np.abs(gv[bad]))
+        step_u, step_v = np.clip(step_u, -2, 2), np.clip(step_v, -2, 2)
+        new_a, new_b = aa * np.exp(step_u), bb * np.exp(step_v)
+        new = _betabinom_loglike(x[active], n[active], new_a, new_b)
+        better = new[0] >= ll[active]
+        idx = active[better]
+        a[idx], b[idx] = new_a[better], new_b[better]
+        ll[idx], da[idx], db[idx], daa[idx], dbb[idx], dab[idx] = (v[better] for v in new)
+        lam[idx] /= 10
+        lam[active[~better]] *= 10
+        gu, gv = a[active] * da[active], b[active] * db[active]
+        scale = tol * (1 + np.abs(ll[active]))
+        done = (np.abs(gu) < scale) & (np.abs(gv) < scale)
+        converged[active[done]] = True
+        # no overdispersion: the likelihood increases towards the binomial (a+b to infinity), with the pooled proportion
+        binomial = ~done & (a[active] + b[active] > 1e6) & (gu + gv >= 0)
+        idx = active[binomial]
+        total, mu = a[idx] + b[idx], x[idx].sum(1) / n[idx].sum(1)
+        a[idx], b[idx] = mu * total, (1 - mu) * total
+        converged[idx] = True
+        done |= binomial
+        active = active[~done & (lam[active] < 1e10)]
+        if not len(active):
+            break
+    # estimates at the lower boundary are left for betabinom_ml, which bounds the parameters
+    converged &= (a > 1e-6) & (b > 1e-6)
+    return a, b, converged
+
+
+def _params_alt(a, b, success):
+    "alternative parametrization (mu and disp) for the results of betabinom_ml_batch"
+    params = []
+    for ai, bi, si in zip(a.tolist(), b.tolist(), success.tolist()):
+        if np.isnan(ai):
+            params.append((None, None))
+        elif np.isnan(bi):
+            params.append((ai, None))
+        else:
+            params.append((ai / (ai + bi), ai * bi / ((ai + bi) ** 2 * (ai + bi + 1))))
+    return params
+
+
+def _betabinom_ll_batch(x, n, a, b):
+    "log likelihood of the fits of betabinom_ml_batch for each event"
+    ll = np.zeros(len(x))
+    binomial = np.isnan(b)
+    ll[binomial] = binom.logpmf(x[binomial], n[binomial], a[binomial, None]).sum(1)
+    ll[~binomial] = betabinom.logpmf(x[~binomial], n[~binomial], a[~binomial, None], b[~binomial, None]).sum(1)
+    return ll
+
+
+def betabinom_lr_test_batch(x, n):
+    """Likelihood ratio test with random-effects betabinomial model for many events at once.
+
+    Same as betabinom_lr_test, but the maximum likelihood parameters of all events are fitted together with betabinom_ml_batch.
+
+    :param x: coverage of the alternative for the two sample groups, as 2d numpy arrays (events x samples)
+    :param n: total coverage for the two sample groups, as 2d numpy arrays (events x samples)
+    :return: The p-values as numpy array, and the list of parameters (PSI and dispersion for both groups and in total) for each event"""
+    x = [np.asarray(xi, dtype=float) for xi in x]
+    n = [np.asarray(ni, dtype=float) for ni in n]
+    x_all, n_all = np.concatenate(x, axis=1), np.concatenate(n, axis=1)
+    testable = (n[0].sum(1) > 0) & (n[1].sum(1) > 0)
+    pval = np.full(len(x_all), np.nan)
+    params = [[None] * 6 for _ in range(len(x_all))]
+    if not testable.any():
+        return pval, params
+    fits = [betabinom_ml_batch(xi[testable], ni[testable]) for xi, ni in zip(x + [x_all], n + [n_all])]
+    success = fits[0][2] & fits[1][2] & fits[2][2]
+    l0 = _betabinom_ll_batch(x_all[testable], n_all[testable], fits[2][0], fits[2][1])
+    l1 = sum(_betabinom_ll_batch(xi[testable], ni[testable], *fit[:2]) for xi, ni, fit in zip(x, n, fits))
+    pval[testable] = np.where(success, chi2.sf(2 * (l1 - l0), 2), np.nan)
+    for i, p1, p2, p0 in zip(np.flatnonzero(testable), *(_params_alt(*fit) for fit in fits)):
+        params[i] = list(p1 + p2 + p0)
+    return pval, params
+
+
 TESTS = {
     "betabinom_lr": betabinom_lr_test,
     "binom_lr": binom_lr_test,
     "proportions": proportion_test,
 }
 
+BATCH_TESTS = {"betabinom_lr": betabinom_lr_test_batch}  # tests of many events at once
+
+
+EVENT_TYPES = ("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")
+
+
+def _test_chunk(x, n, test):
+    "the test of each event in a chunk of events, which can be evaluated in a worker process"
+    return [test([xi[i] for xi in x], [ni[i] for ni in n]) for i in range(len(x[0]))]
+
+
+def _event_matrix_chunk(genes, types, min_total, n_samples):
+    """The events and their coverage for a chunk of genes, which can be evaluated in a worker process.
+
+    :param genes: List of tuples with name, id, chromosome, strand, segment graph, its cached splice bubbles (or None),
+        reference segment graph (or None if there are no known events or they are cached), cached positions of the known events
+        (or None) and the coverage of the selected samples of the genes. The cached results are not pickled with the segment graphs,
+        so they are passed separately to worker processes.
+    :return: The list of events, and the coverage of the alternative and the total coverage (events x samples)."""
+    events, in_cov, total_cov = [], [], []
+    for name, gene_id, chrom, strand, sg, bubbles, ref_sg, known, coverage in genes:
+        # find annotated alternatives for gene (e.g. known events)
+        if known is None:
+            known = {} if ref_sg is None else ref_sg.get_bubble_positions()
+        if bubbles is None:
+            bubbles = sg._splice_bubbles()
+        for bubble, (setA, setB, nX, nY, splice_type) in enumerate(bubbles):
+            if splice_type not in types:
+                continue
+            junction_cov = coverage[:, list(setB)].sum(1)
+            total = coverage[:, list(setA)].sum(1) + junction_cov
+            if total.sum() < min_total:
+                continue
+            if splice_type in ["TSS", "PAS"]:
+                start, end = sg[nX].start, sg[nY].end
+                if (splice_type == "TSS") == (strand == "+"):
+                    novel = end not in known.get(splice_type, set())
+                else:
+                    novel = start not in known.get(splice_type, set())
+            else:
+                start, end = sg[nX].end, sg[nY].start
+                novel = (start, end) not in known.get(splice_type, set())
+            events.append((name, gene_id, chrom, strand, start, end, splice_type, novel, bubble))
+            in_cov.append(junction_cov)
+            total_cov.append(total)
+    return events, np.array(in_cov).reshape(len(events), n_samples), np.array(total_cov).reshape(len(events), n_samples)
+
+
+def _event_matrix_gene(g, sidx):
+    "the data of a gene needed by :func:`_event_matrix_chunk`, including the splice bubbles cached in the main process"
+    sg = g.segment_graph
+    ref_sg = g.ref_segment_graph if g.is_annotated else None
+    known = None if ref_sg is None else ref_sg.__dict__.get("_bubble_positions")
+    return g.name, g.id, g.chrom, g.strand, sg, sg.__dict__.get("_bubbles"), ref_sg if known is None else None, known, g.coverage[sidx]
+
+
+def _fingerprint(self):
+    "the samples and the number of transcripts of each gene, which identify the state of the transcriptome for an EventMatrix"
+    return list(self.samples), {g.id: g.n_transcripts for g in self}
+
+
+class EventMatrix:
+    """The alternative splicing events of a transcriptome and their coverage in the samples.
+
+    The matrix is created by :func:`isotools.Transcriptome.event_matrix`, which enumerates the splice bubbles of all genes once.
+    Tests of different groups (:func:`EventMatrix.altsplice_test`), the embedding (:func:`isotools.plots.plot_embedding`)
+    and the export of the events then only index the coverage arrays.
+    As the events refer to the splice bubbles of the segment graphs, the matrix must be created again when samples are added
+    or transcripts are removed. The samples and the number of transcripts of each gene are recorded as fingerprint,
+    and using the matrix with a transcriptome that does not match raises a ValueError.
+
+    :param events: Table with gene name and id, chromosome, strand, start, end, type and novelty of the events,
+        and the index of the splice bubble in the segment graph of the gene.
+    :param samples: The sample names, corresponding to the columns of the coverage arrays.
+    :param in_cov: The coverage of the alternative (events x samples), as numpy array or scipy sparse matrix.
+    :param total_cov: The total coverage of the events (events x samples), as numpy array or scipy sparse matrix.
+    :param fingerprint: The samples of the transcriptome and the number of transcripts of each gene, as recorded by :func:`isotools.Transcriptome.event_matrix`.
+        If omitted, the matrix is not checked against the transcriptome."""
+
+    def __init__(self, events, samples, in_cov, total_cov, fingerprint=None):
+        self.events = events
+        self.samples = list(samples)
+        self.in_cov = in_cov
+        self.total_cov = total_cov
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.events)
+
+    def __repr__(self):
+        return f"{type(self).__name__} with {len(self)} events in {len(self.samples)} samples"
+
+    def save(self, pickle_file):
+        """Saves the event matrix in a pickle file.
+
+        :param pickle_file: Filename to save data"""
+        logger.info(f"saving event matrix to {pickle_file}")
+        with open(pickle_file, "wb") as fh:
+            pickle.dump(self, fh)
+
+    @classmethod
+    def load(cls, pickle_file) -> "EventMatrix":
+        """Restores an event matrix from a pickle file.
+
+        :param pickle_file: Filename to restore data"""
+        logger.info(f"loading event matrix from {pickle_file}")
+        with open(pickle_file, "rb") as fh:
+            return pickle.load(fh)
+
+    def coverage(self, samples=None):
+        """Returns the coverage of the events in selected samples as dense arrays.
+
+        :param samples: List of sample names. If omitted, all samples are selected.
+        :return: The coverage of the alternative and the total coverage (events x samples)."""
+        if samples is None:
+            idx = slice(None)
+        else:
+            sa_idx = {sa: i for i, sa in enumerate(self.samples)}
+            notfound = [sa for sa in samples if sa not in sa_idx]
+            if notfound:
+                raise ValueError(f"Cannot find the following samples: {notfound}")
+            idx = [sa_idx[sa] for sa in samples]
+        return tuple(cov[:, idx].toarray() if issparse(cov) else cov[:, idx] for cov in (self.in_cov, self.total_cov))
+
+    def select(self, events):
+        """Returns the event matrix of a subset of the events.
+
+        :param events: Boolean mask or indices of the selected events."""
+        events = np.asarray(events)
+        if events.dtype == bool:
+            events = np.flatnonzero(events)
+        return type(self)(
+            self.events.iloc[events].reset_index(drop=True), self.samples, self.in_cov[events], self.total_cov[events], self.fingerprint
+        )
+
+    def _check(self, transcriptome):
+        "raises a ValueError if the matrix was created for a different state of the transcriptome"
+        if self.fingerprint is None:
+            return
+        samples, n_transcripts = _fingerprint(transcriptome)
+        if samples != self.fingerprint[0]:
+            raise ValueError(
+                f"The event matrix was created for the samples {self.fingerprint[0]}, but the transcriptome has the samples {samples}. "
+                "Please create the event matrix again."
+            )
+        if n_transcripts != self.fingerprint[1]:
+            changed = [gene_id for gene_id in n_transcripts.keys() | self.fingerprint[1].keys() if n_transcripts.get(gene_id) != self.fingerprint[1].get(gene_id)]
+            raise ValueError(
+                f"The transcripts of {len(changed)} genes (e.g. {changed[0]}) changed since the event matrix was created. "
+                "Please create the event matrix again."
+            )
+
+    def _covered(self, samples, min_total, min_alt_fraction):
+        "mask of the events with sufficient coverage of both alternatives in the samples, and the coverage of the samples"
+        in_cov, total_cov = self.coverage(samples)
+        junction_sum, total_sum = in_cov.sum(1), total_cov.sum(1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            alt_fraction = junction_sum / total_sum
+        covered = (total_sum >= min_total) & (min_alt_fraction < alt_fraction) & (alt_fraction < 1 - min_alt_fraction)
+        return covered, in_cov, total_cov
+
+    def altsplice_test(
+        self,
+        groups,
+        min_total=100,
+        min_alt_fraction=0.1,
+        min_n=10,
+        min_sa=0.51,
+        test="auto",
+        padj_method="fdr_bh",
+        types=None,
+        processes=1,
+    ):
+        """Performs the alternative splicing event test on the events of the matrix.
+
+        :param groups: Dict with groupnames as keys and lists of samplenames as values, defining the two groups for the test.
+            If more then two groups are provided, test is performed between first two groups, but maximum likelihood parameters
+            (expected PSI and dispersion) will be computet for the other groups as well.
+        :param min_total: Minimum total coverage over all selected samples (for both groups combined).
+        :param min_alt_fraction: Minimum fraction of reads supporting the alternative (for both groups combined).
+        :param min_n: The minimum coverage of the event for an individual sample to be considered for the min_sa filter.
+        :param min_sa: The fraction of samples within each group that must be covered by at least min_n reads.
+        :param test: The name of one of the implemented statistical tests ('betabinom_lr','binom_lr','proportions'),
+            or a function of the coverage of the alternative and the total coverage of the two groups.
+        :param padj_method: Specify the method for multiple testing correction.
+        :param types: Restrict the analysis on types of events. If ommited, all types are tested.
+        :param processes: Number of worker processes. If larger than 1, tests that are performed for each event individually
+            ('binom_lr', 'proportions' or a custom function, which must be picklable) are evaluated for chunks of events in
+            worker processes. The 'betabinom_lr' test fits all events together in the main process.
+        :return: Table with the test results."""
+        groupnames = list(groups)
+        groups = list(groups.values())
+        if isinstance(test, str):
+            if test == "auto":
+                test = (
+                    "betabinom_lr" if min(len(g) for g in groups[:2]) > 1 else "proportions"
+                )
+            test_name = test
+            try:
+                test = TESTS[test]
+            except KeyError as e:
+                raise ValueError(f"test must be one of {str(list(TESTS))}") from e
+        else:
+            test_name = "custom"
+        batch_test = BATCH_TESTS.get(test_name)
+
+        logger.info(
+            "testing differential splicing for %s using %s test",
+            " vs ".join(f"{groupnames[i]} ({len(groups[i])})" for i in range(2)),
+            test_name,
+        )
+        if min_sa < 1:
+            min_sa *= sum(len(gr) for gr in groups[:2])
+        # the coverage of the selected samples, with the groups in consecutive columns
+        in_cov, total_cov = self.coverage([sa for grp in groups for sa in grp])
+        offsets = np.cumsum([0] + [len(grp) for grp in groups])
+        grp_idx = [list(range(i, j)) for i, j in zip(offsets[:-1], offsets[1:])]
+        sidx = grp_idx[0] + grp_idx[1]
+        junction_sum, total_sum = in_cov[:, sidx].sum(1), total_cov[:, sidx].sum(1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            alt_fraction = junction_sum / total_sum
+        selected = (total_sum >= min_total) & ~(alt_fraction < min_alt_fraction) & ~(alt_fraction > 1 - min_alt_fraction)
+        selected &= (total_cov[:, sidx] >= min_n).sum(1) >= min_sa
+        if types is not None:
+            selected &= self.events["splice_type"].isin([types] if isinstance(types, str) else types).values
+        events = self.events.loc[selected, ["gene", "gene_id", "chrom", "strand", "start", "end", "splice_type", "novel"]]
+        x = [in_cov[selected][:, grp] for grp in grp_idx]
+        n = [total_cov[selected][:, grp] for grp in grp_idx]
+        # the tests are performed for all events together
+        if batch_test is not None:
+            pvals, params = batch_test(x[:2], n[:2])
+        elif len(events):
+            if processes > 1:
+                chunk_size = -(-len(events) // (4 * processes))
+                chunks = [
+                    ([xi[i : i + chunk_size] for xi in x[:2]], [ni[i : i + chunk_size] for ni in n[:2]])
+                    for i in range(0, len(events), chunk_size)
+                ]
+                with Pool(processes) as pool:
+                    results = pool.starmap(partial(_test_chunk, test=test), chunks)
+            else:
+                results = [_test_chunk(x[:2], n[:2], test)]
+            pvals, params = zip(*(res for chunk in results for res in chunk))
+        else:
+            pvals, params = [], []
+        params_other = [_params_alt(*betabinom_ml_batch(xi, ni)) for xi, ni in zip(x[2:], n[2:])]
+        res = []
+        for i, event in enumerate(events.itertuples(index=False)):
+            res.append(
+                tuple(
+                    itertools.chain(
+                        event,
+                        (pvals[i],),
+                        params[i],
+                        (v for p in params_other for v in p[i]),
+                        (
+                            val
+                            for xi, ni in zip(x, n)
+                            for pair in zip(xi[i], ni[i])
+                            for val in pair
+                        ),
+                    )
+                )
+            )
+
+        df = pd.DataFrame(
+            res,
+            columns=(
+                [
+                    "gene",
+                    "gene_id",
+                    "chrom",
+                    "strand",
+                    "start",
+                    "end",
+                    "splice_type",
+                    "novel",
+                    "pvalue",
+                ]
+                + [
+                    gn + part
+                    for gn in groupnames[:2] + ["total"] + groupnames[2:]
+                    for part in ["_PSI", "_disp"]
+                ]
+                + [
+                    f"{sa}_{gn}_{w}"
+                    for gn, grp in zip(groupnames, groups)
+                    for sa in grp
+                    for w in ["in_cov", "total_cov"]
+                ]
+            ),
+        )
+        try:
+            mask = np.isfinite(df["pvalue"])
+            padj = np.empty(mask.shape)
+            padj.fill(np.nan)
+            padj[mask] = multi.multipletests(df.loc[mask, "pvalue"], method=padj_method)[1]
+            df.insert(8, "padj", padj)
+        except TypeError as e:  # apparently this happens if df is empty...
+            logger.error(f"unexpected error during calculation of adjusted p-values: {e}")
+        return df
+
+
+def event_matrix(
+    self,
+    samples=None,
+    types=None,
+    min_total=0,
+    region=None,
+    include=None,
+    remove=None,
+    sparse=False,
+    processes=1,
+):
+    """Creates the matrix of the alternative splicing events and their coverage in the samples.
+
+    The splice bubbles of the genes are enumerated once. Tests of different groups, the embedding and the export of the events
+    can be performed on the matrix, without searching the segment graphs again.
+
+    :param samples: The samples to consider. If omitted, all samples are selected.
+    :param types: Restrict the matrix on types of events. If ommited, all types are included.
+    :param min_total: Minimum total coverage of the events over all selected samples.
+    :param region: Specify the region, either as (chr, start, end) tuple or as "chr:start-end" string.
+        If omitted, the complete genome is searched.
+    :param include: Specify required flags to include genes.
+    :param remove: Specify flags to ignore genes.
+    :param sparse: If True, the coverage is stored in scipy sparse matrices, which need less memory for many samples.
+    :param processes: Number of worker processes. If larger than 1, the genes of each chromosome are evaluated in a worker process.
+        The splice bubbles cached in the main process (see :func:`precompute_splice_bubbles`) are passed to the workers.
+    :return: The EventMatrix."""
+    if samples is None:
+        samples = self.samples
+    notfound = [sa for sa in samples if sa not in self.samples]
+    if notfound:
+        raise ValueError(f"Cannot find the following samples: {notfound}")
+    sa_idx = {sa: idx[0] for sa, idx in self._get_sample_idx().items()}
+    sidx = [sa_idx[sa] for sa in samples]
+    if types is None:
+        types = EVENT_TYPES
+    elif isinstance(types, str):
+        types = (types,)
+    # the genes of each chromosome are evaluated together, such that worker processes only get the data they need
+    chunks = (
+        [_event_matrix_gene(g, sidx) for g in genes if g.n_transcripts and g.coverage[sidx, :].sum() >= min_total]
+        for _, genes in itertools.groupby(self.iter_genes(region, include, remove), key=lambda g: g.chrom)
+    )
+    chunk_events = partial(_event_matrix_chunk, types=types, min_total=min_total, n_samples=len(samples))
+    events, in_cov, total_cov = [], [], []
+    with ExitStack() as stack:
+        if processes > 1:
+            results = stack.enter_context(Pool(processes)).imap(chunk_events, chunks)
+        else:
+            results = map(chunk_events, chunks)
+        for chunk, chunk_in, chunk_total in tqdm(results, total=len(self.chromosomes) if region is None else None, unit="chromosomes"):
+            if chunk:
+                events.extend(chunk)
+                in_cov.append(csr_matrix(chunk_in) if sparse else chunk_in)
+                total_cov.append(csr_matrix(chunk_total) if sparse else chunk_total)
+    if not events:
+        in_cov = total_cov = [np.zeros((0, len(samples)), int)]
+    stack_cov = (lambda covs: csr_matrix(sparse_vstack(covs))) if sparse else np.concatenate
+    logger.info("found %i alternative splicing events", len(events))
+    return EventMatrix(
+        pd.DataFrame(events, columns=["gene", "gene_id", "chrom", "strand", "start", "end", "splice_type", "novel", "bubble"]),
+        samples,
+        stack_cov(in_cov),
+        stack_cov(total_cov),
+        _fingerprint(self),
+    )
+
 
 def altsplice_test(
     self,
@@ -187,6 +702,8 @@ def altsplice_test(
     test="auto",
     padj_method="fdr_bh",
     types=None,
+    processes=1,
+    event_matrix=None,
 ):
     """Performs the alternative splicing event test.
 
@@ -198,8 +715,17 @@ def altsplice_test(
     :param min_n: The minimum coverage of the event for an individual sample to be considered for the min_sa filter.
     :param min_sa: The fraction of samples within each group that must be covered by at least min_n reads.
     :param test: The name of one of the implemented statistical tests ('betabinom_lr','binom_lr','proportions').
+        The 'betabinom_lr' test fits all events together (betabinom_lr_test_batch). Where the dispersion is well determined (> 1e-3),
+        p-values agree with the individual test (betabinom_lr_test) to a relative tolerance of about 1e-3 (absolute 1e-6).
+        Close to zero dispersion, the likelihood is flat and the individual fits stop early, so p-values can differ more.
+        There, the batch fit reaches an equal or higher likelihood.
     :param padj_method: Specify the method for multiple testing correction.
-    :param types: Restrict the analysis on types of events. If ommited, all types are tested."""
+    :param types: Restrict the analysis on types of events. If ommited, all types are tested.
+    :param processes: Number of worker processes. If larger than 1, the events of each chromosome are determined in a worker process,
+        and tests that are performed for each event individually are evaluated for chunks of events in worker processes
+        (see :func:`EventMatrix.altsplice_test`).
+    :param event_matrix: The EventMatrix of the transcriptome (see :func:`event_matrix`).
+        If omitted, the events and their coverage in the selected samples are determined from the segment graphs of the genes."""
     # assert len(groups) == 2 , "length of groups should be 2, but found %i" % len(groups)
     # find groups and sample indices
     if isinstance(groups, dict):
@@ -209,141 +735,28 @@ def altsplice_test(
         groupnames = list(groups)
         groups = [self.groups()[gn] for gn in groupnames]
     elif all(isinstance(grp, list) for grp in groups):
-        groupnames = ["group{i+1}" for i in range(len(groups))]
+        groupnames = [f"group{i+1}" for i in range(len(groups))]
     else:
         raise ValueError("groups not found in dataset")
     notfound = [sa for grp in groups for sa in grp if sa not in self.samples]
     if notfound:
         raise ValueError(f"Cannot find the following samples: {notfound}")
-
-    if isinstance(test, str):
-        if test == "auto":
-            test = (
-                "betabinom_lr" if min(len(g) for g in groups[:2]) > 1 else "proportions"
-            )
-        test_name = test
-        try:
-            test = TESTS[test]
-        except KeyError as e:
-            raise ValueError(f"test must be one of {str(list(TESTS))}") from e
+    if event_matrix is None:
+        samples = list(dict.fromkeys(sa for grp in groups for sa in grp))
+        event_matrix = self.event_matrix(samples, types=types, min_total=min_total, processes=processes)
     else:
-        test_name = "custom"
-
-    logger.info(
-        "testing differential splicing for %s using %s test",
-        " vs ".join(f"{groupnames[i]} ({len(groups[i])})" for i in range(2)),
-        test_name,
-    )
-    sa_idx = {sa: idx[0] for sa, idx in self._get_sample_idx().items()}
-    grp_idx = [[sa_idx[sa] for sa in grp] for grp in groups]
-    sidx = grp_idx[0] + grp_idx[1]
-    if min_sa < 1:
-        min_sa *= sum(len(gr) for gr in groups[:2])
-    res = []
-    for g in tqdm(self):
-        if g.coverage[sidx, :].sum() < min_total:
-            continue
-        known = {}  # check for known events
-        if g.is_annotated and g.n_transcripts:
-            sg = g.ref_segment_graph
-            # find annotated alternatives for gene (e.g. known events)
-            for _, _, nX, nY, splice_type in sg.find_splice_bubbles(types=types):
-                if splice_type in ("TSS", "PAS"):
-                    if (splice_type == "TSS") == (g.strand == "+"):
-                        known.setdefault(splice_type, set()).add((sg[nX].end))
-                    else:
-                        known.setdefault(splice_type, set()).add((sg[nY].start))
-                else:
-                    known.setdefault(splice_type, set()).add((sg[nX].end, sg[nY].start))
-        sg = g.segment_graph
-        for setA, setB, nX, nY, splice_type in sg.find_splice_bubbles(types=types):
-
-            junction_cov = g.coverage[:, setB].sum(1)
-            total_cov = g.coverage[:, setA].sum(1) + junction_cov
-            if total_cov[sidx].sum() < min_total:
-                continue
-            alt_fraction = junction_cov[sidx].sum() / total_cov[sidx].sum()
-            if alt_fraction < min_alt_fraction or alt_fraction > 1 - min_alt_fraction:
-                continue
-            x = [junction_cov[grp] for grp in grp_idx]
-            n = [total_cov[grp] for grp in grp_idx]
-            if sum((ni >= min_n).sum() for ni in n[:2]) < min_sa:
-                continue
-            pval, params = test(x[:2], n[:2])
-            params_other = tuple(
-                v for xi, ni in zip(x[2:], n[2:]) for v in betabinom_ml(xi, ni)[1]
-            )
-            if splice_type in ["TSS", "PAS"]:
-                start, end = sg[nX].start, sg[nY].end
-                if (splice_type == "TSS") == (g.strand == "+"):
-                    novel = end not in known.get(splice_type, set())
-                else:
-                    novel = start not in known.get(splice_type, set())
-            else:
-                start, end = sg[nX].end, sg[nY].start
-                novel = (start, end) not in known.get(splice_type, set())
-            res.append(
-                tuple(
-                    itertools.chain(
-                        (
-                            g.name,
-                            g.id,
-                            g.chrom,
-                            g.strand,
-                            start,
-                            end,
-                            splice_type,
-                            novel,
-                            pval,
-                        ),
-                        params,
-                        params_other,
-                        (
-                            val
-                            for lists in zip(x, n)
-                            for pair in zip(*lists)
-                            for val in pair
-                        ),
-                    )
-                )
-            )
-
-    df = pd.DataFrame(
-        res,
-        columns=(
-            [
-                "gene",
-                "gene_id",
-                "chrom",
-                "strand",
-                "start",
-                "end",
-                "splice_type",
-                "novel",
-                "pvalue",
-            ]
-            + [
-                gn + part
-                for gn in groupnames[:2] + ["total"] + groupnames[2:]
-                for part in ["_PSI", "_disp"]
-            ]
-            + [
-                f"{sa}_{gn}_{w}"
-                for gn, grp in zip(groupnames, groups)
-                for sa in grp
-                for w in ["in_cov", "total_cov"]
-            ]
-        ),
+        event_matrix._check(self)
+    return event_matrix.altsplice_test(
+        dict(zip(groupnames, groups)),
+        min_total=min_total,
+        min_alt_fraction=min_alt_fraction,
+        min_n=min_n,
+        min_sa=min_sa,
+        test=test,
+        padj_method=padj_method,
+        types=types,
+        processes=processes,
     )
-    try:
-        mask = np.isfinite(df["pvalue"])
-        padj = np.empty(mask.shape)
-        padj.fill(np.nan)
-        padj[mask] = multi.multipletests(df.loc[mask, "pvalue"], method=padj_method)[1]
-        df.insert(8, "padj", padj)
-    except TypeError as e:  # apparently this happens if df is empty...
-        logger.error(f"unexpected error during calculation of adjusted p-values: {e}")
-    return df
 
 
 def splice_dependence_test(
@@ -399,6 +812,7 @@ def alternative_splicing_events(
     region=None,
     include=None,
     remove=None,
+    event_matrix=None,
 ):
     """Finds alternative splicing events.
 
@@ -413,59 +827,27 @@ def alternative_splicing_events(
         If omitted, the complete genome is searched.
     :param include: Specify required flags to include genes.
     :param remove: Specify flags to ignore genes.
+    :param event_matrix: The EventMatrix of the transcriptome (see :func:`event_matrix`).
+        If omitted, the events are determined from the segment graphs of the genes.
     :return: Table with alternative splicing events."""
-    bubbles = []
     if samples is None:
         samples = self.samples
     assert all(s in self.samples for s in samples), "not all specified samples found"
-    sa_dict = {sa: i for i, sa in enumerate(self.samples)}
-    sidx = np.array([sa_dict[sa] for sa in samples])
-
     assert 0 < min_alt_fraction < 0.5, "min_alt_fraction must be > 0 and < 0.5"
-    for g in self.iter_genes(region, include, remove):
-        if g.coverage[sidx, :].sum() < min_total:
-            continue
-        known = {}  # check for known events
-        if g.is_annotated and g.n_transcripts:
-            sg = g.ref_segment_graph
-            for (
-                _,
-                _,
-                nX,
-                nY,
-                splice_type,
-            ) in sg.find_splice_bubbles():  # find annotated alternatives (known)
-                if splice_type in ("TSS", "PAS"):
-                    if (splice_type == "TSS") == (g.strand == "+"):
-                        known.setdefault(splice_type, set()).add((sg[nX].end))
-                    else:
-                        known.setdefault(splice_type, set()).add((sg[nY].start))
-                else:
-                    known.setdefault(splice_type, set()).add((sg[nX].end, sg[nY].start))
-        sg = g.segment_graph
-        for setA, setB, nX, nY, splice_type in sg.find_splice_bubbles():
-            junction_cov = g.coverage[np.ix_(sidx, setA)].sum(1)
-            total_cov = g.coverage[np.ix_(sidx, setB)].sum(1) + junction_cov
-            if (
-                total_cov.sum() >= min_total
-                and min_alt_fraction
-                < junction_cov.sum() / total_cov.sum()
-                < 1 - min_alt_fraction
-            ):
-                if splice_type in ["TSS", "PAS"]:
-                    start, end = sg[nX].start, sg[nY].end
-                    if (splice_type == "TSS") == (g.strand == "+"):
-                        novel = end not in known.get(splice_type, set())
-                    else:
-                        novel = start not in known.get(splice_type, set())
-                else:
-                    start, end = sg[nX].end, sg[nY].start
-                    novel = (start, end) not in known.get(splice_type, set())
-                bubbles.append(
-                    [g.id, g.chrom, start, end, splice_type, novel]
-                    + list(junction_cov)
-                    + list(total_cov)
-                )
+    if event_matrix is None:
+        event_matrix = self.event_matrix(samples, min_total=min_total, region=region, include=include, remove=remove)
+    else:
+        event_matrix._check(self)
+        if region is not None or include or remove:
+            gene_ids = {g.id for g in self.iter_genes(region, include, remove)}
+            event_matrix = event_matrix.select(event_matrix.events["gene_id"].isin(gene_ids).values)
+    covered, in_cov, total_cov = event_matrix._covered(samples, min_total, min_alt_fraction)
+    events = event_matrix.events.loc[covered, ["gene_id", "chrom", "start", "end", "splice_type", "novel"]]
+    # the table reports the coverage of the primary path
+    bubbles = [
+        list(event) + list(total - junction) + list(total)
+        for event, junction, total in zip(events.itertuples(index=False), in_cov[covered], total_cov[covered])
+    ]
     return pd.DataFrame(
         bubbles,
         columns=["gene", "chr", "start", "end", "splice_type", "novel"]
@@ -474,6 +856,40 @@ def alternative_splicing_events(
 
 
 # summary tables (can be used as input to plot_bar / plot_dist)
+def _splice_bubbles(sg):
+    "the splice bubbles and bubble positions of a segment graph, computed in a worker process"
+    return sg._splice_bubbles(), sg.get_bubble_positions()
+
+
+def precompute_splice_bubbles(self, reference=True, processes=1):
+    """Enumerates the splice bubbles of the segment graphs of all genes.
+
+    The bubbles are cached with the segment graphs, such that subsequent calls of :func:`altsplice_test`,
+    :func:`alternative_splicing_events` and :func:`export_alternative_splicing` do not need to search them again.
+    The cache of a segment graph is discarded when the graph is modified, e.g. by adding samples.
+    It is only kept in the main process, and is not pickled: it is neither saved with the transcriptome nor sent to worker
+    processes with the segment graphs. :func:`event_matrix` (and the functions using it) pass the cached bubbles to their
+    worker processes explicitly, but the bubbles searched by these workers are discarded.
+
+    :param reference: If True, the bubbles of the reference segment graphs (the known events) are also computed.
+    :param processes: Number of worker processes. If larger than 1, the segment graphs are sent to the workers,
+        and the bubbles are returned to the main process, where they are cached. This only pays off if the bubbles are
+        used several times, otherwise the workers of the subsequent function can search them just as well."""
+    graphs = [g.segment_graph for g in self if g.n_transcripts]
+    if reference:
+        graphs.extend(g.ref_segment_graph for g in self if g.is_annotated and g.n_ref_transcripts)
+    graphs = [sg for sg in graphs if "_bubble_positions" not in sg.__dict__]
+    logger.info("searching splice bubbles in %i segment graphs", len(graphs))
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = pool.imap(_splice_bubbles, graphs, chunksize=max(1, min(100, len(graphs) // (4 * processes))))
+            for sg, (bubbles, positions) in zip(graphs, tqdm(results, total=len(graphs))):
+                sg._bubbles, sg._bubble_positions = bubbles, positions
+    else:
+        for sg in tqdm(graphs):
+            _splice_bubbles(sg)
+
+
 def altsplice_stats(
     self, groups=None, weight_by_coverage=True, min_coverage=2, tr_filter={}
 ):
@@ -93,6 +93,55 @@ def junctions_from_cigar(cigartuples, offset):
     return exons
 
 
+def junctions_from_cigar_batch(cigartuples_list, offsets):
+    """Returns the exon positions of several alignments, as flat arrays.
+
+    This is equivalent to calling junctions_from_cigar for each alignment (including the removal of zero length exons),
+    but processes all alignments at once.
+
+    :param cigartuples_list: List with the cigar tuples of the alignments.
+    :param offsets: List with the reference start positions of the alignments.
+    :return: Tuple of three numpy arrays: the exon starts, the exon ends, and the exon offsets of length n+1,
+        such that the exons of alignment i are at positions offsets[i] to offsets[i+1] of the first two arrays."""
+    n = len(cigartuples_list)
+    n_ops = np.fromiter((len(ct) for ct in cigartuples_list), dtype=np.int64, count=n)
+    cigar = np.fromiter(
+        itertools.chain.from_iterable(itertools.chain.from_iterable(cigartuples_list)),
+        dtype=np.int64,
+        count=2 * n_ops.sum(),
+    ).reshape(-1, 2)
+    op, op_len = cigar[:, 0], cigar[:, 1]
+    ref_len = np.where(np.isin(op, (0, 2, 3, 7, 8)), op_len, 0)  # MDN=X -> move forward on reference
+    read_idx = np.repeat(np.arange(n), n_ops)
+    first_op = np.concatenate(([0], np.cumsum(n_ops)))
+    cum_len = np.concatenate(([0], np.cumsum(ref_len)))
+    # shift the cumulative length, such that it starts at the reference start of each alignment
+    shift = np.asarray(offsets, dtype=np.int64) - cum_len[first_op[:-1]]
+    is_junction = op == 3  # N ->  Splice junction
+    junction_read = read_idx[is_junction]
+    n_exons = 1 + np.bincount(junction_read, minlength=n)
+    exon_idx = np.concatenate(([0], np.cumsum(n_exons)))
+    # rank of each junction within its alignment
+    junction_rank = np.arange(len(junction_read)) - np.cumsum(
+        np.concatenate(([0], n_exons - 1))
+    )[junction_read]
+    starts = np.empty(exon_idx[-1], dtype=np.int64)
+    ends = np.empty(exon_idx[-1], dtype=np.int64)
+    starts[exon_idx[:-1]] = offsets
+    ends[exon_idx[1:] - 1] = cum_len[first_op[1:]] + shift
+    junction_pos = np.flatnonzero(is_junction)
+    starts[exon_idx[junction_read] + junction_rank + 1] = (
+        cum_len[junction_pos + 1] + shift[junction_read]
+    )
+    ends[exon_idx[junction_read] + junction_rank] = (
+        cum_len[junction_pos] + shift[junction_read]
+    )
+    # delete zero length exons (may occur if insertion within intron, e.g. 10M100N10I100N10M)
+    keep = starts != ends
+    exon_idx = np.concatenate(([0], np.cumsum(keep)))[exon_idx]
+    return starts[keep], ends[keep], exon_idx
+
+
 def is_same_gene(tr1, tr2, spj_iou_th=0, reg_iou_th=0.5):
     "checks whether tr1 and tr2 are the same gene by calculating intersection over union of the intersects"
     # current default definition of "same gene": at least one shared splice site
@@ -123,6 +172,14 @@ def splice_identical(tr1, tr2):
     return True
 
 
+def intron_chain(exons):
+    """Returns the splice sites of a transcript as tuple.
+
+    Two multi-exon transcripts are splice identical iff their intron chains are equal, hence the chain can be used as a
+    hashable key for matching transcripts. For mono-exon transcripts the chain is empty."""
+    return tuple(pos for e1, e2 in pairwise(exons) for pos in (e1[1], e2[0]))
+
+
 def overlap(r1, r2):
     "check the overlap of two intervals"
     # assuming start < end
@@ -6,7 +6,11 @@ from intervaltree import Interval
 
 from .logger import isotools_logger as logger
 from .short_read import Coverage
-from .splice_graph import SegmentGraph
+from .splice_graph import ArraySegmentGraph, SegmentGraph
+from ._utils import intron_chain, splice_identical
+
+# if more transcripts have been added or modified, the segment graph is constructed again rather than updated in place
+MAX_SEGMENT_GRAPH_UPDATES = 5
 
 
 def _eval_filter_fun(fun, name, args):
@@ -395,7 +399,7 @@ class Gene(Interval):
     def _set_coverage(self, force=False):
         samples = self._transcriptome.samples
         cov = np.zeros((len(samples), self.n_transcripts), dtype=int)
-        if not force:  # keep the segment graph if no new transcripts
+        if not force:  # keep the known coverage if no new transcripts
             known = self.data.get("coverage", None)
             if known is not None and known.shape[1] == self.n_transcripts:
                 if known.shape == cov.shape:
@@ -410,7 +414,6 @@ class Gene(Interval):
             for j, tr in enumerate(self.transcripts):
                 cov[i, j] = tr["coverage"].get(sa, 0)
         self.data["coverage"] = cov
-        self.data["segment_graph"] = None
 
     @property
     def coverage(self):
@@ -496,6 +499,76 @@ class Gene(Interval):
         except KeyError:
             return []
 
+    @property
+    def intron_chain_index(self):
+        """Returns a dict mapping the intron chains of the multi-exon transcripts to their index in the transcript list.
+
+        The index is computed on first request and kept in the gene data. Code that modifies the transcript list
+        (other than appending new transcripts with add_transcript) has to remove "intron_chain_index" from the gene data."""
+        idx = self.data.get("intron_chain_index", None)
+        if idx is None:
+            idx = {}
+            for i, tr in enumerate(self.transcripts):
+                if len(tr["exons"]) > 1:
+                    idx.setdefault(intron_chain(tr["exons"]), i)
+            self.data["intron_chain_index"] = idx
+        return idx
+
+    def find_splice_identical(self, exons):
+        """Returns the index of the first transcript that is splice identical to the provided exons, or None if there is none.
+
+        Multi-exon transcripts are looked up in the intron chain index, mono-exon transcripts need to overlap.
+
+        :param exons: List of exon positions."""
+        if len(exons) > 1:
+            return self.intron_chain_index.get(intron_chain(exons))
+        for i, tr in enumerate(self.transcripts):
+            if len(tr["exons"]) == 1 and splice_identical(tr["exons"], exons):
+                return i
+        return None
+
+    def add_transcript(self, tr):
+        """Appends a transcript to the gene and updates the intron chain index.
+
+        If present, the segment graph is updated on next request. The coverage matrix gets recomputed on next request.
+
+        :param tr: The transcript dict."""
+        transcripts = self.data.setdefault("transcripts", [])
+        transcripts.append(tr)
+        idx = self.data.get("intron_chain_index", None)
+        if idx is not None and len(tr["exons"]) > 1:
+            idx.setdefault(intron_chain(tr["exons"]), len(transcripts) - 1)
+        self.data["coverage"] = None
+
+    def _transcript_modified(self, tr_idx):
+        """Marks the segment graph of the transcript for update on next request, after its start or end has been moved.
+
+        :param tr_idx: The index of the modified transcript."""
+        segment_graph = self.data.get("segment_graph", None)
+        if segment_graph is not None and tr_idx < segment_graph.n_transcripts:
+            self.data.setdefault("segment_graph_modified", set()).add(tr_idx)
+
+    def remove_transcripts(self, tr_idx):
+        """Removes transcripts from the gene.
+
+        If a single transcript is removed, the segment graph is updated in place if supported, otherwise it gets reconstructed
+        on next request.
+        The intron chain index and the coverage matrix get recomputed on next request.
+
+        :param tr_idx: The indices of the transcripts to remove."""
+        tr_idx = set(tr_idx)
+        n_transcripts = self.n_transcripts
+        self.data["transcripts"] = [tr for i, tr in enumerate(self.transcripts) if i not in tr_idx]
+        self.data.pop("intron_chain_index", None)
+        segment_graph = self.data.get("segment_graph", None)
+        modified = self.data.pop("segment_graph_modified", None)
+        if segment_graph is not None:
+            if segment_graph.in_place_updates and len(tr_idx) == 1 and not modified and segment_graph.n_transcripts == n_transcripts:
+                segment_graph.remove_transcript(next(iter(tr_idx)))
+            else:
+                self.data["segment_graph"] = None
+        self.data["coverage"] = None
+
     @property
     def n_transcripts(self):
         """Returns number of transcripts of the gene, as found by LRTS."""
@@ -506,6 +579,12 @@ class Gene(Interval):
         """Returns number of reference transcripts of the gene."""
         return len(self.ref_transcripts)
 
+    @property
+    def _segment_graph_type(self):
+        "the segment graph implementation, as selected by :func:`Transcriptome.set_segment_graph_backend`"
+        infos = getattr(self._transcriptome, "infos", {})
+        return ArraySegmentGraph if infos.get("segment_graph_backend") == "array" else SegmentGraph
+
     @property
     def ref_segment_graph(self):  # raises key error if not self.is_annotated
         """Returns the segment graph of the reference transcripts for the gene"""
@@ -516,16 +595,30 @@ class Gene(Interval):
             or self.data["reference"]["segment_graph"] is None
         ):
             exons = [tr["exons"] for tr in self.ref_transcripts]
-            self.data["reference"]["segment_graph"] = SegmentGraph(exons, self.strand)
+            self.data["reference"]["segment_graph"] = self._segment_graph_type(exons, self.strand)
         return self.data["reference"]["segment_graph"]
 
     @property
     def segment_graph(self):
-        """Returns the segment graph of the LRTS transcripts for the gene"""
-        if "segment_graph" not in self.data or self.data["segment_graph"] is None:
+        """Returns the segment graph of the LRTS transcripts for the gene.
+
+        Transcripts added or modified since the last request are updated in place, unless there are more than
+        MAX_SEGMENT_GRAPH_UPDATES or the segment graph does not support in place updates, in which case it is constructed again."""
+        segment_graph = self.data.get("segment_graph", None)
+        modified = self.data.pop("segment_graph_modified", ())
+        if segment_graph is not None:
+            n_transcripts = segment_graph.n_transcripts
+            if not segment_graph.in_place_updates or self.n_transcripts - n_transcripts + len(modified) > MAX_SEGMENT_GRAPH_UPDATES:
+                segment_graph = None
+            else:
+                for i in sorted(modified):
+                    segment_graph.replace_transcript(i, self.transcripts[i]["exons"])
+                for tr in self.transcripts[n_transcripts:]:
+                    segment_graph.add_transcript(tr["exons"])
+        if segment_graph is None:
             exons = [tr["exons"] for tr in self.transcripts]
-            self.data["segment_graph"] = SegmentGraph(exons, self.strand)
-        return self.data["segment_graph"]
+            segment_graph = self.data["segment_graph"] = self._segment_graph_type(exons, self.strand)
+        return segment_graph
 
     def __copy__(self):
         return Gene(self.start, self.end, self.data, self._transcriptome)
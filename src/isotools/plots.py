@@ -5,6 +5,7 @@ import seaborn as sns
 from matplotlib.colors import is_color_like, to_hex
 from scipy.stats import beta, nbinom
 
+from ._transcriptome_stats import EventMatrix
 from .logger import isotools_logger as logger
 
 
@@ -116,7 +117,8 @@ def plot_embedding(
     A prior weight is added to all samples proportional to the average fraction of the alternatives,
     in order to bias poorly covered samples towards the mean and limit their potential to disturb the analysis.
 
-    :param splice_bubbles: The splice bubble table, produced by Transcriptome.alternative_splicing_events().
+    :param splice_bubbles: The splice bubble table, produced by Transcriptome.alternative_splicing_events(),
+        or the EventMatrix, produced by Transcriptome.event_matrix().
     :param method: The embedding method, either "PCA" or "UMAP".
     :param prior_count: Number of prior reads which are added to each sample proportional to the average fraction of the alternatives.
     :param top_var: Number of alternative splicing events which are used for the embedding.
@@ -142,14 +144,24 @@ def plot_embedding(
     plot_components = np.array(plot_components)
     if isinstance(splice_types, str):
         splice_types = [splice_types]
-    if "all" not in splice_types:
-        splice_bubbles = splice_bubbles.loc[
-            splice_bubbles["splice_type"].isin(splice_types)
-        ]
-    k = splice_bubbles[[c for c in splice_bubbles.columns if c.endswith("_in_cov")]]
-    n = splice_bubbles[[c for c in splice_bubbles.columns if c.endswith("_total_cov")]]
-    n.columns = [c[:-10] for c in n.columns]
-    k.columns = [c[:-7] for c in k.columns]
+    if isinstance(splice_bubbles, EventMatrix):
+        if "all" not in splice_types:
+            splice_bubbles = splice_bubbles.select(
+                splice_bubbles.events["splice_type"].isin(splice_types).values
+            )
+        k, n = (
+            pd.DataFrame(cov, columns=splice_bubbles.samples)
+            for cov in splice_bubbles.coverage()
+        )
+    else:
+        if "all" not in splice_types:
+            splice_bubbles = splice_bubbles.loc[
+                splice_bubbles["splice_type"].isin(splice_types)
+            ]
+        k = splice_bubbles[[c for c in splice_bubbles.columns if c.endswith("_in_cov")]]
+        n = splice_bubbles[[c for c in splice_bubbles.columns if c.endswith("_total_cov")]]
+        n.columns = [c[:-10] for c in n.columns]
+        k.columns = [c[:-7] for c in k.columns]
     samples = list(n.columns)
     assert all(
         c1 == c2 for c1, c2 in zip(n.columns, k.columns)
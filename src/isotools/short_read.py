@@ -1,9 +1,11 @@
 # methods and classes for the integration of short read data
+import itertools
+
 import numpy as np
 from pysam import AlignmentFile, FastaFile, TabixFile
 
 from .logger import isotools_logger as logger
-from ._utils import junctions_from_cigar
+from ._utils import junctions_from_cigar_batch
 
 
 class Coverage:
@@ -42,24 +44,39 @@ class Coverage:
         obj.__init__(cov, junctions, start)
         return obj
 
-    @classmethod  # this is slow - called only if coverage is requested
-    def _import_coverage(cls, align_fh, reg):
+    @classmethod
+    def _import_coverage(cls, align_fh, reg, chunk_size=100000):
         delta = np.zeros(reg[2] - reg[1])
         junctions = {}
-        for read in align_fh.fetch(*reg):
-            exons = junctions_from_cigar(read.cigartuples, read.reference_start)
-            # alternative: read.get_blocks() should be more efficient.. -todo: is it different?
-            for i, exon in enumerate(exons):
-                s = max(reg[1], min(reg[2] - 1, exon[0])) - reg[1]
-                e = max(reg[1], min(reg[2] - 1, exon[1])) - reg[1]
-                delta[s] += 1
-                delta[e] -= 1
-                if i > 0:
-                    jpos = (exons[i - 1][1], exon[0])
-                    if jpos[1] - jpos[0] < 1 or jpos[0] < reg[1] or jpos[1] > reg[2]:
-                        continue
-
-                    junctions[jpos] = junctions.get(jpos, 0) + 1
+        reads = align_fh.fetch(*reg)
+        while True:
+            chunk = [
+                read
+                for read in itertools.islice(reads, chunk_size)
+                if read.cigartuples is not None
+            ]
+            if not chunk:
+                break
+            starts, ends, idx = junctions_from_cigar_batch(
+                [read.cigartuples for read in chunk],
+                [read.reference_start for read in chunk],
+            )
+            np.add.at(delta, np.clip(starts, reg[1], reg[2] - 1) - reg[1], 1)
+            np.add.at(delta, np.clip(ends, reg[1], reg[2] - 1) - reg[1], -1)
+            # junctions are between consecutive exons of the same read
+            not_first = np.ones(len(starts), dtype=bool)
+            not_first[idx[:-1][idx[:-1] < len(starts)]] = False
+            jstart = ends[np.flatnonzero(not_first) - 1]
+            jend = starts[not_first]
+            use = (jend - jstart >= 1) & (jstart >= reg[1]) & (jend <= reg[2])
+            if use.any():
+                jpos, count = np.unique(
+                    np.stack((jstart[use], jend[use]), axis=1),
+                    axis=0,
+                    return_counts=True,
+                )
+                for (s, e), c in zip(jpos.tolist(), count.tolist()):
+                    junctions[(s, e)] = junctions.get((s, e), 0) + c
         cov = np.cumsum(delta)  # todo: use rle instead?
         return cov, junctions
 
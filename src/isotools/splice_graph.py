@@ -1,3 +1,4 @@
+from bisect import bisect_left, bisect_right
 from itertools import combinations
 from typing import Union
 
@@ -8,10 +9,99 @@ from sortedcontainers import SortedDict  # for SpliceGraph
 from tqdm import tqdm
 
 from .logger import isotools_logger as logger
-from ._utils import overlap, pairwise
+from ._utils import intron_chain, overlap, pairwise
 from .decorators import deprecated, experimental
 
 
+class _TerminalPos(int):
+    """Marks the transcript start or end position, such that it can be replaced in cached results."""
+
+    def __new__(cls, pos, is_end=False):
+        obj = super().__new__(cls, pos)
+        obj.is_end = is_end
+        return obj
+
+
+def _fill_terminal_pos(result, start, end):
+    "returns a copy of result, with the marked terminal positions replaced by start and end"
+    result_type = type(result)
+    if result_type is dict:
+        return {k: _fill_terminal_pos(v, start, end) for k, v in result.items()}
+    if result_type is list:
+        return [_fill_terminal_pos(v, start, end) for v in result]
+    if result_type is tuple:
+        return tuple([_fill_terminal_pos(v, start, end) for v in result])
+    if result_type is _TerminalPos:
+        return end if result.is_end else start
+    return result
+
+
+def _find_substrings(seqs):
+    """For each sequence, finds the sequences that are contained as contiguous subsequence, with an Aho-Corasick automaton.
+
+    :param seqs: A list of distinct, non-empty tuples.
+    :return: A list with a list of (sequence index, start position) tuples for each sequence, including the sequence itself."""
+    # trie of the sequences, term: index of the sequence ending at the trie node (or -1)
+    children, term, depth = [{}], [-1], [0]
+    for k, seq in enumerate(seqs):
+        node = 0
+        for c in seq:
+            nxt = children[node].get(c)
+            if nxt is None:
+                nxt = children[node][c] = len(children)
+                children.append({})
+                term.append(-1)
+                depth.append(depth[node] + 1)
+            node = nxt
+        term[node] = k
+    # fail: longest proper suffix in the trie, dict_link: longest proper suffix that is a sequence (0 for none)
+    fail, dict_link = [0] * len(children), [0] * len(children)
+    queue = list(children[0].values())
+    for node in queue:
+        for c, child in children[node].items():
+            f = fail[node]
+            while f and c not in children[f]:
+                f = fail[f]
+            fail[child] = children[f].get(c, 0) if node else 0
+            dict_link[child] = fail[child] if term[fail[child]] >= 0 else dict_link[fail[child]]
+            queue.append(child)
+    # the sequences are in the trie, hence the automaton state after each prefix of a sequence is the trie node of the prefix
+    substrings = []
+    for seq in seqs:
+        found, node = [], 0
+        for c in seq:
+            node = children[node][c]
+            m = node if term[node] >= 0 else dict_link[node]
+            while m:
+                found.append((term[m], depth[node] - depth[m]))
+                m = dict_link[m]
+        substrings.append(found)
+    return substrings
+
+
+def _boundary_classes(boundaries, pos):
+    "for each position, the index of the next boundary and whether the position is on this boundary, see SegmentGraph._boundary_class"
+    return list(zip(np.searchsorted(boundaries, pos).tolist(), _contains(boundaries, pos).tolist()))
+
+
+def _introns(transcripts):
+    "the transcript index, intron number, donor (lower) and acceptor (upper) position of the introns of all transcripts"
+    tr_idx = [k for k, exons in enumerate(transcripts) for _ in range(len(exons) - 1)]
+    intron_idx = [i for exons in transcripts for i in range(len(exons) - 1)]
+    donor = np.array([e[1] for exons in transcripts for e in exons[:-1]], dtype=np.int64)
+    acceptor = np.array([e[0] for exons in transcripts for e in exons[1:]], dtype=np.int64)
+    return tr_idx, intron_idx, donor, acceptor
+
+
+def _contains(sorted_pos, pos):
+    "boolean array indicating whether the positions are in the sorted array"
+    idx = np.searchsorted(sorted_pos, pos)
+    found = np.zeros(len(pos), dtype=bool)
+    inside = idx < len(sorted_pos)
+    found[inside] = sorted_pos[idx[inside]] == pos[inside]
+    return found
+
+
 class SegmentGraph:
     '''Segment Graph Implementation
 
@@ -24,6 +114,9 @@ class SegmentGraph:
     :type transcripts: list
     :param strand: the strand of the gene, either "+" or "-"'''
 
+    # whether add_transcript, remove_transcript and replace_transcript modify the graph in place
+    in_place_updates = True
+
     def __init__(self, transcripts, strand):
         self.strand = strand
         assert strand in "+-", 'strand must be either "+" or "-"'
@@ -50,17 +143,225 @@ class SegmentGraph:
         self._pas = [end_idx[e[-1][1]] for e in transcripts]
 
         for i, tr in enumerate(transcripts):
-            for j, e in enumerate(tr):
-                if start_idx[e[0]] < end_idx[e[1]]:  # psydojuctions within exon
-                    self._graph[start_idx[e[0]]].suc[i] = start_idx[e[0]] + 1
-                    self._graph[end_idx[e[1]]].pre[i] = end_idx[e[1]] - 1
-                    for node_idx in range(start_idx[e[0]] + 1, end_idx[e[1]]):
-                        self._graph[node_idx].suc[i] = node_idx + 1
-                        self._graph[node_idx].pre[i] = node_idx - 1
-                if j < len(tr) - 1:  # real junctions
-                    e2 = tr[j + 1]
-                    self._graph[end_idx[e[1]]].suc[i] = start_idx[e2[0]]
-                    self._graph[start_idx[e2[0]]].pre[i] = end_idx[e[1]]
+            self._link_transcript(i, tr, start_idx, end_idx)
+
+    def _link_transcript(self, i, tr, start_idx, end_idx):
+        "adds the edges of the ith transcript, given the node indices of the exon starts and ends"
+        for j, e in enumerate(tr):
+            if start_idx[e[0]] < end_idx[e[1]]:  # psydojuctions within exon
+                self._graph[start_idx[e[0]]].suc[i] = start_idx[e[0]] + 1
+                self._graph[end_idx[e[1]]].pre[i] = end_idx[e[1]] - 1
+                for node_idx in range(start_idx[e[0]] + 1, end_idx[e[1]]):
+                    self._graph[node_idx].suc[i] = node_idx + 1
+                    self._graph[node_idx].pre[i] = node_idx - 1
+            if j < len(tr) - 1:  # real junctions
+                e2 = tr[j + 1]
+                self._graph[end_idx[e[1]]].suc[i] = start_idx[e2[0]]
+                self._graph[start_idx[e2[0]]].pre[i] = end_idx[e[1]]
+
+    def _mono_nodes(self):
+        "returns a dict with the transcripts that consist of a single node, by node index"
+        mono = dict()
+        for trid, (tss, pas) in enumerate(zip(self._tss, self._pas)):
+            if tss == pas and tss is not None:
+                mono.setdefault(tss, []).append(trid)
+        return mono
+
+    # the results that depend on the nodes, which are computed on first use
+    _cache_keys = ("_altsplice_cache", "_boundaries", "_chain_index", "_bubbles", "_bubble_positions", "_bounds")
+
+    def _clear_cache(self):
+        "drops the results that depend on the nodes, after the graph has been modified"
+        for key in self._cache_keys:
+            self.__dict__.pop(key, None)
+
+    def __getstate__(self):
+        "the cached results are not pickled, they are computed again when needed"
+        return {k: v for k, v in self.__dict__.items() if k not in self._cache_keys}
+
+    @property
+    def n_transcripts(self):
+        "the number of transcripts in the segment graph"
+        return len(self._tss)
+
+    def _replace_segments(self, lo, hi, nodes, pre_map, suc_map):
+        """Replaces the segments lo to hi-1 by nodes, and maps the edges and the transcript start and end nodes to the new indices.
+
+        The edges of all nodes must still refer to the old indices. Only the edges from the first modified segment on are mapped.
+
+        :param pre_map: The new node index for each old node index, for predecessor edges and transcript ends.
+        :param suc_map: The new node index for each old node index, for successor edges and transcript starts."""
+        self._graph[lo:hi] = nodes
+        first_modified = next((k for k in range(lo, len(pre_map)) if pre_map[k] != k or suc_map[k] != k), None)
+        if first_modified is None:
+            return
+        for node in self._graph[:first_modified]:
+            suc = node.suc
+            for trid, idx in suc.items():
+                if idx >= first_modified:
+                    suc[trid] = suc_map[idx]
+        for node in self._graph[first_modified:]:
+            pre, suc = node.pre, node.suc
+            for trid, idx in pre.items():
+                pre[trid] = pre_map[idx]
+            for trid, idx in suc.items():
+                suc[trid] = suc_map[idx]
+        self._tss = [idx if idx is None else suc_map[idx] for idx in self._tss]
+        self._pas = [idx if idx is None else pre_map[idx] for idx in self._pas]
+
+    def _split_segments(self, exons):
+        """Splits the segments at the exon boundaries, and adds segments for the exonic regions not covered so far.
+
+        Only the segments overlapping the exons are replaced, the indices of the following segments are shifted.
+
+        :return: Dicts with the node indices of the segments starting and ending at the exon boundaries."""
+        graph = self._graph
+        lo = bisect_right([n.end for n in graph], exons[0][0])
+        hi = bisect_left([n.start for n in graph], exons[-1][1], lo)
+        region = graph[lo:hi]
+        boundaries = sorted({pos for n in region for pos in (n.start, n.end)}.union(pos for e in exons for pos in e))
+        # new node indices of the first and last part of the old segments
+        first, last = [], []
+        nodes = []
+        k = m = 0
+        for start, end in pairwise(boundaries):
+            while k < len(region) and region[k].end <= start:
+                k += 1
+            while m < len(exons) and exons[m][1] <= start:
+                m += 1
+            if k < len(region) and region[k].start <= start:
+                if region[k].start == start:
+                    first.append(lo + len(nodes))
+                if region[k].end == end:
+                    last.append(lo + len(nodes))
+                    if region[k].start == start:  # not split
+                        nodes.append(region[k])
+                        continue
+            elif m == len(exons) or exons[m][0] > start:
+                continue  # not exonic
+            nodes.append(SegGraphNode(start, end))
+        if len(nodes) > len(region) or any(i != j for i, j in zip(first, last)):
+            shift = len(nodes) - len(region)
+            following = range(hi + shift, len(graph) + shift)
+            pre_map = [*range(lo), *last, *following]
+            suc_map = [*range(lo), *first, *following]
+            # the transcripts covering the split segments, with the edges between the parts added after the mapping
+            mono = self._mono_nodes()
+            split = []
+            for k, node in enumerate(region):
+                i, j = first[k] - lo, last[k] - lo
+                if i < j:
+                    split.append((i, j, sorted(set(node.pre).union(node.suc, mono.get(lo + k, ())))))
+                    nodes[i] = SegGraphNode(nodes[i].start, nodes[i].end, node.pre, nodes[i].suc)
+                    nodes[j] = SegGraphNode(nodes[j].start, nodes[j].end, nodes[j].pre, node.suc)
+            self._replace_segments(lo, hi, nodes, pre_map, suc_map)
+            for i, j, cover in split:
+                for idx in range(i, j):
+                    nodes[idx].suc.update((trid, lo + idx + 1) for trid in cover)
+                    nodes[idx + 1].pre.update((trid, lo + idx) for trid in cover)
+        start_idx = {node.start: lo + i for i, node in enumerate(nodes)}
+        end_idx = {node.end: lo + i for i, node in enumerate(nodes)}
+        return start_idx, end_idx
+
+    def _merge_segments(self, lo, hi):
+        """Removes the segments lo to hi that are not covered anymore, and merges adjacent segments in this range if the boundary
+        between them is not used by any transcript. The indices of the following segments are shifted."""
+        graph = self._graph
+        lo, hi = max(lo - 1, 0), min(hi + 2, len(graph))  # also the boundaries to the adjacent segments
+        mono = self._mono_nodes()
+        new_idx = [None] * (hi - lo)  # index of the (merged) node in the new graph
+        nodes = []
+        for k in range(lo, hi):
+            node = graph[k]
+            if not (node.pre or node.suc or k in mono):
+                continue  # not covered anymore
+            if (
+                nodes
+                and new_idx[k - 1 - lo] is not None
+                and graph[k - 1].end == node.start
+                and k - 1 not in mono
+                and k not in mono
+                and all(idx == k for idx in graph[k - 1].suc.values())
+                and all(idx == k - 1 for idx in node.pre.values())
+                and graph[k - 1].suc.keys() >= graph[k - 1].pre.keys()
+                and node.pre.keys() >= node.suc.keys()
+            ):  # the boundary is not used by any transcript: merge with previous node
+                nodes[-1] = SegGraphNode(nodes[-1].start, node.end, nodes[-1].pre, node.suc)
+            else:
+                nodes.append(node)
+            new_idx[k - lo] = lo + len(nodes) - 1
+        if len(nodes) < hi - lo:
+            new_idx = [*range(lo), *new_idx, *range(hi + len(nodes) - (hi - lo), len(graph) + len(nodes) - (hi - lo))]
+            self._replace_segments(lo, hi, nodes, new_idx, new_idx)
+
+    def _unlink_transcript(self, i):
+        "removes the edges of the ith transcript, and returns the indices of its first and last node"
+        idx = self._tss[i]
+        while idx is not None:
+            node = self._graph[idx]
+            node.pre.pop(i, None)
+            idx = node.suc.pop(i, None)
+        return self._tss[i], self._pas[i]
+
+    def add_transcript(self, exons):
+        """Adds a transcript to the segment graph in place.
+
+        The segments overlapping the transcript are split at the new exon boundaries, and new segments are added for the exonic
+        regions not covered so far. The indices of the following segments are shifted.
+        The result is equivalent to a segment graph constructed with the transcript appended to the list of transcripts.
+
+        :param exons: A list of exon tuples representing the transcript
+        :return: The index of the new transcript"""
+        start_idx, end_idx = self._split_segments(exons)
+        self._tss.append(start_idx[exons[0][0]])
+        self._pas.append(end_idx[exons[-1][1]])
+        self._link_transcript(len(self._tss) - 1, exons, start_idx, end_idx)
+        self._clear_cache()
+        return len(self._tss) - 1
+
+    def remove_transcript(self, i):
+        """Removes a transcript from the segment graph in place.
+
+        Segments that are not covered anymore are removed, and adjacent segments are merged if the boundary between them
+        is not used by any of the remaining transcripts. The indices of the following transcripts are decremented by one.
+        The result is equivalent to a segment graph constructed without the transcript.
+
+        :param i: The index of the transcript to remove"""
+        lo, hi = self._unlink_transcript(i)
+        del self._tss[i]
+        del self._pas[i]
+        self._merge_segments(lo, hi)
+        for node in self._graph:
+            for edges in (node.pre, node.suc):
+                if edges and max(edges) > i:
+                    items = [(trid if trid < i else trid - 1, idx) for trid, idx in edges.items()]
+                    edges.clear()
+                    edges.update(items)
+        self._clear_cache()
+
+    def replace_transcript(self, i, exons):
+        """Replaces the exons of a transcript in place, e.g. if the transcript start or end has been moved.
+
+        Only the segments of the old and the new transcript are modified.
+        The result is equivalent to a segment graph constructed with the new exons of the transcript.
+
+        :param i: The index of the transcript to replace
+        :param exons: A list of exon tuples representing the new transcript"""
+        lo, hi = self._unlink_transcript(i)
+        self._tss[i] = self._pas[i] = None
+        self._merge_segments(lo, hi)
+        start_idx, end_idx = self._split_segments(exons)
+        self._tss[i] = start_idx[exons[0][0]]
+        self._pas[i] = end_idx[exons[-1][1]]
+        self._link_transcript(i, exons, start_idx, end_idx)
+        # the edges are ordered by transcript index, as in a new segment graph
+        for node in self._graph[self._tss[i] : self._pas[i] + 1]:
+            for edges in (node.pre, node.suc):
+                if i in edges and max(edges) > i:
+                    items = sorted(edges.items())
+                    edges.clear()
+                    edges.update(items)
+        self._clear_cache()
 
     def _restore(self, i: int) -> list:  # mainly for testing
         """Restore the i_{th} transcript from the Segment graph by traversing from 5' to 3'
@@ -109,6 +410,8 @@ class SegmentGraph:
 
         """Tests if a transcript (provided as list of exons) is contained in self and return the corresponding transcript indices.
 
+        Multi exon transcripts are looked up by their intron chain, in an index that is built on first use.
+
         :param exons: A list of exon tuples representing the transcript
         :type exons: list
         :return: a list of supporting transcript indices
@@ -126,39 +429,25 @@ class SegmentGraph:
                 and self[j1].start <= exons[0][1]
                 and self[j2].end >= exons[0][0]
             ]
-        # all junctions must be contained and no additional
-        tr = set(range(len(self._tss)))
-        j = 0
-        for i, e in enumerate(exons[:-1]):
-            while (
-                j < len(self) and self[j].end < e[1]
-            ):  # check exon (no junction allowed)
-                tr -= set(
-                    trid
-                    for trid, j2 in self[j].suc.items()
-                    if self[j].end != self[j2].start
-                )
-                j += 1
-            if self[j].end != e[1]:
-                return []
-            # check junction (must be present)
-            tr &= set(
-                trid
-                for trid, j2 in self[j].suc.items()
-                if self[j2].start == exons[i + 1][0]
-            )
-            j += 1
-            if len(tr) == 0:
-                return tr
-
-        while j < len(self):  # check last exon (no junction allowed)
-            tr -= set(
-                trid
-                for trid, j2 in self[j].suc.items()
-                if self[j].end != self[j2].start
-            )
-            j += 1
-        return [trid for trid in tr]
+        # multi exon transcript: all junctions must be contained and no additional
+        return list(self._intron_chain_index().get(intron_chain(exons), []))
+
+    def _intron_chain_index(self):
+        "dict with the intron chains of the multi exon transcripts as keys and lists of transcript indices as values"
+        try:
+            return self._chain_index
+        except AttributeError:  # built on first use, or graph from previous version
+            self._chain_index = {}
+            for trid, (j1, j2) in enumerate(zip(self._tss, self._pas)):
+                chain = []
+                while j1 != j2:
+                    j = self[j1].suc[trid]
+                    if self[j1].end != self[j].start:
+                        chain.extend((self[j1].end, self[j].start))
+                    j1 = j
+                if chain:
+                    self._chain_index.setdefault(tuple(chain), []).append(trid)
+            return self._chain_index
 
     def _is_same_exon(self, tr_nr, j1, j2):
         """Tests if nodes j1 and j2 belong to same exon in transcript tr_nr."""
@@ -200,38 +489,77 @@ class SegmentGraph:
             ]
         )
 
+    def _exon_nodes(self):
+        "returns the exons of each transcript as lists of (first node index, last node index) tuples"
+        first = [[j] for j in self._tss]
+        last = [[] for _ in self._tss]
+        for j, node in enumerate(self._graph):
+            if j + 1 < len(self._graph) and self._graph[j + 1].start == node.end:
+                junctions = [(trid, j2) for trid, j2 in node.suc.items() if j2 != j + 1]
+            else:
+                junctions = node.suc.items()
+            for trid, j2 in junctions:
+                last[trid].append(j)
+                first[trid].append(j2)
+        for trid, j in enumerate(self._pas):
+            last[trid].append(j)
+        return [list(zip(f, l)) for f, l in zip(first, last)]
+
     def find_fragments(self):
-        """Finds all fragments (e.g. transcript contained in other transcripts) in the segment graph."""
-        truncated = set()
-        contains = {}
-        starts = [set() for _ in range(len(self))]
-        for trid, idx in enumerate(self._tss):
-            starts[idx].add(trid)
-        nodes = self.get_node_matrix()
-        for trid, (tss, pas) in enumerate(zip(self._tss, self._pas)):
-            if trid in truncated:
-                continue
-            contains[trid] = {
-                trid2
-                for trid2, (tss2, pas2) in enumerate(zip(self._tss, self._pas))
-                if trid2 != trid
-                and tss2 >= tss
-                and pas2 <= pas
-                and all(nodes[trid2, tss2 : pas2 + 1] == nodes[trid, tss2 : pas2 + 1])
-            }
-            truncated.update(contains[trid])  # those are not checked
+        """Finds all fragments (e.g. transcript contained in other transcripts) in the segment graph.
+
+        A transcript is contained in another transcript, if its introns are a contiguous subsequence of the introns of the other,
+        and its first and last exon are within the corresponding exons of the other. The intron chains contained in other intron
+        chains are found for all transcripts at once, with an Aho-Corasick automaton.
+
+        :return: Dict with the fragments as keys, and lists of (containing transcript, number of introns missing at the 5' end,
+            number of introns missing at the 3' end) tuples as values. Containing transcripts are only reported if they are not
+            fragments themselves, and only the first of identical transcripts."""
+        groups = {}  # transcripts with identical nodes
+        for trid, exons in enumerate(self._exon_nodes()):
+            groups.setdefault(tuple(exons), []).append(trid)
+        paths = list(groups)
+        chains = {}  # paths by intron chain (in terms of node indices)
+        for i, exons in enumerate(paths):
+            chains.setdefault(intron_chain(exons), []).append(i)
+        contains = [[] for _ in paths]  # (contained path, number of preceding introns in the containing path)
+        spliced = [chain for chain in chains if chain]
+        # spliced paths: the introns are a contiguous subsequence, and the terminal exons are within the corresponding exons
+        for chain, found in zip(spliced, _find_substrings([tuple(zip(chain[::2], chain[1::2])) for chain in spliced])):
+            for k, pos in found:
+                sub_chain = spliced[k]
+                last = pos + len(sub_chain) // 2
+                for i in chains[chain]:
+                    for i2 in chains[sub_chain]:
+                        if i != i2 and paths[i][pos][0] <= paths[i2][0][0] and paths[i][last][1] >= paths[i2][-1][1]:
+                            contains[i].append((i2, pos))
+        # unspliced paths: within one exon
+        mono = sorted((paths[i][0], i) for i in chains.get((), []))
+        for i, exons in enumerate(paths):
+            for pos, (first, last) in enumerate(exons):
+                for (first2, last2), i2 in mono[bisect_left(mono, ((first, -1),)) :]:
+                    if first2 > last:
+                        break
+                    if i != i2 and last2 <= last:
+                        contains[i].append((i2, pos))
+        is_contained = [False] * len(paths)
+        for contained in contains:
+            for i2, _ in contained:
+                is_contained[i2] = True
 
         fragments = {}
-        for big, smallL in contains.items():
-            if big not in truncated:
-                for trid in smallL:
-                    delta1 = self._count_introns(big, self._tss[big], self._tss[trid])
-                    delta2 = self._count_introns(big, self._pas[trid], self._pas[big])
-                    fragments.setdefault(trid, []).append(
-                        (big, delta1, delta2)
-                        if self.strand == "+"
-                        else (big, delta2, delta1)
-                    )
+        for i in sorted((i for i in range(len(paths)) if not is_contained[i]), key=lambda i: groups[paths[i]][0]):
+            big, *identical = groups[paths[i]]
+            n_introns = len(paths[i]) - 1
+            contained = [(trid, 0, 0) for trid in identical]
+            for i2, pos in contains[i]:
+                contained.extend((trid, pos, n_introns - pos - len(paths[i2]) + 1) for trid in groups[paths[i2]])
+            for trid, delta1, delta2 in sorted(contained):
+                fragments.setdefault(trid, []).append(
+                    (big, delta1, delta2)
+                    if self.strand == "+"
+                    else (big, delta2, delta1)
+                )
         return fragments
 
     def get_alternative_splicing(self, exons, alternative=None):
@@ -240,10 +568,134 @@ class SegmentGraph:
         This function computes the novelty class of the provided transcript compared to (reference annotation) transcripts
         from the segment graph. It returns the "squanti category" (0=FSM,1=ISM,2=NIC,3=NNC,4=Novel gene) and the subcategory.
 
+        The results are cached by the intron chain and the position of transcript start and end relative to the segments,
+        which determines the classification. Hence, transcripts that differ only by TSS/PAS within the same segments share
+        the cache entry, with the positions of TSS/PAS filled in. The cache is stored with the segment graph,
+        so it is discarded when the graph is modified or recomputed. It is not pickled, e.g. when the transcriptome is saved.
+        See :func:`altsplice_cache_info` for cache statistics.
+
         :param exons: A list of exon tuples representing the transcript
         :type exons: list
+        :param alternative: A list of tuples with gene names and junction numbers covered by other genes (e.g. readthrough fusion).
+            The results depend on the other genes, so they are not cached.
         :return: pair with the squanti category number and the subcategories as list of novel splicing events that produce the provided transcript from the transcripts in splce graph
         :rtype: tuple"""
+        if alternative is not None and len(alternative) > 0:
+            return self._get_alternative_splicing(exons, alternative)
+        try:
+            cache = self._altsplice_cache
+        except AttributeError:  # e.g. graph from previous version
+            cache = self._init_altsplice_cache()
+        start, end = exons[0][0], exons[-1][1]
+        return self._cached_alternative_splicing(cache, exons, self._boundary_class(start), self._boundary_class(end))
+
+    def get_alternative_splicing_batch(self, transcripts, alternatives=None):
+        """Compares many transcripts to the segment graph and returns the novel splicing events for each transcript.
+
+        The results are the same as for :func:`get_alternative_splicing` of the individual transcripts, but the positions of
+        the transcripts relative to the segments are looked up for all transcripts at once.
+
+        :param transcripts: A list of transcripts, which are lists of exon tuples
+        :param alternatives: A list with the alternative parameter of :func:`get_alternative_splicing` for each transcript.
+        :return: A list with the squanti category number and the subcategories of each transcript"""
+        if not transcripts:
+            return []
+        if alternatives is None:
+            alternatives = [None] * len(transcripts)
+        try:
+            cache = self._altsplice_cache
+        except AttributeError:
+            cache = self._init_altsplice_cache()
+        starts, ends = self._segment_bounds()
+        boundaries = np.array(self._boundaries, dtype=np.int64)
+        tr_start = np.array([exons[0][0] for exons in transcripts], dtype=np.int64)
+        tr_end = np.array([exons[-1][1] for exons in transcripts], dtype=np.int64)
+        start_class = _boundary_classes(boundaries, tr_start)
+        end_class = _boundary_classes(boundaries, tr_end)
+        # first segment ending after the transcript start, and last segment starting before the end of the first exon
+        first = np.searchsorted(ends, tr_start, side="right").tolist()
+        last = (np.searchsorted(starts, [exons[0][1] for exons in transcripts]) - 1).tolist()
+        results = []
+        for exons, alternative, start_cls, end_cls, j1, j2 in zip(transcripts, alternatives, start_class, end_class, first, last):
+            if alternative is not None and len(alternative) > 0:
+                results.append(self._get_alternative_splicing(exons, alternative, j1, j2))
+            else:
+                results.append(self._cached_alternative_splicing(cache, exons, start_cls, end_cls, j1, j2))
+        return results
+
+    def _cached_alternative_splicing(self, cache, exons, start_class, end_class, j1=None, j2=None):
+        "looks up the novelty class in the cache, given the boundary classes of the transcript start and end"
+        start, end = exons[0][0], exons[-1][1]
+        key = (intron_chain(exons), start_class, end_class)
+        template = cache["results"].get(key)
+        if template is None:
+            cache["misses"] += 1
+            marked = [list(e) for e in exons]
+            marked[0][0] = _TerminalPos(start)
+            marked[-1][1] = _TerminalPos(end, is_end=True)
+            template = self._get_alternative_splicing(marked, j1=j1, j2=j2)
+            cache["results"][key] = template
+        else:
+            cache["hits"] += 1
+        return _fill_terminal_pos(template, start, end)
+
+    def _segment_bounds(self):
+        "arrays with the start and end positions of the segments, computed on first use"
+        try:
+            return self._bounds
+        except AttributeError:
+            self._bounds = (
+                np.array([n.start for n in self], dtype=np.int64),
+                np.array([n.end for n in self], dtype=np.int64),
+            )
+            return self._bounds
+
+    def _first_ending_after(self, pos, lo=0):
+        "index of the first segment (from lo) ending after pos, or len(self) if there is none"
+        return max(lo, bisect_right(self._segment_bounds()[1], pos))
+
+    def _first_starting_from(self, pos, lo=0):
+        "index of the first segment (from lo) starting at or after pos, or len(self) if there is none"
+        return max(lo, bisect_left(self._segment_bounds()[0], pos))
+
+    def _index_of(self, pos, is_end, lo=0):
+        "index of the segment (from lo) ending (is_end=True) or starting at pos, or None if there is none"
+        bounds = self._segment_bounds()[is_end]
+        j = bisect_left(bounds, pos, lo)
+        return j if j < len(bounds) and bounds[j] == pos else None
+
+    def segments_in(self, start, end):
+        """Returns the indices of the segments overlapping a genomic region, with binary search of the segment boundaries.
+
+        :param start: The start position of the region.
+        :param end: The end position of the region.
+        :return: A range with the indices of the segments."""
+        return range(self._first_ending_after(start), self._first_starting_from(end))
+
+    def _init_altsplice_cache(self):
+        self._altsplice_cache = {"results": {}, "hits": 0, "misses": 0}
+        self._boundaries = sorted({pos for n in self for pos in (n.start, n.end)})
+        return self._altsplice_cache
+
+    def _boundary_class(self, pos):
+        "position relative to the segment boundaries: index of the next boundary, and whether pos is on this boundary"
+        i = bisect_left(self._boundaries, pos)
+        return i, i < len(self._boundaries) and self._boundaries[i] == pos
+
+    def altsplice_cache_info(self):
+        """Returns the statistics of the cache for :func:`get_alternative_splicing`.
+
+        :return: Dict with the number of cache hits, misses and the number of cached results."""
+        try:
+            cache = self._altsplice_cache
+        except AttributeError:
+            cache = self._init_altsplice_cache()
+        return {"hits": cache["hits"], "misses": cache["misses"], "size": len(cache["results"])}
+
+    def _get_alternative_splicing(self, exons, alternative=None, j1=None, j2=None):
+        """computes the novelty class of a transcript, see :func:`get_alternative_splicing`
+
+        j1 and j2 are the first and last segment overlapping the first exon, if known"""
 
         # returns a tuple
         # the sqanti category: 0=FSM,1=ISM,2=NIC,3=NNC,4=Novel gene
@@ -266,13 +718,13 @@ class SegmentGraph:
             fusion_exons = set()
 
         is_reverse = self.strand == "-"
-        j1 = next((j for j, n in enumerate(self) if n.end > exons[0][0]))
-        # j1: index of first segment ending after exon start (i.e. first overlapping segment)
-        j2 = next(
-            (j - 1 for j in range(j1, len(self)) if self[j].start >= exons[0][1]),
-            len(self) - 1,
-        )
-        # j2: index of last segment starting befor exon end (i.e. last overlapping segment)
+        if j1 is None:
+            # j1: index of first segment ending after exon start (i.e. first overlapping segment)
+            j1 = self._first_ending_after(exons[0][0])
+            # j2: index of last segment starting befor exon end (i.e. last overlapping segment)
+            j2 = self._first_starting_from(exons[0][1], j1) - 1
+        if j1 == len(self):
+            raise ValueError(f"transcript starting at {exons[0][0]} does not overlap the segment graph")
 
         # check truncation at begining (e.g. low position)
         if (
@@ -465,13 +917,8 @@ class SegmentGraph:
             * j3: first node ending after e2 start, or len(self)
             * j4: last node starting before e2 end (assuming there is such a node)"""
         altsplice = {}
-        j3 = next(
-            (j for j in range(j2 + 1, len(self)) if self[j][1] > e2[0]), len(self)
-        )
-        j4 = next(
-            (j - 1 for j in range(j3, len(self)) if self[j].start >= e2[1]),
-            len(self) - 1,
-        )
+        j3 = self._first_ending_after(e2[0], j2 + 1)
+        j4 = self._first_starting_from(e2[1], j3) - 1
         if j3 == len(self) or self[j3].start > e2[1]:
             return j3, j4, altsplice  # no overlap with e2
         exon_skipping = set()
@@ -530,36 +977,31 @@ class SegmentGraph:
         :type size: int
         :return: a dict with the intron number as key and the shift as value (assuming size is smaller than introns)
         :rtype: dict"""
-        fuzzy = {}
-        if size < 1:  # no need to check
+        return self.fuzzy_junction_batch([exons], size)[0]
+
+    def fuzzy_junction_batch(self, transcripts, size):
+        """Looks for "fuzzy junctions" in many transcripts at once, see :func:`fuzzy_junction`.
+
+        :param transcripts: A list of transcripts, which are lists of exon tuples
+        :param size: The maximum size of the fuzzy junction
+        :return: a list with a dict for each transcript, with the intron number as key and the shift as value"""
+        fuzzy = [{} for _ in transcripts]
+        if size < 1 or not len(self):  # no need to check
             return fuzzy
-        j1 = 0
-        for i, e1 in enumerate(exons[:-1]):
-            e2 = exons[i + 1]
-            try:
-                j1 = next(
-                    j for j in range(j1, len(self)) if self[j].end + size >= e1[1]
-                )
-                # j1: first node intersecting size range of e1 end
-            except StopIteration:
-                break
+        starts, ends = self._segment_bounds()
+        tr_idx, intron_idx, donor, acceptor = _introns(transcripts)
+        # nodes ending within size of the donor, unless there is a node ending exactly at the donor
+        exact = _contains(ends, donor)
+        first = np.searchsorted(ends, donor - size).tolist()
+        last = np.searchsorted(ends, donor + size, side="right").tolist()
+        for k in np.flatnonzero(~exact & (np.array(first) < last)).tolist():
             shift = None
-            while (
-                j1 < len(self) and self[j1].end - e1[1] <= size
-            ):  # in case there are several nodes starting in the range around e1
-                shift_e1 = self[j1].end - e1[1]
-                # print(f'{i} {e1[1]}-{e2[0]} {shift_e1}')
-                if shift_e1 == 0:
-                    break
-                if any(
-                    self[j2].start - e2[0] == shift_e1
-                    for j2 in set(self[j1].suc.values())
-                ):
+            for j1 in range(first[k], last[k]):
+                shift_e1 = int(ends[j1] - donor[k])
+                if any(starts[j2] - acceptor[k] == shift_e1 for j2 in set(self[j1].suc.values())):
                     shift = shift_e1
-                j1 += 1
-            else:
-                if shift is not None:
-                    fuzzy[i] = shift
+            if shift is not None:
+                fuzzy[tr_idx[k]][intron_idx[k]] = shift
         return fuzzy
 
     def find_splice_sites(self, exons):
@@ -568,23 +1010,20 @@ class SegmentGraph:
         :param exons: A list of exon tuples representing the transcript
         :type exons: list
         :return: boolean array indicating whether the splice site is contained or not"""
+        return self.find_splice_sites_batch([exons])[0]
 
-        j = 0
-        sites = np.zeros((len(exons) - 1) * 2, dtype=bool)
-        for i, (e1, e2) in enumerate(pairwise(exons)):
-            while self[j].end < e1[1]:
-                j += 1
-                if j == len(self):
-                    return sites
-            if self[j].end == e1[1]:
-                sites[i * 2] = True
-            while self[j].start < e2[0]:
-                j += 1
-                if j == len(self):
-                    return sites
-            if self[j].start == e2[0]:
-                sites[i * 2 + 1] = True
-        return sites
+    def find_splice_sites_batch(self, transcripts):
+        """Checks whether the splice sites of many transcripts are present in the segment graph, see :func:`find_splice_sites`.
+
+        :param transcripts: A list of transcripts, which are lists of exon tuples
+        :return: A list with a boolean array for each transcript, indicating whether the splice site is contained or not"""
+        starts, ends = self._segment_bounds()
+        tr_idx, _, donor, acceptor = _introns(transcripts)
+        sites = np.empty(len(donor) * 2, dtype=bool)
+        # donor sites are segment ends, acceptor sites are segment starts
+        sites[0::2] = _contains(ends, donor)
+        sites[1::2] = _contains(starts, acceptor)
+        return np.split(sites, np.cumsum([(len(exons) - 1) * 2 for exons in transcripts[:-1]]))
 
     def get_overlap(self, exons):
         """Compute the exonic overlap of a new transcript with the segment graph.
@@ -592,22 +1031,27 @@ class SegmentGraph:
         :param exons: A list of exon tuples representing the transcript
         :type exons: list
         :return: the overlap"""
+        return self.get_overlap_batch([exons])[0]
 
-        ol = 0
-        j = 0
-        for e in exons:
-            while self[j].end < e[0]:  # no overlap
-                j += 1
-                if j == len(self):
-                    return ol
-            while self[j].start < e[1]:
-                i_end = min(e[1], self[j].end)
-                i_start = max(e[0], self[j].start)
-                ol += i_end - i_start
-                j += 1
-                if j == len(self):
-                    return ol
-        return ol
+    def get_overlap_batch(self, transcripts):
+        """Compute the exonic overlap of many transcripts with the segment graph, see :func:`get_overlap`.
+
+        :param transcripts: A list of transcripts, which are lists of exon tuples
+        :return: A list with the overlap of each transcript"""
+        starts, ends = self._segment_bounds()
+        # exonic length of the segment graph up to each segment start
+        offset = np.concatenate([[0], np.cumsum(ends - starts)])
+
+        def exonic_length(pos):
+            "exonic length of the segment graph before the positions"
+            j = np.searchsorted(starts, pos) - 1  # last segment starting before pos
+            return np.where(j < 0, 0, offset[j] + np.minimum(pos, ends[j]) - starts[j])
+
+        exon_start = np.array([e[0] for exons in transcripts for e in exons], dtype=np.int64)
+        exon_end = np.array([e[1] for exons in transcripts for e in exons], dtype=np.int64)
+        ol = exonic_length(exon_end) - exonic_length(exon_start) if len(self) else np.zeros(len(exon_start), dtype=np.int64)
+        tr_idx = np.repeat(np.arange(len(transcripts)), [len(exons) for exons in transcripts])
+        return np.bincount(tr_idx, weights=ol, minlength=len(transcripts)).astype(np.int64).tolist()
 
     def get_intron_support_matrix(self, exons):
         """Check the intron support for the provided transcript w.r.t. transcripts from self.
@@ -618,17 +1062,13 @@ class SegmentGraph:
         :param exons: A list of exon positions defining the transcript to check.
         :return: A boolean array of shape (n_transcripts in self)x(len(exons)-1).
             An entry is True iff the intron from "exons" is present in the respective transcript of self."""
-        node_iter = iter(self)
         ism = np.zeros(
-            (len(self._tss), len(exons) - 1), np.bool
+            (len(self._tss), len(exons) - 1), bool
         )  # the intron support matrix
         for intron_nr, (e1, e2) in enumerate(pairwise(exons)):
-            try:
-                node = next(n for n in node_iter if n.end >= e1[1])
-            except StopIteration:
-                return ism
-            if node.end == e1[1]:
-                for trid, suc in node.suc.items():
+            j = self._index_of(e1[1], is_end=True)
+            if j is not None:
+                for trid, suc in self[j].suc.items():
                     if self[suc].start == e2[0]:
                         ism[trid, intron_nr] = True
         return ism
@@ -644,7 +1084,7 @@ class SegmentGraph:
             An entry is True iff the exon from "exons" is fully covered in the respective transcript of self.
             First and last exon are checked to overlap the first and last exon of the ref transcript but do not need to be fully covered"""
         esm = np.zeros(
-            (len(self._tss), len(exons)), np.bool
+            (len(self._tss), len(exons)), bool
         )  # the intron support matrix
         for tr_nr, tss in enumerate(self._tss):  # check overlap of first exon
             for j in range(tss, len(self)):
@@ -671,19 +1111,18 @@ class SegmentGraph:
 
         j2 = 0
         for e_nr, e in enumerate(exons[1:-1]):
-            j1 = next((j for j in range(j2, len(self)) if self[j].end > e[0]))
             # j1: index of first segment ending after exon start (i.e. first overlapping segment)
-            j2 = next(
-                (j - 1 for j in range(j1, len(self)) if self[j].start >= e[1]),
-                len(self) - 1,
-            )
+            j1 = self._first_ending_after(e[0], j2)
+            if j1 == len(self):
+                break
             # j2: index of last segment starting befor exon end (i.e. last overlapping segment)
+            j2 = self._first_starting_from(e[1], j1) - 1
             if self[j1].start <= e[0] and self[j2].end >= e[1]:
                 covered = set.intersection(
                     *(set(self[j].suc) for j in range(j1, j2 + 1))
                 )
                 if covered:
-                    esm[covered, e_nr + 1] = True
+                    esm[sorted(covered), e_nr + 1] = True
         return esm
 
     def get_intersects(self, exons):
@@ -844,32 +1283,16 @@ class SegmentGraph:
 
         if any(t < 5 for t in tids):
 
-            try:
-                i, nA = next((idx, n) for idx, n in enumerate(self) if n.end == pos[0])
-                if len(pos) == 3:
-                    middle = [
-                        next(
-                            idx + i
-                            for idx, n in enumerate(self[i:])
-                            if n.start > pos[1]
-                        )
-                    ]
-                    j, nB = next(
-                        (idx + middle[0], n)
-                        for idx, n in enumerate(self[middle[0] :])
-                        if n.start == pos[2]
-                    )
-                else:
-                    j, nB = next(
-                        (idx + i, n)
-                        for idx, n in enumerate(self[i:])
-                        if n.start == pos[1]
-                    )
-                    middle = [idx for idx in range(i + 2, j)]
-            except StopIteration as e:
-                raise ValueError(
-                    f"cannot find segments at {pos} in segment graph"
-                ) from e
+            i = self._index_of(pos[0], is_end=True)
+            if i is not None and len(pos) == 3:
+                middle = [self._first_starting_from(pos[1] + 1, i)]
+                j = self._index_of(pos[2], is_end=False, lo=middle[0]) if middle[0] < len(self) else None
+            elif i is not None:
+                j = self._index_of(pos[1], is_end=False, lo=i)
+                middle = [idx for idx in range(i + 2, j)] if j is not None else []
+            if i is None or j is None:
+                raise ValueError(f"cannot find segments at {pos} in segment graph")
+            nA, nB = self[i], self[j]
 
             direct = set()  # primary
             indirect = set(), set(), set(), set()  # for es, as at start, as at end, ir
@@ -911,22 +1334,11 @@ class SegmentGraph:
                             yield me_event
                             seen_prim.update(me_event[0])
         if any(t > 4 for t in tids):
-            try:
-                i, nA = next(
-                    (idx, n) for idx, n in enumerate(self) if n.start >= pos[0]
-                )
-                j, nB = next(
-                    (
-                        (idx + i, n)
-                        for idx, n in enumerate(self[i:])
-                        if n.end >= pos[-1]
-                    ),
-                    (len(self) - 1, self[-1]),
-                )
-            except StopIteration as e:
-                raise ValueError(
-                    f"cannot find segments at {pos} in segment graph"
-                ) from e
+            i = self._first_starting_from(pos[0])
+            if i == len(self):
+                raise ValueError(f"cannot find segments at {pos} in segment graph")
+            j = min(max(i, bisect_left(self._segment_bounds()[1], pos[-1])), len(self) - 1)
+            nA, nB = self[i], self[j]
 
             if 5 in tids and nB.end == pos[-1]:  # TSS on +, PAS on -
                 alt = {
@@ -966,6 +1378,8 @@ class SegmentGraph:
             If ommited, all types are considered
         :param pos: If specified, restrict the search on specific position. This is useful to find the supporting transcripts for a given type if the position is known.
 
+        The bubbles of all types are enumerated on first use, and cached with the segment graph until it is modified.
+
         :return: Tuple with 1) transcript indices of primary (e.g. most direct) paths and 2) alternative paths respectivly,
             as well as 3) start and 4) end node ids and 5) type of alternative event
             ('ES','3AS', '5AS','IR' or 'ME', 'TSS', 'PAS')"""
@@ -974,18 +1388,59 @@ class SegmentGraph:
             types = ("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")
         elif isinstance(types, str):
             types = (types,)
-        alt_types = (
-            ("ES", "5AS", "3AS", "IR", "ME", "PAS", "TSS")
-            if self.strand == "-"
-            else ("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")
-        )
 
         if pos is not None:
+            alt_types = (
+                ("ES", "5AS", "3AS", "IR", "ME", "PAS", "TSS")
+                if self.strand == "-"
+                else ("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")
+            )
             for prim, alt, i, j, alt_tid in self._find_splice_bubbles_at_position(
                 [i for i, t in enumerate(alt_types) if t in types], pos
             ):
                 yield list(prim), list(alt), i, j, alt_types[alt_tid]
             return
+        for prim, alt, i, j, splice_type in self._splice_bubbles():
+            if splice_type in types:
+                yield list(prim), list(alt), i, j, splice_type
+
+    def _splice_bubbles(self):
+        "the list of splice bubbles of all types, enumerated on first use"
+        try:
+            return self._bubbles
+        except AttributeError:  # not computed yet, or graph from previous version
+            self._bubbles = list(self._find_splice_bubbles(("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")))
+            return self._bubbles
+
+    def get_bubble_positions(self):
+        """Returns the genomic positions of the splice bubbles, e.g. to check which events are known in the reference.
+
+        The result is cached with the segment graph until it is modified.
+
+        :return: Dict with the event types as keys and sets of positions as values: the position of the splice junction for
+            'TSS' and 'PAS', and (start, end) of the alternative for the other types."""
+        try:
+            return self._bubble_positions
+        except AttributeError:
+            positions = {}
+            for _, _, nX, nY, splice_type in self._splice_bubbles():
+                if splice_type in ("TSS", "PAS"):
+                    if (splice_type == "TSS") == (self.strand == "+"):
+                        positions.setdefault(splice_type, set()).add(self[nX].end)
+                    else:
+                        positions.setdefault(splice_type, set()).add(self[nY].start)
+                else:
+                    positions.setdefault(splice_type, set()).add((self[nX].end, self[nY].start))
+            self._bubble_positions = positions
+            return positions
+
+    def _find_splice_bubbles(self, types):
+        "enumerates the splice bubbles of the given types, see :func:`find_splice_bubbles`"
+        alt_types = (
+            ("ES", "5AS", "3AS", "IR", "ME", "PAS", "TSS")
+            if self.strand == "-"
+            else ("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")
+        )
         if any(t in types for t in ("ES", "3AS", "5AS", "IR", "ME")):
             # alternative types: intron retention, alternative splice site at left and right, exon skipping, mutually exclusive
             inB_sets = [
@@ -1156,10 +1611,8 @@ class SegmentGraph:
 
         :param position: The genomic position to check.
         :return: True, if the position overlaps with an exon, else False."""
-        for n in self:
-            if n[0] <= position and n[1] >= position:
-                return True
-        return False
+        j = bisect_left(self._segment_bounds()[1], position)  # first segment ending at or after position
+        return j < len(self) and self[j].start <= position
 
     def _get_all_exons(self, nodeX, nodeY, tr):
         "get all exons from nodeX to nodeY for transcripts tr"
@@ -1193,6 +1646,160 @@ class SegmentGraph:
         return len(self._graph)
 
 
+class ArraySegmentGraph(SegmentGraph):
+    """Segment Graph Implementation backed by numpy arrays
+
+    This is an alternative to :class:`SegmentGraph` with the same interface, which needs considerably less memory, in particular
+    for pickled graphs of genes with many transcripts. The segments are stored as arrays of start and end positions, and the
+    transcripts as paths of node indices in compressed sparse row (CSR) format. The edges are derived from the paths, and are
+    again stored as CSR arrays, sorted by node. The nodes (:class:`SegGraphNode` with pre and suc dicts) are created on first
+    access and kept until :func:`compact` is called or the graph is pickled.
+    The graph cannot be modified in place, genes construct a new graph when their transcripts have changed.
+
+    :param transcripts: A list of transcripts, which are lists of exons, which in turn are (start,end) tuples
+    :type transcripts: list
+    :param strand: the strand of the gene, either "+" or "-"
+    """
+
+    in_place_updates = False
+
+    def __init__(self, transcripts, strand):
+        self.strand = strand
+        assert strand in "+-", 'strand must be either "+" or "-"'
+        self._build(transcripts)
+
+    def _build(self, transcripts):
+        "computes the segments and the transcript paths"
+        n_exons = np.array([len(tr) for tr in transcripts], dtype=np.int64)
+        exon_start = np.array([e[0] for tr in transcripts for e in tr], dtype=np.int64)
+        exon_end = np.array([e[1] for tr in transcripts for e in tr], dtype=np.int64)
+        boundaries = np.unique(np.concatenate([exon_start, exon_end]))
+        open_exons = np.zeros(len(boundaries), dtype=np.int64)
+        np.add.at(open_exons, np.searchsorted(boundaries, exon_start), 1)
+        np.add.at(open_exons, np.searchsorted(boundaries, exon_end), -1)
+        covered = np.cumsum(open_exons)[:-1] > 0
+        self._starts = boundaries[:-1][covered]
+        self._ends = boundaries[1:][covered]
+        # the nodes of each exon: from the node starting at the exon start to the node ending at the exon end
+        first = np.searchsorted(self._starts, exon_start)
+        n_nodes = np.searchsorted(self._ends, exon_end) - first + 1
+        offset = np.cumsum(n_nodes) - n_nodes
+        self._path = (np.arange(n_nodes.sum()) - np.repeat(offset - first, n_nodes)).astype(np.int32)
+        exon_ptr = np.concatenate([[0], np.cumsum(n_exons)])
+        self._path_ptr = np.concatenate([[0], np.cumsum(n_nodes)]).astype(np.int64)[exon_ptr]
+        self._link()
+
+    def _link(self):
+        "derives the edges and the transcript start and end nodes from the paths"
+        self.compact()
+        self._tss = self._path[self._path_ptr[:-1]].tolist()
+        self._pas = self._path[self._path_ptr[1:] - 1].tolist()
+        trid = np.repeat(np.arange(len(self._tss), dtype=np.int32), np.diff(self._path_ptr))
+        linked = trid[:-1] == trid[1:]  # consecutive nodes of the same transcript
+        trid, src, dst = trid[:-1][linked], self._path[:-1][linked], self._path[1:][linked]
+        node_range = np.arange(len(self._starts) + 1)
+        order = np.lexsort((trid, src))
+        self._suc_ptr = np.searchsorted(src[order], node_range)
+        self._suc_tr, self._suc_node = trid[order], dst[order]
+        order = np.lexsort((trid, dst))
+        self._pre_ptr = np.searchsorted(dst[order], node_range)
+        self._pre_tr, self._pre_node = trid[order], src[order]
+        self._clear_cache()
+
+    def _transcripts(self):
+        "restores the exons of all transcripts from the paths"
+        path_starts, path_ends = self._starts[self._path], self._ends[self._path]
+        transcripts = []
+        for i, j in pairwise(self._path_ptr.tolist()):
+            # exons are split where consecutive nodes are not adjacent
+            split = (np.flatnonzero(path_starts[i + 1 : j] != path_ends[i : j - 1]) + i).tolist()
+            transcripts.append(
+                [
+                    (int(path_starts[k]), int(path_ends[m]))
+                    for k, m in zip([i] + [s + 1 for s in split], split + [j - 1])
+                ]
+            )
+        return transcripts
+
+    def add_transcript(self, exons):
+        "not supported, construct a new segment graph instead"
+        raise NotImplementedError("ArraySegmentGraph cannot be modified in place, construct a new graph instead")
+
+    def remove_transcript(self, i):
+        "not supported, construct a new segment graph instead"
+        raise NotImplementedError("ArraySegmentGraph cannot be modified in place, construct a new graph instead")
+
+    def replace_transcript(self, i, exons):
+        "not supported, construct a new segment graph instead"
+        raise NotImplementedError("ArraySegmentGraph cannot be modified in place, construct a new graph instead")
+
+    def _intron_chain_index(self):
+        try:
+            return self._chain_index
+        except AttributeError:
+            self._chain_index = {}
+            for trid, exons in enumerate(self._transcripts()):
+                if len(exons) > 1:
+                    self._chain_index.setdefault(intron_chain(exons), []).append(trid)
+            return self._chain_index
+
+    def _segment_bounds(self):
+        return self._starts, self._ends
+
+    def _exon_nodes(self):
+        # exons end where consecutive nodes of a path are not adjacent, or at the end of the path
+        exon_end = self._ends[self._path[:-1]] != self._starts[self._path[1:]]
+        exon_end[self._path_ptr[1:-1] - 1] = True
+        last = np.append(np.flatnonzero(exon_end), len(self._path) - 1)
+        first = np.insert(last[:-1] + 1, 0, 0)
+        exons = list(zip(self._path[first].tolist(), self._path[last].tolist()))
+        exon_ptr = np.searchsorted(last, self._path_ptr).tolist()
+        return [exons[i:j] for i, j in pairwise(exon_ptr)]
+
+    def compact(self):
+        "Releases the nodes created on access, such that only the arrays are kept in memory."
+        self._nodes = [None] * len(self._starts)
+        self._complete = False  # True if all nodes have been created
+
+    def _node(self, j):
+        node = self._nodes[j]
+        if node is None:
+            i, k = self._pre_ptr[j], self._pre_ptr[j + 1]
+            pre = dict(zip(self._pre_tr[i:k].tolist(), self._pre_node[i:k].tolist()))
+            i, k = self._suc_ptr[j], self._suc_ptr[j + 1]
+            suc = dict(zip(self._suc_tr[i:k].tolist(), self._suc_node[i:k].tolist()))
+            node = self._nodes[j] = SegGraphNode(int(self._starts[j]), int(self._ends[j]), pre, suc)
+        return node
+
+    @property
+    def _graph(self):
+        if not self._complete:
+            for j, node in enumerate(self._nodes):
+                if node is None:
+                    self._node(j)
+            self._complete = True
+        return self._nodes
+
+    def __getitem__(self, key):
+        if self._complete:
+            return self._nodes[key]
+        node = self._nodes[key]  # raises IndexError like a list
+        if isinstance(key, slice):
+            return [self._node(j) for j in range(len(self._starts))[key]] if None in node else node
+        return self._node(key % len(self._starts)) if node is None else node
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getstate__(self):
+        "only the segments and the paths are pickled, the edges and nodes are recomputed"
+        return {k: self.__dict__[k] for k in ("strand", "_starts", "_ends", "_path", "_path_ptr")}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._link()
+
+
 class SegGraphNode(tuple):
     """A node in a segment graph represents an exonic segment."""
 
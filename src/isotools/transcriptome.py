@@ -88,6 +88,13 @@ class Transcriptome:
         logger.info(f"saving transcriptome to {pickle_file}")
         pickle.dump(self, open(pickle_file, "wb"))
 
+    def __getstate__(self):
+        "the lazily computed lookup tables are not pickled, they get recomputed on demand"
+        state = self.__dict__.copy()
+        for cache in ("_ref_splice_sites", "_chim_idx", "_bp_idx"):
+            state.pop(cache, None)
+        return state
+
     @classmethod
     def load(cls, pickle_file) -> "Transcriptome":
         """Restores transcriptome information from a pickle file.
@@ -129,23 +136,31 @@ class Transcriptome:
         return ref_tr
 
     def make_index(self):
-        """Updates the index of gene names and ids (e.g. used by the the [] operator)."""
-        idx = dict()
+        """Updates the index of gene names, ids and aliases (e.g. used by the the [] operator).
+
+        This also drops the lookup table of reference splice sites, which is recomputed on demand,
+        so make_index should be called whenever genes have been added, removed or modified."""
+        self.__dict__.pop("_ref_splice_sites", None)
+        self._idx = dict()
         for g in self:
-            if g.id in idx:  # at least id should be unique - maybe raise exception?
-                logger.warn(
-                    f"{g.id} seems to be ambigous: {str(self[g.id])} vs {str(g)}"
-                )
-            idx[g.name] = g
-            idx[g.id] = g
-        self._idx = idx
+            self._index_gene(g)
+
+    def _index_gene(self, g):
+        "adds a new gene to the index of gene names, ids and aliases, or replaces a gene with the same id"
+        idx = self._idx
+        if g.id in idx and idx[g.id].data is not g.data:  # at least id should be unique - maybe raise exception?
+            logger.warn(f"{g.id} seems to be ambigous: {str(idx[g.id])} vs {str(g)}")
+        if "alias" in g.data:  # e.g. the numeric id of novel genes
+            idx[g.data["alias"]] = g
+        idx[g.name] = g
+        idx[g.id] = g
 
     ##### basic user level functionality
     def __getitem__(self, key):
         """
         Syntax: self[key]
 
-        :param key: May either be the gene name or the gene id
+        :param key: May either be the gene name, the gene id or the alias of novel genes
         :return: The gene specified by key.
         """
         return self._idx[key]
@@ -161,7 +176,7 @@ class Transcriptome:
 
         Checks whether key is in self.
 
-        :param key: May either be the gene name or the gene id"""
+        :param key: May either be the gene name, the gene id or the alias of novel genes"""
         return key in self._idx
 
     def remove_chromosome(self, chromosome):
@@ -171,6 +186,20 @@ class Transcriptome:
         del self.data[chromosome]
         self.make_index()
 
+    def set_segment_graph_backend(self, backend="dict"):
+        """Selects the implementation of the segment graphs of the genes.
+
+        The segment graphs computed so far are discarded, and recomputed on demand with the selected implementation.
+
+        :param backend: Either "dict" for :class:`~isotools.SegmentGraph`, or "array" for the numpy array based
+            :class:`~isotools.ArraySegmentGraph`, which needs less memory, in particular when saved."""
+        assert backend in ("dict", "array"), 'backend must be either "dict" or "array"'
+        self.infos["segment_graph_backend"] = backend
+        for g in self:
+            g.data["segment_graph"] = None
+            if g.is_annotated:
+                g.data["reference"]["segment_graph"] = None
+
     def _get_sample_idx(self, group_column="name"):
         "a dict with group names as keys and index lists as values"
         return self.infos["sample_table"].groupby(group_column).groups
@@ -251,10 +280,21 @@ class Transcriptome:
     ### IO: utility functions
     from ._transcriptome_io import (
         _add_chimeric,
+        _add_collapsed,
         _add_novel_genes,
         _add_sample_transcript,
+        _add_sample_table_rows,
+        _breakpoint_index,
+        _breakpoint_index_add,
+        _chimeric_index,
         _get_intersects,
+        _import_bam,
+        _reference_splice_sites,
+        _update_coverage,
         add_sample_from_bam,
+        add_samples_from_bam,
+        add_samples_from_bams,
+        add_samples_from_collapsed,
         add_short_read_coverage,
         chimeric_table,
         collapse_immune_genes,
@@ -274,8 +314,10 @@ class Transcriptome:
         altsplice_test,
         direct_repeat_hist,
         downstream_a_hist,
+        event_matrix,
         exons_per_transcript_hist,
         filter_stats,
+        precompute_splice_bubbles,
         splice_dependence_test,
         transcript_coverage_hist,
         transcript_length_hist,
@@ -0,0 +1,332 @@
+import pickle
+import random
+
+import pytest
+
+from isotools.splice_graph import ArraySegmentGraph, SegmentGraph
+from isotools._utils import intron_chain
+
+
+def random_transcript(rng, length=60):
+    "random exon list with up to 5 exons, exons may be adjacent"
+    n = rng.randint(1, 5)
+    pos = sorted(rng.sample(range(length), 2 * n))
+    return [(pos[2 * j], pos[2 * j + 1]) for j in range(n)]
+
+
+def graph_state(sg):
+    "the nodes with their links and the transcript start/end nodes, which fully describe the segment graph"
+    return (
+        [(n.start, n.end, list(n.pre.items()), list(n.suc.items())) for n in sg],
+        sg._tss,
+        sg._pas,
+    )
+
+
+def test_find_splice_sites_after_missing_acceptor():
+    "a donor directly following an acceptor that is not in the graph is found"
+    sg = SegmentGraph([[(0, 10), (20, 30), (40, 50)]], "+")
+    assert sg.find_splice_sites([(0, 10), (25, 30), (40, 50)]).tolist() == [True, False, True, True]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_find_splice_sites(seed):
+    "the splice sites are found iff a node of the graph ends at the donor or starts at the acceptor"
+    rng = random.Random(seed)
+    for _ in range(300):
+        sg = SegmentGraph([random_transcript(rng) for _ in range(rng.randint(1, 4))], rng.choice("+-"))
+        ends, starts = {n.end for n in sg}, {n.start for n in sg}
+        exons = random_transcript(rng)
+        expected = [site for e1, e2 in zip(exons, exons[1:]) for site in (e1[1] in ends, e2[0] in starts)]
+        assert sg.find_splice_sites(exons).tolist() == expected
+
+
+def alternative_splicing(get, exons):
+    try:
+        return get(exons)
+    except (StopIteration, IndexError, ValueError) as e:  # query outside of the graph
+        return type(e)
+
+
+@pytest.mark.parametrize("strand", ["+", "-"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_alternative_splicing_cache(strand, seed):
+    "the cached novelty classification equals the computed one, also for queries that share the cache entry"
+    rng = random.Random(seed)
+    hits = 0
+    for _ in range(100):
+        sg = SegmentGraph([random_transcript(rng) for _ in range(rng.randint(1, 4))], strand)
+        queries = [[list(e) for e in random_transcript(rng)] for _ in range(10)]
+        # the same intron chains with other start and end positions
+        queries += [[[q[0][0] + rng.randint(-2, 0), q[0][1]]] + q[1:-1] + [[q[-1][0], q[-1][1] + rng.randint(0, 2)]] for q in queries if len(q) > 1]
+        queries += queries
+        for q in queries:
+            assert alternative_splicing(sg.get_alternative_splicing, q) == alternative_splicing(sg._get_alternative_splicing, q)
+        info = sg.altsplice_cache_info()
+        assert info["hits"] + info["misses"] == len(queries)
+        assert info["size"] <= info["misses"]  # queries outside of the graph raise, and are not cached
+        hits += info["hits"]
+    assert hits > 0
+
+
+def test_pickle_without_cache():
+    "the cached results are not pickled with the segment graph, and are computed again after loading"
+    rng = random.Random(0)
+    for _ in range(50):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 6))]
+        sg = SegmentGraph(transcripts, "+")
+        queries = [random_transcript(rng) for _ in range(3)] + transcripts
+        expected = [alternative_splicing(sg.get_alternative_splicing, q) for q in queries]
+        [sg.search_transcript(tr) for tr in transcripts]
+        bubbles, positions = list(sg.find_splice_bubbles()), sg.get_bubble_positions()
+        sg.is_exonic(transcripts[0][0][0])
+        assert {"_altsplice_cache", "_bubbles", "_bubble_positions", "_bounds"} <= set(sg.__dict__)
+        loaded = pickle.loads(pickle.dumps(sg))
+        assert not set(SegmentGraph._cache_keys) & set(loaded.__dict__)
+        assert graph_state(loaded) == graph_state(sg)
+        assert [alternative_splicing(loaded.get_alternative_splicing, q) for q in queries] == expected
+        assert list(loaded.find_splice_bubbles()) == bubbles and loaded.get_bubble_positions() == positions
+
+
+@pytest.mark.parametrize("strand", ["+", "-"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_add_remove_transcript(strand, seed):
+    "random sequences of added, modified and removed transcripts result in the same graph as the constructor"
+    rng = random.Random(seed)
+    for _ in range(150):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 6))]
+        queries = [random_transcript(rng) for _ in range(3)] + transcripts
+        sg = SegmentGraph(transcripts[:1], strand)
+        current = transcripts[:1]
+        for tr in transcripts[1:]:
+            [alternative_splicing(sg.get_alternative_splicing, q) for q in queries]  # fill the cache
+            sg.add_transcript(tr)
+            current.append(tr)
+            expected = SegmentGraph(current, strand)
+            assert graph_state(sg) == graph_state(expected)
+            assert [alternative_splicing(sg.get_alternative_splicing, q) for q in queries] == [alternative_splicing(expected.get_alternative_splicing, q) for q in queries]
+        for _ in range(3):  # move the start or end of a transcript, as when reads are merged
+            i = rng.randrange(len(current))
+            exons = [list(e) for e in current[i]]
+            exons[0][0] = rng.randint(max(exons[0][0] - 10, 0), exons[0][1] - 1)
+            exons[-1][1] = rng.randint(exons[-1][0] + 1, exons[-1][1] + 10)
+            sg.replace_transcript(i, exons)
+            current[i] = exons
+            expected = SegmentGraph(current, strand)
+            assert graph_state(sg) == graph_state(expected)
+            assert [alternative_splicing(sg.get_alternative_splicing, q) for q in queries] == [alternative_splicing(expected.get_alternative_splicing, q) for q in queries]
+        while current:
+            i = rng.randrange(len(current))
+            sg.remove_transcript(i)
+            del current[i]
+            expected = SegmentGraph(current, strand)
+            assert graph_state(sg) == graph_state(expected)
+            if current:
+                assert [sg._restore(j) for j in range(len(current))] == [[list(e) for e in tr] for tr in current]
+                assert [alternative_splicing(sg.get_alternative_splicing, q) for q in queries] == [alternative_splicing(expected.get_alternative_splicing, q) for q in queries]
+
+
+@pytest.mark.parametrize("strand", ["+", "-"])
+def test_array_segment_graph(strand):
+    "the array based segment graph has the same nodes and results as the dict based segment graph, also after pickling"
+    rng = random.Random(0)
+    for _ in range(300):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 8))]
+        expected = SegmentGraph(transcripts, strand)
+        sg = pickle.loads(pickle.dumps(ArraySegmentGraph(transcripts, strand)))
+        assert graph_state(sg) == graph_state(expected)
+        assert sg._transcripts() == [[tuple(e) for e in tr] for tr in transcripts]
+        assert list(sg.find_splice_bubbles()) == list(expected.find_splice_bubbles())
+        assert sg.find_fragments() == expected.find_fragments()
+        queries = [random_transcript(rng) for _ in range(3)] + transcripts
+        assert [alternative_splicing(sg.get_alternative_splicing, q) for q in queries] == [alternative_splicing(expected.get_alternative_splicing, q) for q in queries]
+        sg.compact()
+        assert graph_state(sg) == graph_state(expected)
+        with pytest.raises(NotImplementedError):
+            sg.add_transcript(random_transcript(rng))
+        with pytest.raises(NotImplementedError):
+            sg.remove_transcript(0)
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+def test_search_transcript(graph_type):
+    "multi exon transcripts are found by their intron chain, also after the graph has been modified or constructed again"
+    rng = random.Random(0)
+    for _ in range(300):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 8))]
+        sg = graph_type(transcripts, "+")
+        [sg.search_transcript(tr) for tr in transcripts if len(tr) > 1]  # build the index
+        new_transcripts = [random_transcript(rng) for _ in range(3)]
+        transcripts = transcripts[1:] + new_transcripts
+        if sg.in_place_updates:
+            for tr in new_transcripts:
+                sg.add_transcript(tr)
+            sg.remove_transcript(0)
+        else:
+            sg = graph_type(transcripts, "+")
+        for query in transcripts + [random_transcript(rng) for _ in range(5)]:
+            if len(query) > 1:
+                chain = intron_chain(query)
+                assert sg.search_transcript(query) == [i for i, tr in enumerate(transcripts) if intron_chain(tr) == chain]
+
+
+def fragments_pairwise(sg):
+    "the fragments found by comparing all pairs of transcripts in the node matrix"
+    truncated, contains = set(), {}
+    nodes = sg.get_node_matrix()
+    for trid, (tss, pas) in enumerate(zip(sg._tss, sg._pas)):
+        if trid in truncated:
+            continue
+        contains[trid] = {
+            trid2
+            for trid2, (tss2, pas2) in enumerate(zip(sg._tss, sg._pas))
+            if trid2 != trid and tss2 >= tss and pas2 <= pas and all(nodes[trid2, tss2 : pas2 + 1] == nodes[trid, tss2 : pas2 + 1])
+        }
+        truncated.update(contains[trid])
+    fragments = {}
+    for big, small in contains.items():
+        if big not in truncated:
+            for trid in sorted(small):
+                delta1 = sg._count_introns(big, sg._tss[big], sg._tss[trid])
+                delta2 = sg._count_introns(big, sg._pas[trid], sg._pas[big])
+                fragments.setdefault(trid, []).append((big, delta1, delta2) if sg.strand == "+" else (big, delta2, delta1))
+    return fragments
+
+
+@pytest.mark.parametrize("strand", ["+", "-"])
+def test_find_fragments(strand):
+    "the fragments are the same as found by pairwise comparison, including identical and truncated transcripts"
+    rng = random.Random(0)
+    for _ in range(500):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 6))]
+        for tr in rng.sample(transcripts, rng.randint(0, len(transcripts))):
+            i = rng.randrange(len(tr))
+            j = rng.randrange(i, len(tr))
+            fragment = [list(e) for e in tr[i : j + 1]]
+            fragment[0][0] = rng.randint(fragment[0][0], fragment[0][1] - 1)
+            fragment[-1][1] = rng.randint(fragment[-1][0] + 1, fragment[-1][1])
+            transcripts.insert(rng.randrange(len(transcripts) + 1), fragment)
+        transcripts += rng.choices(transcripts, k=rng.randint(0, 2))  # identical transcripts
+        sg = SegmentGraph(transcripts, strand)
+        assert sg.find_fragments() == fragments_pairwise(sg)
+
+
+@pytest.mark.parametrize("strand", ["+", "-"])
+def test_splice_bubble_cache(strand):
+    "the cached bubbles are the same as a new search, for all types and after the graph has been modified"
+    rng = random.Random(0)
+    types = [None, "ES", ("3AS", "5AS"), ("ME", "TSS", "PAS"), "IR"]
+    for _ in range(200):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(2, 8))]
+        sg = SegmentGraph(transcripts, strand)
+        for t in types:
+            search_types = (t,) if isinstance(t, str) else t or ("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")
+            expected = list(SegmentGraph(transcripts, strand)._find_splice_bubbles(search_types))
+            assert list(sg.find_splice_bubbles(t)) == expected
+        positions = sg.get_bubble_positions()
+        tr = random_transcript(rng)
+        sg.add_transcript(tr)
+        expected = SegmentGraph(transcripts + [tr], strand)
+        assert list(sg.find_splice_bubbles()) == list(expected._find_splice_bubbles(("ES", "3AS", "5AS", "IR", "ME", "TSS", "PAS")))
+        assert sg.get_bubble_positions() == expected.get_bubble_positions()
+        assert sg.get_bubble_positions() is not positions
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+@pytest.mark.parametrize("strand", ["+", "-"])
+def test_batch_queries(graph_type, strand):
+    "the batch variants report the same as the checks of the individual transcripts"
+    rng = random.Random(0)
+    for _ in range(200):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 6))]
+        queries = [random_transcript(rng, 70) for _ in range(10)] + transcripts
+        sg = graph_type(transcripts, strand)
+        ends, starts = {n.end for n in sg}, {n.start for n in sg}
+        expected_sites = [[pos in (ends if i % 2 == 0 else starts) for i, pos in enumerate(intron_chain(q))] for q in queries]
+        assert [sites.tolist() for sites in sg.find_splice_sites_batch(queries)] == expected_sites
+        expected_ol = [sum(max(0, min(e[1], n.end) - max(e[0], n.start)) for e in q for n in sg) for q in queries]
+        assert sg.get_overlap_batch(queries) == expected_ol
+        fuzzy = sg.fuzzy_junction_batch(queries, 3)
+        for q, shifts in zip(queries, fuzzy):
+            for i, (e1, e2) in enumerate(zip(q[:-1], q[1:])):
+                candidates = [n.end - e1[1] for n in sg if abs(n.end - e1[1]) <= 3]
+                found = [s for s in candidates if any(sg[j].start - e2[0] == s for n in sg if n.end - e1[1] == s for j in n.suc.values())]
+                assert shifts.get(i) == (None if 0 in candidates or not found else max(found))
+        inside = [q for q in queries if q[0][0] < sg[-1].end]  # the single query fails for transcripts after the graph
+        expected = [alternative_splicing(graph_type(transcripts, strand).get_alternative_splicing, q) for q in inside]
+        assert sg.get_alternative_splicing_batch(inside) == expected
+        assert sg.get_alternative_splicing_batch(inside) == expected  # from the cache
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+def test_get_overlap(graph_type):
+    "the overlap is summed over all exons, also if a segment spans an intron of the transcript"
+    assert graph_type([[(0, 100)]], "+").get_overlap([(10, 20), (30, 40)]) == 20
+    rng = random.Random(1)
+    for _ in range(300):
+        sg = graph_type([random_transcript(rng) for _ in range(rng.randint(1, 4))], rng.choice("+-"))
+        exons = random_transcript(rng, 70)
+        assert sg.get_overlap(exons) == sum(max(0, min(e[1], n.end) - max(e[0], n.start)) for e in exons for n in sg)
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+def test_fuzzy_junction(graph_type):
+    "each intron is checked independently, also if the nodes within size of its donor were scanned for the previous intron"
+    assert graph_type([[(0, 10), (20, 30), (40, 50)]], "+").fuzzy_junction([(0, 7), (9, 12), (22, 30), (40, 50)], 3) == {1: -2}
+    rng = random.Random(1)
+    for _ in range(300):
+        sg = graph_type([random_transcript(rng) for _ in range(rng.randint(1, 4))], rng.choice("+-"))
+        exons = random_transcript(rng)
+        expected = {}
+        for i, (e1, e2) in enumerate(zip(exons[:-1], exons[1:])):
+            shifts = [n.end - e1[1] for n in sg if abs(n.end - e1[1]) <= 3]
+            found = [s for s in shifts if any(sg[j].start - e2[0] == s for n in sg if n.end - e1[1] == s for j in n.suc.values())]
+            if found and 0 not in shifts:
+                expected[i] = max(found)
+        assert sg.fuzzy_junction(exons, 3) == expected
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+@pytest.mark.parametrize("strand", ["+", "-"])
+def test_positional_lookups(graph_type, strand):
+    "the binary searches over the segment boundaries find the same segments as a scan over all segments"
+    rng = random.Random(0)
+    for _ in range(200):
+        transcripts = [random_transcript(rng) for _ in range(rng.randint(1, 6))]
+        sg = graph_type(transcripts, strand)
+        for _ in range(10):
+            start = rng.randrange(-5, 70)
+            end = start + rng.randrange(1, 30)
+            assert list(sg.segments_in(start, end)) == [i for i, n in enumerate(sg) if n.end > start and n.start < end]
+            assert sg.is_exonic(start) == any(n.start <= start <= n.end for n in sg)
+        for q in [random_transcript(rng, 70) for _ in range(5)] + transcripts:
+            ism = sg.get_intron_support_matrix(q)
+            for trid in range(len(transcripts)):
+                exp = [any(n.end == e1[1] and trid in n.suc and sg[n.suc[trid]].start == e2[0] for n in sg) for e1, e2 in zip(q[:-1], q[1:])]
+                assert ism[trid].tolist() == exp
+            esm = sg.get_exon_support_matrix(q)
+            for trid, tr in enumerate(transcripts):  # internal exons within a (non-terminal) exon of the transcript are supported
+                for e_nr, e in enumerate(q[1:-1]):
+                    if any(start <= e[0] and e[1] <= end for start, end in tr[:-1]):
+                        assert esm[trid, e_nr + 1]
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+def test_support_matrices(graph_type):
+    "introns and exons following a query exon that does not overlap the graph or ends within the same segment are supported"
+    sg = graph_type([[(2, 19), (21, 28)]], "+")
+    assert sg.get_intron_support_matrix([(2, 5), (12, 19), (21, 30)]).tolist() == [[False, True]]
+    sg = graph_type([[(15, 22), (23, 24)]], "+")
+    assert sg.get_exon_support_matrix([(1, 3), (4, 13), (17, 19), (20, 29)]).tolist() == [[False, False, True, True]]
+    sg = graph_type([[(10, 15)]], "+")
+    assert sg.get_exon_support_matrix([(3, 12), (17, 20), (26, 29)]).tolist() == [[True, False, False]]
+    assert sg.get_intron_support_matrix([(3, 12), (17, 20), (26, 29)]).tolist() == [[False, False]]
+
+
+@pytest.mark.parametrize("graph_type", [SegmentGraph, ArraySegmentGraph])
+def test_alternative_splicing_after_graph(graph_type):
+    "transcripts starting after the segment graph raise a ValueError"
+    sg = graph_type([[(0, 10), (20, 30)]], "+")
+    for exons in [(40, 50), (60, 70)], [(40, 50)]:
+        with pytest.raises(ValueError):
+            sg.get_alternative_splicing(exons)
@@ -0,0 +1,169 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from intervaltree import Interval, IntervalTree
+
+from isotools.splice_graph import SegmentGraph
+from isotools.transcriptome import Transcriptome
+from isotools._transcriptome_stats import (
+    EventMatrix,
+    betabinom_lr_test,
+    betabinom_lr_test_batch,
+    betabinom_ml,
+    betabinom_ml_batch,
+    loglike_betabinom,
+)
+
+
+def random_events(seed, n_events=300, group_sizes=(3, 4)):
+    "coverage of the alternative (x) and total coverage (n) with varying overdispersion, group differences and uncovered samples"
+    rng = np.random.default_rng(seed)
+    n = [rng.integers(0, 60, (n_events, s)) * (rng.random((n_events, s)) < 0.9) for s in group_sizes]
+    p = rng.beta(2, 3, n_events)
+    sd = rng.choice([0, 0.05, 0.2], (n_events, 1))
+    shift = rng.choice([0, 0.2], (n_events, 1))
+    x = [rng.binomial(ni, np.clip(p[:, None] + rng.normal(0, sd, ni.shape) + shift * i, 0, 1)) for i, ni in enumerate(n)]
+    return x, n
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_betabinom_ml_batch(seed):
+    "the batch fit reaches at least the likelihood of the individual fits"
+    x, n = random_events(seed)
+    x, n = np.concatenate(x, axis=1), np.concatenate(n, axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        a, b, success = betabinom_ml_batch(x, n)
+        for i, (xi, ni) in enumerate(zip(x, n)):
+            params, _, ok = betabinom_ml(xi, ni)
+            if params[0] is None:  # not covered
+                assert np.isnan(a[i]) and not success[i]
+            elif params[1] is None:  # binomial
+                assert a[i] == pytest.approx(params[0]) and np.isnan(b[i])
+            elif ok:
+                cov = ni > 0
+                assert loglike_betabinom((a[i], b[i]), xi[cov], ni[cov])[0] <= loglike_betabinom(params, xi[cov], ni[cov])[0] + 1e-6
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_betabinom_lr_test_batch(seed):
+    "the batch test reports the p-values of the individual tests, if the dispersion is well determined"
+    x, n = random_events(seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        pvals, params = betabinom_lr_test_batch(x, n)
+        for i in range(len(pvals)):
+            pval, params_i = betabinom_lr_test([xi[i] for xi in x], [ni[i] for ni in n])
+            assert len(params[i]) == len(params_i) == 6
+            assert np.isnan(pvals[i]) == np.isnan(pval)
+            # if the dispersion is close to 0, the likelihood is flat and the individual fits stop early
+            if all(disp is not None and disp > 1e-3 for disp in params_i[1::2]):
+                assert pvals[i] == pytest.approx(pval, rel=1e-3, abs=1e-6)
+                assert params[i] == pytest.approx(params_i, rel=1e-2, abs=1e-6)
+
+
+def test_betabinom_lr_test_uncovered_group():
+    "if a group is not covered, the test reports parameters for both groups and the total, to keep the columns of altsplice_test aligned"
+    pval, params = betabinom_lr_test([np.array([3, 5]), np.array([0, 0])], [np.array([10, 12]), np.array([0, 0])])
+    assert np.isnan(pval)
+    assert params == [None] * 6
+
+
+def synthetic_transcriptome(seed, n_samples):
+    "genes with skipped exons on two chromosomes, with random coverage"
+    rng = np.random.default_rng(seed)
+    t = Transcriptome(data={}, infos={"reference_file": "synthetic", "sample_table": pd.DataFrame({"name": [f"s{i}" for i in range(n_samples)]})})
+    for chrom in ("chr1", "chr2"):
+        novel = IntervalTree()
+        for start in range(0, 50000, 5000):
+            exons = [[start + 300 * i, start + 300 * i + 100] for i in range(6)]
+            for _ in range(4):
+                keep = [0] + [i for i in range(1, 5) if rng.random() < 0.7] + [5]
+                novel.add(Interval(start, start + 1600, {"exons": [exons[i] for i in keep], "strand": "+"}))
+        t._add_novel_genes(novel, chrom)
+    for g in t:
+        g.data["coverage"] = rng.poisson(rng.gamma(5, 4, (n_samples, g.n_transcripts)))
+    return t
+
+
+@pytest.mark.parametrize("test", ["betabinom_lr", "binom_lr", "proportions"])
+def test_altsplice_test_processes(test):
+    "the test in worker processes reports the same as the serial test"
+    t = synthetic_transcriptome(0, 7)
+    groups = {"A": ["s0", "s1", "s2"], "B": ["s3", "s4"], "C": ["s5", "s6"]}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        serial = t.altsplice_test(groups, min_total=10, min_n=2, test=test)
+        parallel = t.altsplice_test(groups, min_total=10, min_n=2, test=test, processes=2)
+    assert len(serial) > 0 and serial["pvalue"].notna().any()
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_precompute_splice_bubbles(monkeypatch):
+    "the bubbles searched in worker processes are cached in the main process, and passed to the workers of event_matrix"
+    expected = synthetic_transcriptome(2, 4).event_matrix()
+    t = synthetic_transcriptome(2, 4)
+    t.precompute_splice_bubbles(processes=2)
+    assert all("_bubbles" in g.segment_graph.__dict__ for g in t)
+
+    def search_again(*args):
+        raise AssertionError("splice bubbles searched again")
+
+    monkeypatch.setattr(SegmentGraph, "_find_splice_bubbles", search_again)
+    em = t.event_matrix(processes=2)
+    pd.testing.assert_frame_equal(em.events, expected.events)
+    for cov, expected_cov in zip(em.coverage(), expected.coverage()):
+        np.testing.assert_array_equal(cov, expected_cov)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_event_matrix(sparse, tmp_path):
+    "the tests and event tables of the event matrix are the same as the ones determined from the genes"
+    t = synthetic_transcriptome(1, 6)
+    em = t.event_matrix(sparse=sparse)
+    em.save(tmp_path / "events.pkl")
+    em = EventMatrix.load(tmp_path / "events.pkl")
+    assert len(em) == sum(len(list(g.segment_graph.find_splice_bubbles())) for g in t)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for groups in ({"A": ["s0", "s1", "s2"], "B": ["s3", "s4", "s5"]}, {"B": ["s5", "s1"], "A": ["s0", "s3"], "C": ["s4"]}):
+            for types in (None, "ES"):
+                expected = t.altsplice_test(groups, min_total=10, min_n=2, types=types)
+                pd.testing.assert_frame_equal(t.altsplice_test(groups, min_total=10, min_n=2, types=types, event_matrix=em), expected)
+    for samples in (None, ["s4", "s2"]):
+        expected = t.alternative_splicing_events(min_total=10, samples=samples)
+        pd.testing.assert_frame_equal(t.alternative_splicing_events(min_total=10, samples=samples, event_matrix=em), expected)
+    selected = em.select(em.events["splice_type"] == "ES")
+    in_cov, total_cov = selected.coverage(["s3"])
+    assert in_cov.shape == total_cov.shape == (len(selected), 1)
+    assert (in_cov <= total_cov).all()
+
+
+def test_event_matrix_fingerprint(tmp_path):
+    "the event matrix cannot be used after samples are added or transcripts are removed"
+    t = synthetic_transcriptome(1, 6)
+    em = t.event_matrix()
+    em.save(tmp_path / "events.pkl")
+    EventMatrix.load(tmp_path / "events.pkl")._check(t)
+    em.select(em.events["splice_type"] == "ES")._check(t)
+    groups = {"A": ["s0", "s1", "s2"], "B": ["s3", "s4", "s5"]}
+    t.infos["sample_table"] = pd.concat([t.sample_table, pd.DataFrame({"name": ["s6"]})], ignore_index=True)
+    for g in t:
+        g.data["coverage"] = np.vstack([g.coverage, np.zeros((1, g.n_transcripts), int)])
+    with pytest.raises(ValueError, match="samples"):
+        t.altsplice_test(groups, min_total=10, min_n=2, event_matrix=em)
+    with pytest.raises(ValueError, match="samples"):
+        t.alternative_splicing_events(min_total=10, event_matrix=em)
+    with pytest.raises(ValueError, match="samples"):
+        t.export_alternative_splicing(str(tmp_path), event_matrix=em)
+    t = synthetic_transcriptome(1, 6)
+    g = next(iter(t))
+    g.data["transcripts"] = g.transcripts[:-1]
+    g.data["coverage"] = g.coverage[:, :-1]
+    g.data.pop("segment_graph", None)
+    with pytest.raises(ValueError, match=f"e.g. {g.id}"):
+        t.altsplice_test(groups, min_total=10, min_n=2, event_matrix=em)
+    with pytest.raises(ValueError, match="transcripts"):
+        t.export_alternative_splicing(str(tmp_path), event_matrix=em)
@@ -0,0 +1,649 @@
+import os
+import random
+import tempfile
+from collections import Counter
+from functools import partial
+
+import numpy as np
+import pysam
+import pytest
+from intervaltree import Interval, IntervalTree
+
+from isotools import _transcriptome_io
+from isotools.gene import Gene
+from isotools.splice_graph import SegmentGraph
+from isotools.transcriptome import Transcriptome
+from isotools._transcriptome_io import IntervalArray
+from isotools._utils import intron_chain, is_same_gene, splice_identical
+
+CHROMOSOMES = {"chr1": 60000, "chr2": 40000}
+# gene id, chromosome, strand and exons of the reference transcripts
+REFERENCE = [
+    ("G1", "chr1", "+", [[(1000, 1200), (2000, 2200), (3000, 3300)], [(1000, 1200), (3000, 3300)]]),
+    ("G2", "chr1", "-", [[(10000, 10300), (11000, 11100), (12000, 12400)]]),
+    ("G3", "chr1", "+", [[(20000, 20500), (21000, 21200), (22000, 22100), (23000, 23600)]]),
+    ("G4", "chr2", "+", [[(5000, 5400), (6000, 6200), (7000, 7500)], [(5000, 5400), (6500, 6700), (7000, 7500)]]),
+    ("G5", "chr2", "-", [[(15000, 15800)]]),
+]
+# expressed transcripts that are not in the reference: skipped exon of G3, novel multi and mono exon genes
+NOVEL = [
+    ("chr1", "+", [(20000, 20500), (22000, 22100), (23000, 23600)]),
+    ("chr1", "-", [(40000, 40300), (41000, 41500)]),
+    ("chr2", "+", [(30000, 30800)]),
+]
+
+
+def reference_transcriptome():
+    "a transcriptome with the reference genes"
+    data = {}
+    for gene_id, chrom, strand, transcripts in REFERENCE:
+        info = {"ID": gene_id, "name": gene_id, "chr": chrom, "strand": strand}
+        info["reference"] = {"transcripts": [{"transcript_id": f"{gene_id}.{i + 1}", "exons": exons} for i, exons in enumerate(transcripts)]}
+        start, end = min(tr[0][0] for tr in transcripts), max(tr[-1][1] for tr in transcripts)
+        data.setdefault(chrom, IntervalTree()).add(Gene(start, end, info, None))
+    t = Transcriptome(data=data, infos={"reference_file": "synthetic"})
+    for g in t:
+        g._transcriptome = t
+    return t
+
+
+def alignment(name, chrom, strand, exons, clip=(0, 0), flag=0):
+    "an alignment of the exons, with soft clipped bases at the start and end"
+    cigartuples = [(4, clip[0])] if clip[0] else []
+    for i, (start, end) in enumerate(exons):
+        if i:
+            cigartuples.append((3, start - exons[i - 1][1]))
+        cigartuples.append((0, end - start))
+    if clip[1]:
+        cigartuples.append((4, clip[1]))
+    return {"name": name, "chrom": chrom, "pos": exons[0][0], "flag": flag | (0x10 if strand == "-" else 0), "cigar": cigartuples, "tags": {}}
+
+
+def split_alignment(name, parts):
+    "primary and supplementary alignments of a read, with SA tags, from (chrom, strand, exons) of the parts"
+    lengths = [sum(end - start for start, end in exons) for _, _, exons in parts]
+    aligns = [
+        alignment(name, chrom, strand, exons, (sum(lengths[:i]), sum(lengths[i + 1:])), 0x800 if i else 0)
+        for i, (chrom, strand, exons) in enumerate(parts)
+    ]
+    for i, align in enumerate(aligns):
+        align["tags"]["SA"] = "".join(
+            f'{other["chrom"]},{other["pos"] + 1},{strand},{cigar_string(other["cigar"])},60,0;'
+            for j, (other, (_, strand, _)) in enumerate(zip(aligns, parts))
+            if j != i
+        )
+    return aligns
+
+
+def cigar_string(cigartuples):
+    return "".join(f"{n}{'MIDNSHP=X'[op]}" for op, n in cigartuples)
+
+
+def simulate_reads(seed, samples):
+    """alignments of the reference and novel transcripts with varying ends and clipping, and of a shifted junction,
+    of chimeric reads, of a long intron split in two parts, and secondary and unmapped alignments, for each sample.
+
+    :return: dict with the list of alignments for each sample"""
+    rng = random.Random(seed)
+    reads = {}
+    transcripts = [(chrom, strand, exons) for _, chrom, strand, trs in REFERENCE for exons in trs]
+    n_ref = len(transcripts)
+    for sa in samples:
+        sa_reads = reads[sa] = []
+        for n, (chrom, strand, exons) in enumerate(transcripts + NOVEL):
+            for i in range(rng.randint(2, 6)):
+                exons_i = [list(e) for e in exons]
+                if n < n_ref:  # reads of reference transcripts have varying ends
+                    exons_i[0][0] += rng.randint(0, 50)
+                    exons_i[-1][1] -= rng.randint(0, 50)
+                clip = rng.choice((0, 0, 20)), rng.choice((0, 0, 40))
+                sa_reads.append(alignment(f"{sa}_{n}_{i}", chrom, strand, exons_i, clip))
+        # junctions shifted by a few bases, starting after the reads of the reference transcript
+        sa_reads.append(alignment(f"{sa}_fuzzy", "chr1", "+", [[1100, 1202], [2002, 2200], [3000, 3280]]))
+        for i in range(rng.randint(2, 3)):
+            start = 1000 + rng.randint(0, 50)
+            parts = [("chr1", "+", [[start, 1200], [2000, 2200]]), ("chr2", "+", [[6000, 6200], [7000, 7500]])]
+            sa_reads.extend(split_alignment(f"{sa}_chimeric_{i}", parts))
+        parts = [("chr1", "+", [[20000, 20500]]), ("chr1", "+", [[21000, 21200], [22000, 22100], [23000, 23600]])]
+        sa_reads.extend(split_alignment(f"{sa}_long_intron", parts))
+        sa_reads.append(alignment(f"{sa}_secondary", "chr1", "+", [[1000, 1200], [2000, 2200]], flag=0x100))
+        sa_reads.append(alignment(f"{sa}_unmapped", "chr1", "+", [[2000, 2200]], flag=0x4))
+    return reads
+
+
+def write_bam(fn, reads, tag=None, sort=True):
+    """writes the alignments of the samples to fn, and indexes the file if it is sorted.
+
+    :param reads: Dict with lists of alignments for each sample.
+    :param tag: If provided, the sample names are added as this tag to the alignments (and as read groups for the "RG" tag).
+    :param sort: If False, the alignments are written sample by sample, in the order of the lists."""
+    header = {"HD": {"VN": "1.6", "SO": "coordinate" if sort else "unsorted"}, "SQ": [{"SN": chrom, "LN": chr_len} for chrom, chr_len in CHROMOSOMES.items()]}
+    if tag == "RG":
+        header["RG"] = [{"ID": sa} for sa in reads]
+    aligns = [(sa, align) for sa, sa_reads in reads.items() for align in sa_reads]
+    if sort:
+        aligns.sort(key=lambda item: (list(CHROMOSOMES).index(item[1]["chrom"]), item[1]["pos"]))
+    with pysam.AlignmentFile(str(fn), "wb", header=header) as out:
+        for sa, align in aligns:
+            read = pysam.AlignedSegment(out.header)
+            read.query_name = align["name"]
+            read.flag = align["flag"]
+            read.reference_name = align["chrom"]
+            read.reference_start = align["pos"]
+            read.mapping_quality = 60
+            read.cigartuples = align["cigar"]
+            read.query_sequence = "A" * sum(n for op, n in align["cigar"] if op in (0, 1, 4))
+            tags = dict(align["tags"])
+            if tag is not None:
+                tags[tag] = sa
+            read.set_tags(list(tags.items()))
+            out.write(read)
+    if sort:
+        pysam.index(str(fn))
+    return str(fn)
+
+
+def transcriptome_state(t):
+    "genes and chimeric transcripts of t and the sample table, independent of the order of the transcripts"
+    genes = {}
+    for g in t:
+        transcripts = {tuple(tuple(e) for e in tr["exons"]): plain(tr) for tr in g.transcripts}
+        assert len(transcripts) == g.n_transcripts
+        genes[(g.chrom, g.strand, g.id)] = transcripts
+    sample_table = t.sample_table.drop(columns="file").to_dict("records")
+    return genes, plain(t.chimeric), sample_table
+
+
+def plain(obj):
+    "converts numpy arrays in nested containers to lists, for comparison"
+    if isinstance(obj, dict):
+        return {k: plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(plain(v) for v in obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return obj
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_add_sample_from_bam_processes(tmp_path, seed):
+    "the import with worker processes gives the same result as the serial import"
+    reads = simulate_reads(seed, ["s1"])
+    fn = write_bam(tmp_path / "s1.bam", reads)
+    serial = reference_transcriptome()
+    serial.add_sample_from_bam(fn, "s1")
+    parallel = reference_transcriptome()
+    parallel.add_sample_from_bam(fn, "s1", processes=2)
+    assert transcriptome_state(parallel) == transcriptome_state(serial)
+    genes, chimeric, _ = transcriptome_state(serial)
+    assert sum(len(trs) for trs in genes.values()) > sum(len(trs) for *_, trs in REFERENCE)
+    assert chimeric
+
+
+def test_add_sample_from_bam_genes(tmp_path):
+    "transcripts are assigned to the gene of the reference transcript with the same intron chain, and found by find_splice_identical"
+    reads = simulate_reads(0, ["s1"])
+    t = reference_transcriptome()
+    t.add_sample_from_bam(write_bam(tmp_path / "s1.bam", reads), "s1")
+    expected = {intron_chain(exons): gene_id for gene_id, _, _, transcripts in REFERENCE for exons in transcripts if len(exons) > 1}
+    expected[intron_chain(NOVEL[0][2])] = "G3"
+    for g in t:
+        for i, tr in enumerate(g.transcripts):
+            if len(tr["exons"]) > 1 and g.is_annotated:
+                assert expected.pop(intron_chain(tr["exons"])) == g.id
+            elif len(tr["exons"]) > 1:
+                assert intron_chain(tr["exons"]) == intron_chain(NOVEL[1][2]) and g.strand == "-"
+            assert g.find_splice_identical(tr["exons"]) == i
+            shifted = [list(e) for e in tr["exons"]]  # other transcript start and end
+            shifted[0][0] += 1
+            shifted[-1][1] -= 1
+            assert g.find_splice_identical(shifted) == i
+            # the index gives the same result as comparing to all transcripts
+            assert i == next(j for j, other in enumerate(g.transcripts) if splice_identical(other["exons"], tr["exons"]))
+    assert not expected
+    assert sum(not g.is_annotated for g in t) == 2
+
+
+@pytest.mark.parametrize("tag", ["RG", "BC"])
+def test_add_samples_from_bam(tmp_path, tag):
+    "the multiplexed import gives the same result as importing the samples one by one"
+    samples = ["s1", "s2", "s3"]
+    reads = simulate_reads(0, samples)
+    serial = reference_transcriptome()
+    for sa in samples:
+        serial.add_sample_from_bam(write_bam(tmp_path / f"{sa}.bam", {sa: reads[sa]}), sa)
+    multiplexed = reference_transcriptome()
+    # the read groups are taken from the header, other tag values need to be listed to define the order of the samples
+    sample_names = None if tag == "RG" else samples
+    multiplexed.add_samples_from_bam(write_bam(tmp_path / "all.bam", reads, tag=tag), sample_tag=tag, sample_names=sample_names)
+    assert transcriptome_state(multiplexed) == transcriptome_state(serial)
+    renamed = reference_transcriptome()
+    renamed.add_samples_from_bam(write_bam(tmp_path / "all.bam", reads, tag=tag), sample_tag=tag, sample_names={"s1": "a", "s3": "c"})
+    assert renamed.samples == ["a", "c"]
+
+
+def test_add_sample_from_bam_clipping(tmp_path):
+    "with clipping=True, the clipped position and length of the reads is stored for each transcript and sample"
+    samples = ["s1", "s2"]
+    reads = simulate_reads(0, samples)
+    fn = write_bam(tmp_path / "all.bam", reads, tag="RG")
+    t = reference_transcriptome()
+    t.add_samples_from_bam(fn, clipping=True)
+    for sa in samples:
+        expected = Counter()
+        for align in reads[sa]:
+            cigar = align["cigar"]
+            if "SA" in align["tags"] or align["flag"] & 0x104:  # not imported as transcript
+                continue
+            if cigar[0][0] == 4:
+                expected[(align["pos"], -cigar[0][1])] += 1
+            elif cigar[-1][0] == 4:
+                expected[(align["pos"] + sum(n for op, n in cigar if op in (0, 3)), cigar[-1][1])] += 1
+        clipping = Counter()
+        for g in t:
+            for tr in g.transcripts:
+                clipping.update(tr.get("clipping", {}).get(sa, {}))
+        assert clipping == expected and expected
+    # clipping is merged when transcripts of the samples are combined
+    serial = reference_transcriptome()
+    for sa in samples:
+        serial.add_sample_from_bam(write_bam(tmp_path / f"{sa}.bam", {sa: reads[sa]}), sa, clipping=True)
+    assert transcriptome_state(serial)[0] == transcriptome_state(t)[0]
+    # without clipping, the transcripts are the same, but have no clipping information
+    t_noclip = reference_transcriptome()
+    t_noclip.add_samples_from_bam(fn)
+    genes = transcriptome_state(t)[0]
+    for transcripts in genes.values():
+        for tr in transcripts.values():
+            tr.pop("clipping", None)
+    assert transcriptome_state(t_noclip)[0] == genes
+
+
+def test_add_sample_from_bam_coverage(tmp_path):
+    "the coverage matrices of genes without new transcripts are extended by the new samples"
+    t = reference_transcriptome()
+    t.add_sample_from_bam(write_bam(tmp_path / "s1.bam", simulate_reads(0, ["s1"])), "s1")
+    for g in t:
+        assert g.coverage.shape == (1, g.n_transcripts)
+    t.add_sample_from_bam(write_bam(tmp_path / "s2.bam", simulate_reads(1, ["s2"])), "s2")
+    kept = 0
+    for g in t:
+        kept += g.data["coverage"] is not None  # no new transcripts
+        expected = np.array([[tr["coverage"].get(sa, 0) for tr in g.transcripts] for sa in t.samples])
+        assert (g.coverage == expected).all()
+    assert kept
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_add_samples_from_bams(tmp_path, processes):
+    "the concurrent import of several bam files gives the same result as importing the files one by one"
+    samples = ["s1", "s2", "s3"]
+    reads = simulate_reads(1, samples)
+    fns = {sa: write_bam(tmp_path / f"{sa}.bam", {sa: reads[sa]}) for sa in samples}
+    serial = reference_transcriptome()
+    for sa, fn in fns.items():
+        serial.add_sample_from_bam(fn, sa, group="A" if sa == "s1" else "B")
+    merged = reference_transcriptome()
+    merged.add_samples_from_bams(fns, processes=processes, group={"s1": "A", "s2": "B", "s3": "B"})
+    assert transcriptome_state(merged) == transcriptome_state(serial)
+    assert list(merged.sample_table.file) == list(fns.values())
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_add_sample_from_bam_threads(tmp_path, processes):
+    "decompression threads do not change the result, with sample tags, secondary and unmapped alignments"
+    samples = ["s1", "s2"]
+    reads = simulate_reads(2, samples)
+    fn = write_bam(tmp_path / "multiplexed.bam", reads, tag="BC")
+    expected = reference_transcriptome()
+    expected.add_samples_from_bam(fn, sample_tag="BC", sample_names=samples)
+    threaded = reference_transcriptome()
+    threaded.add_samples_from_bam(fn, sample_tag="BC", sample_names=samples, processes=processes, threads=2)
+    assert transcriptome_state(threaded) == transcriptome_state(expected)
+    fns = {sa: write_bam(tmp_path / f"{sa}.bam", {sa: reads[sa]}) for sa in samples}
+    merged = reference_transcriptome()
+    merged.add_samples_from_bams(fns, processes=processes, threads=2)
+    assert transcriptome_state(merged)[:2] == transcriptome_state(expected)[:2]
+
+
+def chimeric_state(t):
+    "chimeric transcripts of t without the aligned positions, which depend on the read processed first"
+    return {bp: [[cov, [part[:3] + part[4:] for part in parts]] for cov, parts in chim_list] for bp, chim_list in plain(t.chimeric).items()}
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_add_samples_from_bam_chimeric_buffer(tmp_path, monkeypatch, processes):
+    "chimeric parts written to temporary files give the same transcripts as the import in memory, and the files are removed"
+    samples = ["s1", "s2", "s3"]
+    reads = simulate_reads(3, samples)
+    fn = write_bam(tmp_path / "multiplexed.bam", reads, tag="RG")
+    in_memory = reference_transcriptome()
+    in_memory.add_samples_from_bam(fn, processes=processes)
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_dir))
+    written = []
+    spill = _transcriptome_io._SpilledGroups._spill
+
+    def count_and_spill(groups):
+        written.append(groups.n_values)
+        spill(groups)
+
+    monkeypatch.setattr(_transcriptome_io._SpilledGroups, "_spill", count_and_spill)
+    for chimeric_buffer in 1, 3:
+        spilled = reference_transcriptome()
+        spilled.add_samples_from_bam(fn, processes=processes, chimeric_buffer=chimeric_buffer)
+        genes, _, sample_table = transcriptome_state(spilled)
+        assert (genes, sample_table) == transcriptome_state(in_memory)[::2]
+        assert chimeric_state(spilled) == chimeric_state(in_memory)
+        assert list(temp_dir.iterdir()) == []
+    if processes == 1:  # the worker processes do not report to this process
+        assert written
+    assert in_memory.chimeric
+
+
+def chimeric_read(cov, parts):
+    "a chimeric read with its breakpoints, from (chrom, strand, exons) of the parts in read order"
+    aligned, chim_parts = 0, []
+    for chrom, strand, exons in parts:
+        length = sum(end - start for start, end in exons)
+        chim_parts.append([chrom, strand, [list(e) for e in exons], (aligned, aligned + length), None])
+        aligned += length
+    return _transcriptome_io._breakpoints(chim_parts), [cov, chim_parts]
+
+
+def test_chimeric_index(tmp_path):
+    "the chimeric transcripts are merged by breakpoints and intron chains, as by pairwise comparison with splice_identical"
+    reads = simulate_reads(4, ["s1", "s2"])
+    t = reference_transcriptome()
+    t.add_samples_from_bam(write_bam(tmp_path / "multiplexed.bam", reads, tag="RG"))
+    bp_index = t._breakpoint_index()  # built before the next chimeric transcripts are added
+    first = ("chr1", "+", [[1000, 1200], [2000, 2200]])
+    new_chimeric = [
+        chimeric_read(3, [first, ("chr2", "+", [[6000, 6200], [7000, 7600]])]),  # same intron chains, extended end
+        chimeric_read(2, [first, ("chr2", "+", [[6000, 6200], [6500, 6700], [7000, 7500]])]),  # novel intron chain
+        chimeric_read(2, [("chr1", "+", [[1500, 2200]]), ("chr2", "+", [[6000, 6200], [7000, 7500]])]),  # mono exon part
+        chimeric_read(2, [("chr1", "-", [[10000, 10300], [11000, 11100]]), ("chr2", "-", [[15000, 15800]])]),  # new breakpoint
+    ]
+    bp = new_chimeric[0][0]
+    assert len(t.chimeric[bp]) == 1
+    cov = dict(t.chimeric[bp][0][0])
+    for new_bp, new_chim in new_chimeric:
+        t._add_chimeric([(new_bp, [new_chim])], 2, "s2")
+    assert len(t.chimeric[bp]) == 3
+    assert t.chimeric[bp][0][0] == {"s1": cov["s1"], "s2": cov["s2"] + 3}
+    assert t.chimeric[bp][0][1][1][2][-1][1] == 7600
+    for chim_list in t.chimeric.values():
+        for i, chim1 in enumerate(chim_list):
+            for chim2 in chim_list[:i]:
+                assert not all(splice_identical(p1[2], p2[2]) for p1, p2 in zip(chim1[1], chim2[1]))
+    # the indices maintained during the import equal the rebuilt indices
+    chim_index = t._chimeric_index()
+    assert len(chim_index) == sum(len(chim_list) for chim_list in t.chimeric.values())
+    del t._chim_idx, t._bp_idx
+    assert {key: id(chim) for key, chim in chim_index.items()} == {key: id(chim) for key, chim in t._chimeric_index().items()}
+    assert {chrom: sorted(tree) for chrom, tree in bp_index.items()} == {chrom: sorted(tree) for chrom, tree in t._breakpoint_index().items()}
+    # chimeric_table reports the transcripts with a breakpoint in the region
+    for region, (chrom, start, end) in [
+        ("chr1", ("chr1", 0, CHROMOSOMES["chr1"])),
+        ("chr2:5900-6100", ("chr2", 5900, 6100)),
+        (("chr2", 14000, 15000), ("chr2", 14000, 15000)),
+        ("chr1:5000-9000", ("chr1", 5000, 9000)),
+    ]:
+        expected = set()
+        for bp in t.chimeric:
+            if any(c == chrom and start <= pos < end for bp_i in bp for c, pos in (bp_i[0:3:2], bp_i[3:6:2])):
+                expected.update(bp)
+        table = t.chimeric_table(region=region)
+        assert set(zip(table.chr1, table.strand1, table.breakpoint1, table.chr2, table.strand2, table.breakpoint2)) == expected
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    "reads the alignments in chunks of 5, and counts how often the streaming import writes collapsers to temporary files"
+    written = []
+    monkeypatch.setattr(_transcriptome_io, "_read_chunks", partial(_transcriptome_io._read_chunks, chunk_size=5))
+    close = _transcriptome_io._CollapserStore.close
+
+    def count_and_close(store):
+        written.append(store.n_written)
+        files = list(store.files.values())
+        close(store)
+        assert not any(os.path.exists(fn) for fn in files)
+
+    monkeypatch.setattr(_transcriptome_io._CollapserStore, "close", count_and_close)
+    return written
+
+
+def test_add_sample_from_bam_stream(tmp_path, small_chunks):
+    "the streaming import of a sorted file gives the same result as the indexed import, also when collapsers are written to files"
+    reads = simulate_reads(0, ["s1"])
+    fn = write_bam(tmp_path / "s1.bam", reads)
+    indexed = reference_transcriptome()
+    indexed.add_sample_from_bam(fn, "s1")
+    for stream_buffer, n_written in (None, 0), (1000, 0), (1, 1):
+        streamed = reference_transcriptome()
+        streamed.add_sample_from_bam(fn, "s1", stream=True, stream_buffer=stream_buffer)
+        assert transcriptome_state(streamed) == transcriptome_state(indexed)
+        # for sorted files, each chromosome is written at most once, when the next one starts
+        assert small_chunks.pop() == n_written
+
+
+def test_add_sample_from_bam_stream_unsorted(tmp_path, small_chunks):
+    "chromosomes of unsorted files are written to files only when they do not fit in the buffer"
+    reads = simulate_reads(0, ["s1"])
+    fn = write_bam(tmp_path / "s1.bam", reads, sort=False)
+    in_memory = reference_transcriptome()
+    in_memory.add_sample_from_bam(fn, "s1", stream=True)
+    assert small_chunks.pop() == 0
+    for stream_buffer in 1000, 10, 1:
+        streamed = reference_transcriptome()
+        streamed.add_sample_from_bam(fn, "s1", stream=True, stream_buffer=stream_buffer)
+        assert transcriptome_state(streamed) == transcriptome_state(in_memory)
+        n_written = small_chunks.pop()
+        if stream_buffer == 1000:
+            assert n_written == 0
+        else:
+            assert 0 < n_written <= len(reads["s1"]) / 5
+
+
+def test_add_sample_from_bam_altsplice_cache(tmp_path, monkeypatch):
+    "the novelty classification from the cache of the reference segment graphs equals the computed classification"
+    reads = simulate_reads(5, ["s1", "s2"])
+    # mono-exon fragments within the same exon share the cache entry
+    reads["s2"] += [alignment(f"s2_fragment_{i}", "chr1", "+", exons) for i, exons in enumerate([[[20050, 20200]], [[20300, 20450]]])]
+    fns = {sa: write_bam(tmp_path / f"{sa}.bam", {sa: reads[sa]}) for sa in reads}
+    cached = reference_transcriptome()
+    for sa, fn in fns.items():
+        cached.add_sample_from_bam(fn, sa)
+    assert sum(g.ref_segment_graph.altsplice_cache_info()["hits"] for g in cached if g.is_annotated) > 0
+    monkeypatch.setattr(SegmentGraph, "get_alternative_splicing", SegmentGraph._get_alternative_splicing)
+    computed = reference_transcriptome()
+    for sa, fn in fns.items():
+        computed.add_sample_from_bam(fn, sa)
+    assert transcriptome_state(cached) == transcriptome_state(computed)
+
+
+def segment_graph_state(sg):
+    "the nodes with their links and the transcript start/end nodes of a segment graph"
+    return [(n.start, n.end, list(n.pre.items()), list(n.suc.items())) for n in sg], sg._tss, sg._pas
+
+
+@pytest.mark.parametrize("backend", ["dict", "array"])
+def test_segment_graph_in_place(tmp_path, backend):
+    """the segment graphs updated while adding and removing samples equal the segment graphs built from the transcripts.
+    The array based segment graphs are constructed again."""
+    samples = ["s1", "s2", "s3"]
+    reads = simulate_reads(6, samples)
+    # novel isoforms of G1 and G4, and a transcript extending G2, in one sample each
+    new_transcripts = [
+        ("s2", "chr1", "+", [[1000, 1200], [2500, 2600], [3000, 3300]]),
+        ("s2", "chr1", "-", [[9800, 10300], [11000, 11100], [12000, 12600]]),
+        ("s3", "chr2", "+", [[5000, 5400], [6000, 6200], [6500, 6700], [7000, 7500]]),
+    ]
+    for i, (sa, chrom, strand, exons) in enumerate(new_transcripts):
+        reads[sa] += [alignment(f"{sa}_new_{i}_{j}", chrom, strand, exons) for j in range(2)]
+    # reads that move the start and end of the G3 transcript
+    reads["s3"] += [alignment(f"s3_ends_{j}", "chr1", "+", [[19900, 20500], [21000, 21200], [22000, 22100], [23000, 23700]]) for j in range(20)]
+    t = reference_transcriptome()
+    t.set_segment_graph_backend(backend)
+    in_place = Counter()
+
+    def check():
+        for g in t:
+            segment_graph = g.data.get("segment_graph")
+            if g.data.get("segment_graph_modified"):
+                in_place["modified"] += 1
+            if segment_graph is not None and (g.data.get("segment_graph_modified") or segment_graph.n_transcripts < g.n_transcripts):
+                in_place[g.segment_graph is segment_graph] += 1
+            assert segment_graph_state(g.segment_graph) == segment_graph_state(SegmentGraph([tr["exons"] for tr in g.transcripts], g.strand))
+
+    for sa in samples:
+        t.add_sample_from_bam(write_bam(tmp_path / f"{sa}.bam", {sa: reads[sa]}), sa)
+        check()
+    t.remove_samples(["s2"])
+    check()
+    assert in_place["modified"]
+    assert in_place[True] if backend == "dict" else in_place[False] and not in_place[True]
+    assert all(g.data["segment_graph"] is not None for g in t if g.transcripts)
+
+
+def random_exons(rng, n_max=4):
+    "random exons on a coarse grid, such that exon boundaries of different transcripts coincide"
+    n = rng.randint(1, n_max)
+    pos = sorted(rng.sample(range(0, 400, 10), 2 * n))
+    return [[pos[2 * j], pos[2 * j + 1]] for j in range(n)]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_find_splice_sites_reference_hash(seed):
+    "the reference splice sites looked up in the hash select the same genes as the segment graphs, including start and end sites"
+    rng = random.Random(seed)
+    for _ in range(200):
+        strand = rng.choice("+-")
+        genes = []
+        for i in range(rng.randint(1, 5)):
+            transcripts = [{"exons": random_exons(rng)} for _ in range(rng.randint(1, 3))]
+            info = {"ID": f"G{i}", "name": f"G{i}", "chr": "chr1", "strand": strand}
+            if rng.random() < 0.7:
+                info["reference"] = {"transcripts": transcripts}
+            else:
+                info["transcripts"] = transcripts
+            start, end = min(tr["exons"][0][0] for tr in transcripts), max(tr["exons"][-1][1] for tr in transcripts)
+            genes.append(Gene(start, end, info, None))
+        t = Transcriptome(data={"chr1": IntervalTree(genes)}, infos={"reference_file": "synthetic"})
+        ref_sites = t._reference_splice_sites("chr1")
+        for _ in range(5):
+            exons = random_exons(rng)
+            expected = _transcriptome_io._find_splice_sites(genes, exons)
+            found = _transcriptome_io._find_splice_sites(genes, exons, ref_sites)
+            assert found[0] is expected[0]
+            assert plain(found[2:]) == plain(expected[2:])
+            if found[1] is not None:
+                assert found[1] == expected[1]
+
+
+def test_add_sample_from_bam_gene_index(tmp_path):
+    "new genes, and novel genes that grow by the transcripts of a new sample, are found by id, name and alias"
+    t = reference_transcriptome()
+    t.add_sample_from_bam(write_bam(tmp_path / "s1.bam", simulate_reads(0, ["s1"])), "s1")
+    novel = next(g for g in t if g.chrom == "chr1" and not g.is_annotated)
+    extended = [alignment(f"extended_{i}", "chr1", "-", [[39000, 39500], [40000, 40300], [41000, 41500]]) for i in range(2)]
+    t.add_sample_from_bam(write_bam(tmp_path / "s2.bam", {"s2": extended}), "s2")
+    assert t[novel.id].start == 39000 and t[novel.id].n_transcripts == 2
+    for g in t:
+        assert t[g.id] is g and t[g.name] is g
+        if not g.is_annotated:
+            assert t[g.data["alias"]] is g
+    idx = {key: id(g) for key, g in t._idx.items()}
+    t.make_index()
+    assert idx == {key: id(g) for key, g in t._idx.items()}
+
+
+def test_add_samples_from_collapsed(tmp_path):
+    "the collapsed reads saved by the import give the same result as the import from bam, also for another reference"
+    reads = simulate_reads(2, ["s1", "s2"])
+    fn = write_bam(tmp_path / "all.bam", reads, tag="RG")
+    collapsed_file = str(tmp_path / "collapsed.npz")
+    imported = reference_transcriptome()
+    imported.add_samples_from_bam(fn, clipping=True, collapsed_file=collapsed_file)
+    restored = reference_transcriptome()
+    restored.add_samples_from_collapsed(collapsed_file)
+    assert transcriptome_state(restored) == transcriptome_state(imported)
+    assert list(restored.sample_table.file) == [fn, fn]
+    # a reference without G3: the transcripts of G3 are assigned to novel genes
+    other, other_restored = reference_transcriptome(), reference_transcriptome()
+    for t in other, other_restored:
+        t.data["chr1"].remove(t["G3"])
+        t.make_index()
+    other.add_samples_from_bam(fn, clipping=True)
+    other_restored.add_samples_from_collapsed(collapsed_file)
+    assert transcriptome_state(other_restored) == transcriptome_state(other)
+    assert any(not g.is_annotated and g.start <= 20050 and g.strand == "+" for g in other_restored.data["chr1"])
+    renamed = reference_transcriptome()
+    renamed.add_samples_from_collapsed(collapsed_file, sample_names={"s1": "a"}, group={"a": "A", "s2": "B"})
+    assert renamed.samples == ["a", "s2"] and list(renamed.sample_table.group) == ["A", "B"]
+    assert all("s1" not in tr["coverage"] for g in renamed for tr in g.transcripts)
+
+
+def random_novel(rng, n, chr_len):
+    "random mono and multi exon transcripts, in a few dense clusters"
+    transcripts = []
+    for i in range(n):
+        start = rng.choice((0, 100000, 200000)) + rng.randint(0, 20000)
+        if i % 3:
+            exons = [[start, start + rng.randint(100, 2000)]]
+        else:
+            end1 = start + rng.randint(100, 500)
+            start2 = end1 + rng.randint(200, 3000)
+            exons = [[start, end1], [start2, start2 + rng.randint(100, 500)]]
+        transcripts.append({"exons": exons, "strand": rng.choice("+-")})
+    return transcripts
+
+
+def merge_sets(novel, spj_iou_th=0, reg_iou_th=0.5):
+    "the grouping of previous versions, by merging sets of transcripts"
+    idx = {id(tr): i for i, tr in enumerate(novel)}
+    merge = list()
+    for i, tr in enumerate(novel):
+        merge.append({tr})
+        candidates = [
+            c
+            for c in novel.overlap(tr.begin, tr.end)
+            if c.data["strand"] == tr.data["strand"] and idx[id(c)] < i
+        ]
+        for c in candidates:
+            if c in merge[i]:
+                continue
+            if is_same_gene(tr.data["exons"], c.data["exons"], spj_iou_th, reg_iou_th):
+                merge[i].update(merge[idx[id(c)]])
+        for c in merge[i]:
+            merge[idx[id(c)]] = merge[i]
+    return {frozenset(id(tr.data) for tr in trS) for trS in merge}
+
+
+@pytest.mark.parametrize("container", [IntervalArray, IntervalTree])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_add_novel_genes_grouping(container, seed):
+    rng = random.Random(seed)
+    chr_len = 300000
+    transcripts = random_novel(rng, 600, chr_len)
+
+    def make_novel():
+        novel = IntervalArray(chr_len) if container is IntervalArray else IntervalTree()
+        for tr in transcripts:
+            novel.add(Interval(tr["exons"][0][0], tr["exons"][-1][1], tr))
+        return novel
+
+    expected = merge_sets(make_novel())
+    t = Transcriptome(data={}, infos={"reference_file": "synthetic"})
+    t._add_novel_genes(make_novel(), "chr1")
+    genes = list(t.data["chr1"])
+    assert {frozenset(id(tr) for tr in g.transcripts) for g in genes} == expected
+    assert sum(g.n_transcripts for g in genes) == len(transcripts)
+    for g in genes:
+        assert g.start == min(tr["exons"][0][0] for tr in g.transcripts)
+        assert g.end == max(tr["exons"][-1][1] for tr in g.transcripts)
+        assert all(tr["strand"] == g.strand for tr in g.transcripts)
+    assert len({g.id for g in genes}) == len(genes)
+    assert t.novel_genes == len(genes)
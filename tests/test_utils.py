@@ -0,0 +1,59 @@
+import random
+
+import numpy as np
+import pytest
+
+from isotools._utils import junctions_from_cigar, junctions_from_cigar_batch
+
+
+def random_cigar(rng):
+    "random cigar tuples, including insertions within introns and adjacent junctions, which produce zero length exons"
+    cigar = [(0, rng.randint(1, 50))]
+    for _ in range(rng.randint(0, 6)):
+        op = rng.choice((0, 1, 2, 3, 3, 4, 7, 8))
+        cigar.append((op, rng.randint(1, 100)))
+    if rng.random() < 0.2:
+        cigar.append((3, rng.randint(1, 100)))  # junction at the end
+    return cigar
+
+
+def batch_to_lists(starts, ends, exon_idx):
+    return [
+        [[int(s), int(e)] for s, e in zip(starts[i:j], ends[i:j])]
+        for i, j in zip(exon_idx[:-1], exon_idx[1:])
+    ]
+
+
+@pytest.mark.parametrize(
+    "cigar",
+    [
+        [(0, 10)],
+        [(0, 10), (3, 100), (0, 10)],
+        [(0, 10), (3, 100), (1, 10), (3, 100), (0, 10)],  # zero length exon from insertion within intron
+        [(0, 10), (3, 100), (3, 50), (0, 10)],  # adjacent junctions
+        [(4, 5), (0, 10), (3, 100), (0, 10), (4, 5)],  # soft clipping
+        [(0, 10), (2, 5), (0, 10), (3, 20), (7, 3), (8, 1)],
+        [(0, 10), (3, 100)],  # junction at the end
+    ],
+)
+def test_junctions_from_cigar_batch_cases(cigar):
+    offset = 1000
+    starts, ends, exon_idx = junctions_from_cigar_batch([cigar], [offset])
+    assert batch_to_lists(starts, ends, exon_idx) == [junctions_from_cigar(cigar, offset)]
+
+
+def test_junctions_from_cigar_batch_random():
+    rng = random.Random(42)
+    cigars = [random_cigar(rng) for _ in range(5000)]
+    offsets = [rng.randint(0, 10 ** 6) for _ in cigars]
+    starts, ends, exon_idx = junctions_from_cigar_batch(cigars, offsets)
+    assert len(exon_idx) == len(cigars) + 1
+    assert batch_to_lists(starts, ends, exon_idx) == [
+        junctions_from_cigar(c, o) for c, o in zip(cigars, offsets)
+    ]
+
+
+def test_junctions_from_cigar_batch_empty():
+    starts, ends, exon_idx = junctions_from_cigar_batch([], [])
+    assert len(starts) == len(ends) == 0
+    assert np.array_equal(exon_idx, [0])